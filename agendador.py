@@ -0,0 +1,182 @@
+import heapq
+import itertools
+import math
+import queue
+import threading
+import time
+from collections import deque
+from config import *
+
+
+class Temporizador:
+    # timer agendado; cancelar() só marca, e o agendador descarta quando o prazo chega
+    def __init__(self, prazo, funcao, args, intervalo=None):
+        self.prazo = prazo
+        self.funcao = funcao
+        self.args = args
+        self.intervalo = intervalo
+        self.cancelado = False
+
+    def cancelar(self):
+        self.cancelado = True
+
+
+class Agendador:
+    # um único thread dorme até o próximo prazo de um heap de timers e entrega os
+    # callbacks a um pool pequeno de trabalhadores; substitui os threads que
+    # dormiam em laço, um por tarefa periódica, votação, eleição ou rodada.
+    # tarefas que bloqueiam (executar) vão para um segundo pool, para que um
+    # heartbeat nunca espere atrás de uma eleição ou de uma rodada de Berkeley
+    def __init__(self, trabalhadores=TRABALHADORES_AGENDADOR, resolucao=RESOLUCAO_AGENDADOR,
+                 trabalhadores_fundo=TRABALHADORES_FUNDO_AGENDADOR):
+        self.resolucao = resolucao
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.trabalhadores = trabalhadores
+        # pool próprio com threads daemon: uma tarefa presa numa espera não segura a saída do processo
+        self._tarefas = queue.SimpleQueue()
+        self.trabalhadores_fundo = trabalhadores_fundo
+        self._fundo = queue.SimpleQueue()
+        self._rodando = False
+        # atraso entre o prazo e o início do callback (jitter) e quantas vezes o laço acordou
+        self._atrasos = deque(maxlen=AMOSTRAS_JITTER_AGENDADOR)
+        self._lock_medidas = threading.Lock()
+        self.disparos = 0
+        self.despertares = 0
+        self.atraso_maximo = 0.0
+
+    def iniciar(self):
+        self._rodando = True
+        threading.Thread(target=self._laco, daemon=True, name="no-agendador").start()
+        for i in range(self.trabalhadores):
+            threading.Thread(target=self._trabalhar, args=(self._tarefas,), daemon=True, name=f"no-timer-{i}").start()
+        for i in range(self.trabalhadores_fundo):
+            threading.Thread(target=self._trabalhar, args=(self._fundo,), daemon=True, name=f"no-fundo-{i}").start()
+
+    def parar(self):
+        with self._cond:
+            if not self._rodando:
+                return
+            self._rodando = False
+            self._cond.notify()
+        for _ in range(self.trabalhadores):
+            self._tarefas.put(None)
+        for _ in range(self.trabalhadores_fundo):
+            self._fundo.put(None)
+
+    def _trabalhar(self, fila):
+        while True:
+            tarefa = fila.get()
+            if tarefa is None:
+                return
+            funcao, args = tarefa
+            funcao(*args)
+
+    def _inserir(self, timer):
+        # o prazo é arredondado para cima na grade da resolução: timers que vencem
+        # na mesma fatia disparam juntos num só despertar, e nunca antes da hora
+        fatia = math.ceil(timer.prazo / self.resolucao) * self.resolucao
+        with self._cond:
+            heapq.heappush(self._heap, (fatia, next(self._seq), timer))
+            # só acorda o laço se o timer novo vence antes do que ele já espera
+            if self._heap[0][2] is timer:
+                self._cond.notify()
+
+    def agendar(self, atraso, funcao, *args):
+        timer = Temporizador(time.monotonic() + atraso, funcao, args)
+        self._inserir(timer)
+        return timer
+
+    def periodico(self, intervalo, funcao, *args, imediato=False):
+        # taxa fixa: o próximo prazo conta do anterior, então timers com o mesmo
+        # intervalo continuam alinhados e disparam no mesmo despertar
+        timer = Temporizador(time.monotonic() + (0.0 if imediato else intervalo), funcao, args, intervalo)
+        self._inserir(timer)
+        return timer
+
+    def executar(self, funcao, *args):
+        # roda já, no pool de tarefas bloqueantes, fora dos trabalhadores dos timers
+        self._fundo.put((self._chamar, (funcao, args)))
+
+    def ao_concluir(self, futuro, timeout, funcao, condicao=None):
+        # chama funcao(atingiu) uma única vez: quando a condição do futuro
+        # (correlacao.Futuro) valer ou quando o prazo acabar, o que vier primeiro
+        lock = threading.Lock()
+        feito = []
+
+        def concluir(atingiu):
+            with lock:
+                if feito:
+                    return
+                feito.append(True)
+            timer.cancelar()
+            self.executar(funcao, atingiu)
+
+        def verificar():
+            if futuro.satisfeito(condicao):
+                concluir(True)
+
+        timer = self.agendar(timeout, lambda: concluir(futuro.satisfeito(condicao)))
+        futuro.ao_resolver(verificar)
+        verificar()
+        return timer
+
+    def _chamar(self, funcao, args):
+        try:
+            funcao(*args)
+        except Exception as e:
+            if self._rodando:
+                print(f"[ERROR] erro em {getattr(funcao, '__name__', funcao)}: {e}")
+
+    def _disparar(self, timer, prazo):
+        with self._lock_medidas:
+            atraso = time.monotonic() - prazo
+            self.disparos += 1
+            self._atrasos.append(atraso)
+            self.atraso_maximo = max(self.atraso_maximo, atraso)
+        if timer.cancelado:
+            return
+        self._chamar(timer.funcao, timer.args)
+        if timer.intervalo is not None and not timer.cancelado:
+            # reagenda só depois de terminar: um callback lento não roda sobreposto
+            timer.prazo = max(prazo + timer.intervalo, time.monotonic())
+            self._inserir(timer)
+
+    def _laco(self):
+        while True:
+            vencidos = []
+            with self._cond:
+                while self._rodando:
+                    agora = time.monotonic()
+                    while self._heap and self._heap[0][0] <= agora:
+                        _, _, timer = heapq.heappop(self._heap)
+                        if not timer.cancelado:
+                            vencidos.append((timer, timer.prazo))
+                    if vencidos:
+                        break
+                    self._cond.wait(self._heap[0][0] - agora if self._heap else None)
+                    self.despertares += 1
+                if not self._rodando:
+                    return
+            for timer, prazo in vencidos:
+                self._tarefas.put((self._disparar, (timer, prazo)))
+
+    def estatisticas(self):
+        with self._lock_medidas:
+            atrasos = sorted(self._atrasos)
+            disparos = self.disparos
+            maximo = self.atraso_maximo
+        with self._cond:
+            pendentes = sum(1 for _, _, timer in self._heap if not timer.cancelado)
+        if not atrasos:
+            return {"disparos": disparos, "despertares": self.despertares, "pendentes": pendentes}
+        return {
+            "disparos": disparos,
+            "despertares": self.despertares,
+            "pendentes": pendentes,
+            "jitter_medio": sum(atrasos) / len(atrasos),
+            "jitter_p50": atrasos[len(atrasos) // 2],
+            "jitter_p99": atrasos[min(len(atrasos) - 1, int(len(atrasos) * 0.99))],
+            "jitter_max": maximo,
+        }
@@ -0,0 +1,457 @@
+import os
+import json
+import mmap
+import shutil
+import struct
+import bisect
+import tempfile
+from array import array
+from collections import OrderedDict
+from threading import Lock
+from config import *
+from codec import comprimir, descomprimir
+from mensagem import chave_item
+
+# cada registro do log é um tamanho (uint32) seguido do item em JSON
+REGISTRO = struct.Struct(">I")
+# entrada do índice: lamport, origem_id, offset dos dados no .log, tamanho
+ENTRADA_INDICE = struct.Struct(">qqQI")
+SEM_ORIGEM = -1
+
+MANIFESTO = "manifesto.json"
+
+
+def _nome_segmento(numero):
+    return f"seg-{numero:06d}"
+
+
+def _nome_snapshot(numero):
+    return f"snap-{numero:06d}"
+
+
+def _origem(item):
+    origem_id = item.get("origem_id")
+    return SEM_ORIGEM if origem_id is None else int(origem_id)
+
+
+class IndiceMapeado:
+    # índice de um segmento acessado via mmap, sem carregar nada em memória
+    def __init__(self, caminho):
+        self._arquivo = open(caminho, "rb")
+        tamanho = os.fstat(self._arquivo.fileno()).st_size
+        self.n = tamanho // ENTRADA_INDICE.size
+        self._mapa = None
+        if self.n:
+            self._mapa = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.n
+
+    def entrada(self, i):
+        return ENTRADA_INDICE.unpack_from(self._mapa, i * ENTRADA_INDICE.size)
+
+    def fechar(self):
+        if self._mapa is not None:
+            self._mapa.close()
+        self._arquivo.close()
+
+
+class LogHistorico:
+    # log de histórico só de acréscimo: segmentos .log escritos em lote e
+    # relidos em sequência na entrada, e snapshots ordenados (.log com índice
+    # .idx mapeado) que permitem apagar os segmentos antigos
+    def __init__(self, diretorio, tamanho_lote=TAMANHO_LOTE_LOG,
+                 tamanho_segmento=TAMANHO_SEGMENTO_LOG, limite_compactacao=LIMITE_COMPACTACAO_LOG):
+        self.diretorio = diretorio
+        self.tamanho_lote = tamanho_lote
+        self.tamanho_segmento = tamanho_segmento
+        self.limite_compactacao = limite_compactacao
+        os.makedirs(diretorio, exist_ok=True)
+
+        self.manifesto = self._ler_manifesto()
+        self.lock = Lock()
+        self._pendente = []
+        self._log = None
+        self._offset = 0
+        # nunca reabre o último segmento (pode ter ficado truncado): começa outro
+        self._segmento = max(self._segmentos(), default=self.manifesto["ate"]) + 1
+        self.desde_snapshot = 0
+
+    def _caminho(self, nome, extensao):
+        return os.path.join(self.diretorio, nome + extensao)
+
+    def _ler_manifesto(self):
+        try:
+            with open(os.path.join(self.diretorio, MANIFESTO), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"snapshot": None, "ate": 0}
+
+    def _gravar_manifesto(self, manifesto):
+        caminho = os.path.join(self.diretorio, MANIFESTO)
+        with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifesto, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(caminho + ".tmp", caminho)
+        self.manifesto = manifesto
+
+    def _segmentos(self):
+        numeros = []
+        for nome in os.listdir(self.diretorio):
+            if nome.startswith("seg-") and nome.endswith(".log"):
+                try:
+                    numeros.append(int(nome[4:-4]))
+                except ValueError:
+                    pass
+        return sorted(numeros)
+
+    def _abrir_segmento(self):
+        if self._log is None:
+            nome = _nome_segmento(self._segmento)
+            self._log = open(self._caminho(nome, ".log"), "ab")
+            self._offset = self._log.tell()
+
+    def _fechar_segmento(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def anexar(self, itens):
+        with self.lock:
+            self._pendente.extend(itens)
+            if len(self._pendente) >= self.tamanho_lote:
+                self._descarregar()
+
+    def descarregar(self):
+        with self.lock:
+            self._descarregar()
+
+    def _descarregar(self):
+        if not self._pendente:
+            return
+        self._abrir_segmento()
+        blocos = []
+        offset = self._offset
+        for item in self._pendente:
+            dados = json.dumps(item, separators=(",", ":")).encode("utf-8")
+            blocos.append(REGISTRO.pack(len(dados)))
+            blocos.append(dados)
+            offset += REGISTRO.size + len(dados)
+        # um write por lote
+        self._log.write(b"".join(blocos))
+        self._log.flush()
+        if FSYNC_LOG:
+            os.fsync(self._log.fileno())
+        self._offset = offset
+        self.desde_snapshot += len(self._pendente)
+        self._pendente = []
+        if self._offset >= self.tamanho_segmento:
+            self._fechar_segmento()
+            self._segmento += 1
+
+    def rotacionar(self):
+        # fecha o segmento atual; devolve o último número coberto por um snapshot
+        with self.lock:
+            self._descarregar()
+            ate = self._segmento
+            self._fechar_segmento()
+            self._segmento += 1
+            self.desde_snapshot = 0
+            return ate
+
+    def precisa_compactar(self):
+        return self.desde_snapshot >= self.limite_compactacao
+
+    def compactar(self, itens, ate, frios=None):
+        # grava os itens (já ordenados) como snapshot e apaga o que ele cobre; com
+        # frios (descritores do ArquivoFrio), o snapshot é só a janela quente e o
+        # manifesto aponta os segmentos frios, que passam a fazer parte do log
+        nome = _nome_snapshot(ate)
+        log_tmp = self._caminho(nome, ".log.tmp")
+        idx_tmp = self._caminho(nome, ".idx.tmp")
+        blocos = []
+        entradas = []
+        offset = 0
+        for item in itens:
+            dados = json.dumps(item, separators=(",", ":")).encode("utf-8")
+            blocos.append(REGISTRO.pack(len(dados)))
+            blocos.append(dados)
+            entradas.append(ENTRADA_INDICE.pack(item["lamport"], _origem(item),
+                                                offset + REGISTRO.size, len(dados)))
+            offset += REGISTRO.size + len(dados)
+        for caminho, conteudo in ((log_tmp, blocos), (idx_tmp, entradas)):
+            with open(caminho, "wb") as f:
+                f.write(b"".join(conteudo))
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(log_tmp, self._caminho(nome, ".log"))
+        os.replace(idx_tmp, self._caminho(nome, ".idx"))
+
+        anterior = self.manifesto.get("snapshot")
+        manifesto = {"snapshot": nome, "ate": ate}
+        if frios is not None:
+            manifesto["frios"] = frios
+        self._gravar_manifesto(manifesto)
+        for numero in self._segmentos():
+            if numero <= ate:
+                self._remover(_nome_segmento(numero))
+        if anterior and anterior != nome:
+            self._remover(anterior)
+
+    def _remover(self, nome):
+        for extensao in (".log", ".idx"):
+            try:
+                os.remove(self._caminho(nome, extensao))
+            except OSError:
+                pass
+
+    def _ler_sequencial(self, nome):
+        try:
+            with open(self._caminho(nome, ".log"), "rb") as f:
+                dados = f.read()
+        except OSError:
+            return []
+        itens = []
+        pos = 0
+        while pos + REGISTRO.size <= len(dados):
+            (tamanho,) = REGISTRO.unpack_from(dados, pos)
+            fim = pos + REGISTRO.size + tamanho
+            # registro cortado por uma queda no meio da escrita: para aqui
+            if fim > len(dados):
+                break
+            try:
+                itens.append(json.loads(dados[pos + REGISTRO.size:fim]))
+            except ValueError:
+                break
+            pos = fim
+        return itens
+
+    def _ler_snapshot(self):
+        nome = self.manifesto.get("snapshot")
+        if not nome:
+            return []
+        try:
+            indice = IndiceMapeado(self._caminho(nome, ".idx"))
+        except OSError:
+            return []
+        itens = []
+        try:
+            if not len(indice):
+                return []
+            with open(self._caminho(nome, ".log"), "rb") as f:
+                mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for i in range(len(indice)):
+                        _, _, offset, tamanho = indice.entrada(i)
+                        itens.append(json.loads(mapa[offset:offset + tamanho]))
+                finally:
+                    mapa.close()
+        finally:
+            indice.fechar()
+        return itens
+
+    def frios(self):
+        # descritores dos segmentos frios cobertos pelo último snapshot
+        return self.manifesto.get("frios", [])
+
+    def carregar(self):
+        # snapshot ordenado + replay só dos segmentos escritos depois dele
+        itens = self._ler_snapshot()
+        ate = self.manifesto["ate"]
+        for numero in self._segmentos():
+            if numero > ate:
+                itens.extend(self._ler_sequencial(_nome_segmento(numero)))
+        return itens
+
+    def fechar(self):
+        with self.lock:
+            self._descarregar()
+            self._fechar_segmento()
+
+
+class ArquivoFrio:
+    # segmentos frios do histórico em memória: o que sai da janela quente do
+    # HistoricoCompacto vai para arquivos de JSON comprimido (zlib com o dicionário
+    # do codec), e em memória fica só um descritor por segmento (faixa de chaves e,
+    # por origem, quantidade e menor/maior lamport). As leituras voltam do disco
+    # sob demanda, com os últimos segmentos lidos num cache. Num diretório fixo os
+    # segmentos sobrevivem ao processo: o snapshot do LogHistorico guarda só a
+    # janela quente e o manifesto dele lista os descritores, restaurados na entrada
+    def __init__(self, diretorio=DIRETORIO_FRIO, cache=SEGMENTOS_FRIOS_EM_CACHE):
+        self.diretorio = diretorio
+        # sem diretório configurado, um temporário criado no primeiro despejo e apagado ao fechar
+        self.temporario = diretorio is None
+        self._apagar_ao_fechar = False
+        self._preparado = False
+        # segmentos até este número já passaram por fsync
+        self._sincronizado_ate = -1
+        self.cache = cache
+        self.segmentos = []
+        self.mensagens = 0
+        self.bytes = 0
+        self.ultima_chave = -1
+        self.paginacoes = 0
+        # número do segmento -> [itens, chaves (montadas só quando o contem precisa)], em ordem de uso
+        self._paginas = OrderedDict()
+        # protege o cache: o envio de histórico lê segmentos sem o lock do histórico
+        self.lock = Lock()
+        self._proximo = 0
+
+    def _caminho(self, numero):
+        return os.path.join(self.diretorio, f"frio-{numero:06d}.z")
+
+    def _preparar(self):
+        # o diretório só é criado no primeiro despejo (ou na restauração); segmentos
+        # que nenhum manifesto aponta são sobras de outra execução e são apagados
+        self._preparado = True
+        if self.temporario:
+            self.diretorio = tempfile.mkdtemp(prefix="chat-frio-")
+            self._apagar_ao_fechar = True
+            return
+        os.makedirs(self.diretorio, exist_ok=True)
+        numeros = {segmento["numero"] for segmento in self.segmentos}
+        for nome in os.listdir(self.diretorio):
+            if nome.startswith("frio-") and nome.endswith(".z") and nome[5:-2].isdigit() \
+                    and int(nome[5:-2]) not in numeros:
+                os.remove(os.path.join(self.diretorio, nome))
+
+    def restaurar(self, descritores):
+        # volta aos segmentos que o manifesto do log aponta, sem ler nenhum deles
+        if self.temporario:
+            return
+        for descritor in descritores:
+            if not os.path.exists(self._caminho(descritor["numero"])):
+                print(f"[WARN] segmento frio {descritor['numero']} sumiu de {self.diretorio}")
+                continue
+            por_origem = {origem: [quantidade, menor, maior]
+                          for origem, quantidade, menor, maior in descritor["por_origem"]}
+            self.segmentos.append(dict(descritor, por_origem=por_origem))
+            self.mensagens += descritor["quantidade"]
+            self.bytes += descritor["bytes"]
+            self.ultima_chave = max(self.ultima_chave, descritor["ultima"])
+        self._proximo = max((segmento["numero"] for segmento in self.segmentos), default=-1) + 1
+        self._sincronizado_ate = self._proximo - 1
+        self._preparar()
+
+    def descritores(self):
+        # descritores em JSON para o manifesto (as chaves de por_origem podem ser None)
+        return [dict(segmento, por_origem=[[origem] + resumo for origem, resumo in segmento["por_origem"].items()])
+                for segmento in self.segmentos]
+
+    def sincronizar(self, descritores):
+        # fsync dos segmentos novos antes de o manifesto apontá-los; os arquivos
+        # não mudam depois de gravados, então pode rodar fora do lock do histórico
+        ate = self._sincronizado_ate
+        for descritor in descritores:
+            if descritor["numero"] > ate:
+                with open(self._caminho(descritor["numero"]), "ab") as f:
+                    os.fsync(f.fileno())
+                self._sincronizado_ate = max(self._sincronizado_ate, descritor["numero"])
+
+    def escrever(self, itens):
+        # grava um segmento (itens já ordenados pela chave, como saem do começo das
+        # colunas) e devolve o descritor sem contá-lo ainda: roda fora do lock do
+        # histórico, um despejo por vez, e registrar() o publica sob o lock
+        if not self._preparado:
+            self._preparar()
+        numero = self._proximo
+        self._proximo += 1
+        dados = comprimir(json.dumps(itens, separators=(",", ":")).encode("utf-8"))
+        with open(self._caminho(numero), "wb") as f:
+            f.write(dados)
+        por_origem = {}
+        for item in itens:
+            lamport = item["lamport"]
+            resumo = por_origem.get(item["origem_id"])
+            if resumo is None:
+                por_origem[item["origem_id"]] = [1, lamport, lamport]
+            else:
+                resumo[0] += 1
+                resumo[2] = lamport
+        return {"numero": numero, "primeira": chave_item(itens[0]), "ultima": chave_item(itens[-1]),
+                "quantidade": len(itens), "bytes": len(dados), "por_origem": por_origem}
+
+    def registrar(self, descritor):
+        self.segmentos.append(descritor)
+        self.mensagens += descritor["quantidade"]
+        self.bytes += descritor["bytes"]
+        self.ultima_chave = max(self.ultima_chave, descritor["ultima"])
+
+    def _ler(self, numero):
+        with open(self._caminho(numero), "rb") as f:
+            itens = json.loads(descomprimir(f.read()))
+        with self.lock:
+            self.paginacoes += 1
+        return itens
+
+    def _paginar(self, segmento):
+        numero = segmento["numero"]
+        with self.lock:
+            pagina = self._paginas.get(numero)
+            if pagina is not None:
+                self._paginas.move_to_end(numero)
+                return pagina
+        pagina = [self._ler(numero), None]
+        with self.lock:
+            self._paginas[numero] = pagina
+            while len(self._paginas) > self.cache:
+                self._paginas.popitem(last=False)
+        return pagina
+
+    def contem(self, chave):
+        # segmentos podem se sobrepor (mensagem atrasada despejada depois), então confere todos na faixa
+        for segmento in self.segmentos:
+            if segmento["primeira"] <= chave <= segmento["ultima"]:
+                pagina = self._paginar(segmento)
+                if pagina[1] is None:
+                    pagina[1] = array("q", map(chave_item, pagina[0]))
+                chaves = pagina[1]
+                i = bisect.bisect_left(chaves, chave)
+                if i < len(chaves) and chaves[i] == chave:
+                    return True
+        return False
+
+    def contar_ate(self, marcas):
+        # {origem: lamport} -> quantos itens frios da origem têm lamport até a marca;
+        # só lê do disco os segmentos em que a marca cai no meio da faixa da origem
+        contagens = dict.fromkeys(marcas, 0)
+        for segmento in self.segmentos:
+            parciais = {}
+            for origem, maior in marcas.items():
+                resumo = segmento["por_origem"].get(origem)
+                if resumo is None or resumo[1] > maior:
+                    continue
+                if resumo[2] <= maior:
+                    contagens[origem] += resumo[0]
+                else:
+                    parciais[origem] = maior
+            if parciais:
+                itens, _ = self._paginar(segmento)
+                for item in itens:
+                    maior = parciais.get(item["origem_id"])
+                    if maior is not None and item["lamport"] <= maior:
+                        contagens[item["origem_id"]] += 1
+        return contagens
+
+    def percorrer(self, desde, segmentos):
+        # {origem: lamport ou None} -> por segmento, os itens frios da origem depois
+        # do lamport (None: todos). Lê direto do disco, um segmento por vez e sem
+        # passar pelo cache, então uma sincronização inteira não expulsa as páginas úteis
+        for segmento in segmentos:
+            por_origem = segmento["por_origem"]
+            if not any(origem in por_origem and (minimo is None or por_origem[origem][2] > minimo)
+                       for origem, minimo in desde.items()):
+                continue
+            yield [item for item in self._ler(segmento["numero"])
+                   if item["origem_id"] in desde and (desde[item["origem_id"]] is None
+                                                      or item["lamport"] > desde[item["origem_id"]])]
+
+    def estatisticas(self):
+        return {"segmentos": len(self.segmentos), "mensagens": self.mensagens, "bytes": self.bytes,
+                "paginacoes": self.paginacoes}
+
+    def fechar(self):
+        self._paginas.clear()
+        if self._apagar_ao_fechar:
+            shutil.rmtree(self.diretorio, ignore_errors=True)
@@ -0,0 +1,352 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+import time
+from config import *
+from no import No
+from processos import ProcessoNo, TIMEOUT_SAIDA
+
+# suíte de benchmarks em loopback (Linux): sobe n nós no.py sem REPL e mede o
+# espalhamento de chat (vazão e latência ponta a ponta), a entrada de um nó novo
+# conforme o histórico cresce, a rodada Berkeley e o failover depois que o
+# coordenador morre. Um nó gerador roda dentro deste processo e manda os chats;
+# cada linha impressa pelos nós é carimbada com o relógio deste processo na
+# leitura, então as latências incluem o atraso do pipe de saída (~0,1 ms).
+# O resultado vai para um JSON que pode ser comparado com o de outra versão
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+NOME_GERADOR = "BENCH"
+TIMEOUT_ENTRADA = 15.0
+# chats do gerador como aparecem na saída dos nós: "[hh:mm:ss] BENCH: c12"
+PADRAO_CHAT = re.compile(rf"\] {NOME_GERADOR}: ([a-z])(\d+)\b")
+PADRAO_RODADA = re.compile(r"Rodada em ([\d.]+) ms: (\d+)/(\d+) respostas, (\d+) descartadas, média ([-+\d.]+)s")
+
+
+class Saidas:
+    # todas as linhas dos processos, na ordem de leitura, com o instante em que chegaram
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._linhas = []
+        # (nome, prefixo, k) -> instante da primeira entrega do chat do gerador
+        self.entregas = {}
+        self._contagem = {}
+
+    def registrar(self, nome, linha):
+        t = time.perf_counter()
+        with self._cond:
+            self._linhas.append((t, nome, linha))
+            for prefixo, k in PADRAO_CHAT.findall(linha):
+                chave = (nome, prefixo, int(k))
+                if chave not in self.entregas:
+                    self.entregas[chave] = t
+                    self._contagem[prefixo] = self._contagem.get(prefixo, 0) + 1
+            self._cond.notify_all()
+
+    def posicao(self):
+        with self._cond:
+            return len(self._linhas)
+
+    def esperar(self, nome, trecho, timeout, desde=0):
+        # primeira linha do nó (ou de qualquer um, com nome None) que contém o trecho
+        limite = time.perf_counter() + timeout
+        i = desde
+        with self._cond:
+            while True:
+                while i < len(self._linhas):
+                    t, quem, linha = self._linhas[i]
+                    i += 1
+                    if (nome is None or quem == nome) and trecho in linha:
+                        return t, linha
+                resta = limite - time.perf_counter()
+                if resta <= 0:
+                    raise TimeoutError(f"{nome or 'nenhum nó'} não imprimiu '{trecho}'")
+                self._cond.wait(resta)
+
+    def esperar_entrega(self, nome, prefixo, k, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: (nome, prefixo, k) in self.entregas, timeout)
+
+    def esperar_contagem(self, prefixo, alvo, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._contagem.get(prefixo, 0) >= alvo, timeout)
+
+    def linhas(self, desde=0):
+        with self._cond:
+            return self._linhas[desde:]
+
+
+class Gerador(No):
+    # o gerador roda aqui dentro e seus logs não passam por Saidas: guarda o
+    # instante em que ele começou uma eleição para a detecção do failover
+    inicio_eleicao = None
+
+    def iniciar_eleicao(self):
+        if self.inicio_eleicao is None:
+            self.inicio_eleicao = time.perf_counter()
+        super().iniciar_eleicao()
+
+
+def percentis(valores):
+    if not valores:
+        return None
+    valores = sorted(valores)
+
+    def p(q):
+        return round(valores[min(len(valores) - 1, int(len(valores) * q))] * 1000, 3)
+    return {"media": round(sum(valores) / len(valores) * 1000, 3), "p50": p(0.5), "p90": p(0.9),
+            "p99": p(0.99), "max": round(valores[-1] * 1000, 3)}
+
+
+def enviar_chats(gerador, prefixo, inicio_k, quantidade, taxa):
+    # com taxa 0 manda em rajada; devolve o instante de envio de cada chat
+    envios = {}
+    inicio = time.perf_counter()
+    for i in range(quantidade):
+        if taxa:
+            atraso = inicio + i / taxa - time.perf_counter()
+            if atraso > 0:
+                time.sleep(atraso)
+        k = inicio_k + i
+        envios[k] = time.perf_counter()
+        gerador.enviar_chat(f"{prefixo}{k}")
+    return envios
+
+
+def medir_chat(gerador, saidas, nomes, args):
+    envios = enviar_chats(gerador, "c", 0, args.mensagens, args.taxa)
+    esperadas = args.mensagens * len(nomes)
+    saidas.esperar_contagem("c", esperadas, args.timeout)
+    entregas = {(nome, k): t for (nome, prefixo, k), t in list(saidas.entregas.items()) if prefixo == "c"}
+    resultado = {"mensagens": args.mensagens, "receptores": len(nomes), "esperadas": esperadas,
+                 "entregues": len(entregas)}
+    if entregas:
+        inicio = min(envios.values())
+        duracao = max(entregas.values()) - inicio
+        resultado["duracao_s"] = round(duracao, 3)
+        resultado["entregas_por_s"] = round(len(entregas) / duracao) if duracao > 0 else None
+        resultado["latencia_ms"] = percentis([t - envios[k] for (_, k), t in entregas.items()])
+    return resultado
+
+
+def medir_entrada(gerador, saidas, coordenador, args):
+    # para cada tamanho, completa o histórico com chats do gerador e cronometra a entrada de um nó novo
+    resultados = []
+    enviados = 0
+    for j, tamanho in enumerate(sorted(args.historicos)):
+        faltam = tamanho - len(gerador.historico)
+        if faltam > 0:
+            enviar_chats(gerador, "h", enviados, faltam, args.taxa)
+            enviados += faltam
+            # o coordenador precisa ter o histórico inteiro antes do JOIN
+            saidas.esperar_entrega(coordenador, "h", enviados - 1, args.timeout)
+        nome = f"J{j + 1}"
+        desde = saidas.posicao()
+        novo = ProcessoNo(args.porta_base + 100 + j, nome, saidas.registrar, "--eleicao", args.eleicao)
+        try:
+            t_join, _ = saidas.esperar(nome, "enviando JOIN", TIMEOUT_ENTRADA, desde)
+            t_id, _ = saidas.esperar(nome, "Recebi ID", TIMEOUT_ENTRADA, desde)
+            saidas.esperar(nome, "entrou com id", TIMEOUT_ENTRADA, desde)
+            resultados.append({"historico": len(gerador.historico),
+                               "entrada_s": round(t_id - t_join, 4),
+                               "com_inicializacao_s": round(t_id - novo.inicio, 4)})
+        except TimeoutError:
+            resultados.append({"historico": len(gerador.historico), "entrada_s": None})
+        finally:
+            desde = saidas.posicao()
+            novo.encerrar()
+            # espera o coordenador tirar o nó da lista, para não pesar nas etapas seguintes
+            try:
+                saidas.esperar(coordenador, f"{nome} saiu do chat", TIMEOUT_SAIDA, desde)
+            except TimeoutError:
+                pass
+    return resultados
+
+
+def medir_berkeley(saidas, coordenador, args):
+    desde = saidas.posicao()
+    rodadas = []
+    for _ in range(args.rodadas_berkeley):
+        try:
+            _, linha = saidas.esperar(coordenador, "[TEMPO] Rodada em", args.intervalo_berkeley * 2 + args.timeout,
+                                      desde)
+        except TimeoutError:
+            break
+        desde = saidas.posicao()
+        m = PADRAO_RODADA.search(linha)
+        if m:
+            rodadas.append({"duracao_ms": float(m.group(1)), "respostas": int(m.group(2)),
+                            "consultados": int(m.group(3)), "descartadas": int(m.group(4)),
+                            "media_s": float(m.group(5))})
+    duracoes = [r["duracao_ms"] / 1000 for r in rodadas]
+    return {"intervalo_s": args.intervalo_berkeley, "rodadas": rodadas, "duracao_ms": percentis(duracoes)}
+
+
+def medir_failover(gerador, saidas, processos, args):
+    # mata o coordenador sem GOODBYE; o maior id vivo é o último seguidor a entrar
+    coordenador, seguidores = processos[0], processos[1:]
+    vencedor = seguidores[-1].nome
+    desde = saidas.posicao()
+    gerador.inicio_eleicao = None
+    inicio = time.perf_counter()
+    coordenador.matar()
+    pendentes = {p.nome for p in seguidores}
+    convergiu = {}
+    limite = inicio + args.timeout
+    i = desde
+    while (pendentes or NOME_GERADOR not in convergiu) and time.perf_counter() < limite:
+        for t, quem, linha in saidas.linhas(i):
+            i += 1
+            reconheceu = (f"Novo coordenador: {vencedor} " in linha
+                          or (quem == vencedor and "anunciado como coordenador" in linha))
+            if quem in pendentes and reconheceu:
+                pendentes.discard(quem)
+                convergiu[quem] = t - inicio
+        if NOME_GERADOR not in convergiu and gerador.coordenador_nome == vencedor:
+            convergiu[NOME_GERADOR] = time.perf_counter() - inicio
+        time.sleep(0.005)
+    alertas = [t for t, _, linha in saidas.linhas(desde) if "[ALERTA]" in linha]
+    # o gerador também vigia o coordenador e pode ser o primeiro a suspeitar
+    if gerador.inicio_eleicao is not None:
+        alertas.append(gerador.inicio_eleicao)
+    completo = not pendentes and NOME_GERADOR in convergiu
+    return {
+        "eleicao": args.eleicao,
+        "vencedor": vencedor,
+        "convergiu": completo,
+        "deteccao_s": round(min(alertas) - inicio, 3) if alertas else None,
+        "convergencia_s": round(max(convergiu.values()), 3) if completo else None,
+    }
+
+
+def versao():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIRETORIO, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def executar(args, saida):
+    saidas = Saidas()
+    processos = []
+    gerador = None
+    resultado = {"versao": versao(), "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "plataforma": platform.platform(),
+                 "parametros": vars(args)}
+    try:
+        # relógios espalhados em torno de zero para a rodada Berkeley ter o que corrigir
+        def desvio(i):
+            return f"{args.desvio * ((i - 1) / max(1, args.nos - 1) - 0.5):.3f}"
+
+        coordenador = ProcessoNo(args.porta_base + 1, "N1", saidas.registrar, "--eleicao", args.eleicao,
+                                 "--intervalo-berkeley", str(args.intervalo_berkeley),
+                                 "--desvio-relogio", desvio(1))
+        processos.append(coordenador)
+        saidas.esperar("N1", "criado como coordenador inicial", TIMEOUT_ENTRADA)
+        # o gerador entra logo depois do coordenador: fica com o id 2 e nunca vence a eleição
+        gerador = Gerador(args.porta_base, nome=NOME_GERADOR, eleicao=args.eleicao)
+        gerador.iniciar_servicos()
+        gerador.entrar_na_rede()
+        if gerador.id is None or gerador.eh_coordenador:
+            raise RuntimeError("o gerador não conseguiu entrar na rede")
+        for i in range(2, args.nos + 1):
+            nome = f"N{i}"
+            processos.append(ProcessoNo(args.porta_base + i, nome, saidas.registrar, "--eleicao", args.eleicao,
+                                        "--desvio-relogio", desvio(i)))
+            saidas.esperar(nome, "Recebi ID", TIMEOUT_ENTRADA)
+        # deixa heartbeats, detector de falhas e listas de peers assentarem
+        time.sleep(args.estabilizar)
+
+        nomes = [p.nome for p in processos]
+        if "chat" in args.etapas:
+            resultado["chat"] = medir_chat(gerador, saidas, nomes, args)
+            print(f"[chat] {resultado['chat']}", file=saida)
+        if "entrada" in args.etapas:
+            resultado["entrada"] = medir_entrada(gerador, saidas, "N1", args)
+            print(f"[entrada] {resultado['entrada']}", file=saida)
+        if "berkeley" in args.etapas:
+            resultado["berkeley"] = medir_berkeley(saidas, "N1", args)
+            print(f"[berkeley] {resultado['berkeley']['duracao_ms']}", file=saida)
+        if "failover" in args.etapas:
+            resultado["failover"] = medir_failover(gerador, saidas, processos, args)
+            print(f"[failover] {resultado['failover']}", file=saida)
+    finally:
+        if gerador is not None:
+            gerador.rodando = False
+            gerador._parar_servicos()
+        for p in processos:
+            p.matar()
+    return resultado
+
+
+def numeros(dados, prefixo=""):
+    # achata o JSON em caminho -> valor numérico, para comparar duas execuções
+    if isinstance(dados, dict):
+        for chave, valor in dados.items():
+            if chave not in ("parametros", "rodadas"):
+                yield from numeros(valor, f"{prefixo}{chave}.")
+    elif isinstance(dados, list):
+        for i, valor in enumerate(dados):
+            yield from numeros(valor, f"{prefixo}{i}.")
+    elif isinstance(dados, (int, float)) and not isinstance(dados, bool):
+        yield prefixo[:-1], dados
+
+
+def comparar(anterior, atual, saida):
+    antes = dict(numeros(anterior))
+    print(f"\n{'métrica':<40} {anterior.get('versao') or 'anterior':>12} {atual.get('versao') or 'atual':>12} "
+          f"{'variação':>9}", file=saida)
+    for caminho, valor in numeros(atual):
+        if caminho not in antes:
+            continue
+        base = antes[caminho]
+        variacao = f"{(valor - base) / base * 100:+.1f}%" if base else "-"
+        print(f"{caminho:<40} {base:>12} {valor:>12} {variacao:>9}", file=saida)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks de chat, entrada, Berkeley e failover em loopback")
+    parser.add_argument("--nos", type=int, default=5, help="processos no.py (o primeiro é o coordenador)")
+    parser.add_argument("--etapas", nargs="+", choices=["chat", "entrada", "berkeley", "failover"],
+                        default=["chat", "entrada", "berkeley", "failover"])
+    parser.add_argument("--mensagens", type=int, default=500, help="chats medidos no espalhamento")
+    parser.add_argument("--taxa", type=float, default=500.0, help="chats por segundo do gerador (0 = rajada)")
+    parser.add_argument("--historicos", type=int, nargs="+", default=[1000, 2000, 5000],
+                        help="tamanhos de histórico em que a entrada é medida (a etapa de chat já deixa --mensagens)")
+    parser.add_argument("--rodadas-berkeley", type=int, default=3)
+    parser.add_argument("--intervalo-berkeley", type=float, default=2.0,
+                        help="intervalo entre rodadas no coordenador, em segundos")
+    parser.add_argument("--desvio", type=float, default=0.2,
+                        help="amplitude dos desvios de relógio dados aos nós, em segundos")
+    parser.add_argument("--eleicao", choices=["bully", "rapida"], default=MODO_ELEICAO)
+    parser.add_argument("--porta-base", type=int, default=13000)
+    parser.add_argument("--estabilizar", type=float, default=2.0,
+                        help="segundos de espera depois que todos entraram")
+    parser.add_argument("--timeout", type=float, default=30.0, help="limite de cada etapa, em segundos")
+    parser.add_argument("--json", type=str, default="bench_cluster.json", help="arquivo do resultado")
+    parser.add_argument("--comparar", type=str, default=None, help="JSON de outra execução para comparar")
+    parser.add_argument("--verbose", action="store_true", help="mostra os logs do nó gerador")
+    args = parser.parse_args()
+    if args.nos < 3:
+        parser.error("--nos precisa ser pelo menos 3")
+
+    # o gerador imprime como qualquer nó: sem --verbose os logs dele vão para o devnull
+    saida = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    resultado = executar(args, saida)
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2)
+    print(f"resultado gravado em {args.json}", file=saida)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(json.load(f), resultado, saida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import timeit
+from mensagem import Mensagem
+from codec import codificar, decodificar, ler_cabecalho, CODEC_JSON, CODEC_BINARIO, CODEC_ZLIB
+
+# micro-benchmark do codec: JSON atual x binário x binário comprimido (completo e só cabeçalho)
+
+ADDR = ("127.0.0.1", 10001)
+
+
+def mensagens_exemplo():
+    chat = Mensagem("CHAT", origem_id=3, origem_addr=ADDR, origem_nome="Nodo3",
+                    lamport=123456, conteudo={"texto": "olá pessoal, tudo certo por aí?"})
+    heartbeat = Mensagem("HEARTBEAT", origem_id=1, origem_addr=ADDR, origem_nome="Coordenador",
+                         lamport=98765, conteudo=None)
+    historico = [{"lamport": i, "origem_id": i % 4 + 1, "origem_nome": f"Nodo{i % 4 + 1}",
+                  "texto": f"mensagem {i}", "ts_real": 1700000000.0 + i, "ts_berkeley": 1700000000.0 + i}
+                 for i in range(50)]
+    lote = Mensagem("HISTORY", origem_id=1, origem_addr=ADDR, origem_nome="Coordenador",
+                    lamport=555, conteudo={"itens": historico})
+    peers = {str(i): {"addr": ["127.0.0.1", 10000 + i], "nome": f"Nodo{i}", "codecs": ["json", "bin1", "zlib1"]}
+             for i in range(1, 21)}
+    coordenador = Mensagem("COORDINATOR", origem_id=20, origem_addr=ADDR, origem_nome="Nodo20",
+                           lamport=777, conteudo={"peers": peers, "epoca": 3, "versao": 0})
+    return {"CHAT": chat, "HEARTBEAT": heartbeat, "HISTORY(50)": lote, "COORDINATOR(20)": coordenador}
+
+
+def medir(funcao, repeticoes):
+    melhor = min(timeit.repeat(funcao, number=repeticoes, repeat=5))
+    return melhor / repeticoes * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark do codec de mensagens")
+    parser.add_argument("--repeticoes", type=int, default=20000)
+    args = parser.parse_args()
+    n = args.repeticoes
+
+    print(f"{'mensagem':<16} {'codec':<6} {'bytes':>6} {'codifica us':>12} {'decodifica us':>14} {'cabeçalho us':>13}")
+    for nome, msg in mensagens_exemplo().items():
+        reps = n if nome != "HISTORY(50)" else max(1, n // 50)
+        for codec in (CODEC_JSON, CODEC_BINARIO, CODEC_ZLIB):
+            data = codificar(msg, codec)
+            t_cod = medir(lambda: codificar(msg, codec), reps)
+            # decodificação completa: acessa o conteúdo para forçar a leitura
+            t_dec = medir(lambda: decodificar(data).conteudo, reps)
+            if codec != CODEC_JSON:
+                t_cab = f"{medir(lambda: ler_cabecalho(data), reps):13.2f}"
+            else:
+                t_cab = f"{'-':>13}"
+            print(f"{nome:<16} {codec:<6} {len(data):>6} {t_cod:12.2f} {t_dec:14.2f} {t_cab}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import json
+import queue
+import time
+from processos import ProcessoNo
+
+# mede o tempo de convergência da eleição por tamanho de cluster: sobe n nós
+# locais, derruba o coordenador (id 1) junto com os maiores ids e cronometra até
+# todos os sobreviventes reconhecerem o maior id vivo como novo coordenador
+
+TIMEOUT_ENTRADA = 15.0
+TIMEOUT_CONVERGENCIA = 30.0
+
+
+def esperar_linha(linhas, nome, trecho, timeout, registro):
+    limite = time.perf_counter() + timeout
+    while True:
+        resta = limite - time.perf_counter()
+        if resta <= 0:
+            raise TimeoutError(f"{nome} não imprimiu '{trecho}'")
+        t, quem, linha = linhas.get(timeout=resta)
+        registro.append((t, quem, linha))
+        if quem == nome and trecho in linha:
+            return t
+
+
+def medir(n, eleicao, porta_base, estabilizar, mortos):
+    linhas = queue.Queue()
+    registro = []
+    nos = []
+
+    def registrar(nome, linha):
+        linhas.put((time.perf_counter(), nome, linha))
+
+    try:
+        for i in range(1, n + 1):
+            nome = f"N{i}"
+            nos.append(ProcessoNo(porta_base + i, nome, registrar, "--eleicao", eleicao))
+            trecho = "criado como coordenador inicial" if i == 1 else "Recebi ID"
+            esperar_linha(linhas, nome, trecho, TIMEOUT_ENTRADA, registro)
+        # deixa o detector de falhas juntar amostras do coordenador
+        time.sleep(estabilizar)
+        while not linhas.empty():
+            linhas.get_nowait()
+
+        registro = []
+        # os maiores caem junto: a eleição precisa passar por cima deles
+        mortos = min(mortos, n - 2)
+        derrubados = [nos[0]] + nos[n - mortos:]
+        inicio = time.perf_counter()
+        for no in derrubados:
+            no.matar()
+        vencedor = f"N{n - mortos}"
+        pendentes = {no.nome for no in nos[1:n - mortos]}
+        convergiu = {}
+        limite = inicio + TIMEOUT_CONVERGENCIA
+        while pendentes:
+            resta = limite - time.perf_counter()
+            if resta <= 0:
+                break
+            try:
+                t, quem, linha = linhas.get(timeout=resta)
+            except queue.Empty:
+                break
+            registro.append((t, quem, linha))
+            reconheceu = (f"Novo coordenador: {vencedor} " in linha
+                          or (quem == vencedor and "anunciado como coordenador" in linha))
+            if quem in pendentes and reconheceu:
+                pendentes.discard(quem)
+                convergiu[quem] = t - inicio
+    finally:
+        for no in nos:
+            no.matar()
+
+    alertas = [t for t, _, linha in registro if "[ALERTA]" in linha]
+    return {
+        "nos": n,
+        "eleicao": eleicao,
+        "mortos": len(derrubados),
+        "convergiu": not pendentes,
+        "deteccao_s": round(min(alertas) - inicio, 3) if alertas else None,
+        "convergencia_s": round(max(convergiu.values()), 3) if convergiu and not pendentes else None,
+        "election_enviados": sum(1 for _, _, l in registro if "Enviando ELECTION" in l or "Sondando" in l
+                                 or "Designando" in l),
+        "ok_enviados": sum(1 for _, _, l in registro if "Respondendo com OK" in l),
+        "anuncios": sum(1 for _, _, l in registro if "anunciado como coordenador" in l),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tempo de convergência da eleição x tamanho do cluster")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--eleicao", nargs="+", choices=["bully", "rapida"], default=["bully", "rapida"])
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("--porta-base", type=int, default=12000)
+    parser.add_argument("--estabilizar", type=float, default=3.0,
+                        help="segundos antes de derrubar o coordenador")
+    parser.add_argument("--mortos", type=int, default=None,
+                        help="quantos dos maiores ids caem junto com o coordenador (padrão: metade)")
+    parser.add_argument("--json", type=str, default=None, help="arquivo para gravar os resultados")
+    args = parser.parse_args()
+
+    resultados = []
+    print(f"{'eleição':<8} {'nós':>4} {'mortos':>6} {'detecção s':>11} {'convergência s':>15} {'ELECTION':>9} {'OK':>4} {'anúncios':>9}")
+    for eleicao in args.eleicao:
+        for n in args.tamanhos:
+            for _ in range(args.repeticoes):
+                mortos = n // 2 if args.mortos is None else args.mortos
+                r = medir(n, eleicao, args.porta_base, args.estabilizar, mortos)
+                resultados.append(r)
+                conv = f"{r['convergencia_s']:15.3f}" if r["convergiu"] else f"{'não convergiu':>15}"
+                det = f"{r['deteccao_s']:11.3f}" if r["deteccao_s"] is not None else f"{'-':>11}"
+                print(f"{eleicao:<8} {n:>4} {r['mortos']:>6} {det} {conv} {r['election_enviados']:>9} "
+                      f"{r['ok_enviados']:>4} {r['anuncios']:>9}")
+                # dá tempo para as portas serem liberadas antes da próxima rodada
+                time.sleep(1.0)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
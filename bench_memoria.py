@@ -0,0 +1,98 @@
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from armazenamento import ArquivoFrio
+from mensagem import HistoricoCompacto
+
+# memória e tempo do histórico em colunas (HistoricoCompacto), sem e com retenção
+# (janela quente limitada e o resto em segmentos frios), com itens chegando como
+# na sincronização, decodificados de JSON
+
+REMETENTES = 8
+TEXTOS = ["oi", "tudo bem?", "alguém viu o último commit?", "bom dia pessoal",
+          "vou sair em cinco minutos", "ok", "concordo com a proposta de ontem"]
+
+
+def lotes_recebidos(n, lote):
+    # cada lote é um conteúdo HISTORY decodificado: nomes e textos viram strings novas por item
+    base = 1700000000.0
+    for inicio in range(0, n, lote):
+        itens = [{"lamport": i + 1, "origem_id": i % REMETENTES + 1, "origem_nome": f"No:{10001 + i % REMETENTES}",
+                  "texto": f"{TEXTOS[i % len(TEXTOS)]} #{i}", "ts_real": base + i * 0.01,
+                  "ts_berkeley": base + i * 0.01 + 0.002}
+                 for i in range(inicio, min(n, inicio + lote))]
+        yield json.loads(json.dumps(itens))
+
+
+def preencher(classe, n, lote):
+    historico = classe()
+    for itens in lotes_recebidos(n, lote):
+        historico.estende(itens)
+    return historico
+
+
+def medir_memoria(classe, n, lote):
+    gc.collect()
+    tracemalloc.start()
+    historico = preencher(classe, n, lote)
+    gc.collect()
+    retido = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    fechar(historico)
+    return retido
+
+
+def fechar(historico):
+    frio = getattr(historico, "frio", None)
+    if frio is not None:
+        frio.fechar()
+
+
+def medir_tempos(classe, n, lote):
+    inicio = time.perf_counter()
+    historico = preencher(classe, n, lote)
+    tempos = {"estende_s": time.perf_counter() - inicio}
+    inicio = time.perf_counter()
+    for i in range(1000):
+        historico.adiciona(n + i + 1, 1, "No:10001", "mensagem nova")
+    tempos["adiciona_us"] = (time.perf_counter() - inicio) / 1000 * 1e6
+    inicio = time.perf_counter()
+    for i in range(0, n, max(1, n // 10000)):
+        historico.contem(i + 1, i % REMETENTES + 1)
+    tempos["contem_us"] = (time.perf_counter() - inicio) / len(range(0, n, max(1, n // 10000))) * 1e6
+    # um nó a quem faltam as últimas 100 mensagens de cada remetente
+    resumo = {origem: [marca[0] - 100 * REMETENTES, marca[1] - 100] for origem, marca in historico.resumo().items()}
+    inicio = time.perf_counter()
+    historico.faltantes(resumo)
+    tempos["faltantes_800_ms"] = (time.perf_counter() - inicio) * 1000
+    inicio = time.perf_counter()
+    historico.to_list()
+    tempos["to_list_ms"] = (time.perf_counter() - inicio) * 1000
+    fechar(historico)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="memória do histórico: colunas x colunas com retenção")
+    parser.add_argument("--mensagens", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--lote", type=int, default=1000, help="itens por conteúdo HISTORY recebido")
+    parser.add_argument("--retencao", type=int, default=50000, help="mensagens na janela quente no modo com retenção")
+    args = parser.parse_args()
+    modos = (("colunas", HistoricoCompacto),
+             ("retencao", lambda: HistoricoCompacto(frio=ArquivoFrio(), max_mensagens=args.retencao, max_bytes=None)))
+
+    print(f"{'mensagens':>9} {'modo':<9} {'MiB':>8} {'B/msg':>6} {'estende s':>10} {'adiciona us':>12} "
+          f"{'contem us':>10} {'faltantes ms':>13} {'to_list ms':>11}")
+    for n in args.mensagens:
+        for nome, classe in modos:
+            retido = medir_memoria(classe, n, args.lote)
+            t = medir_tempos(classe, n, args.lote)
+            print(f"{n:>9} {nome:<9} {retido / 2**20:8.1f} {retido / n:6.0f} {t['estende_s']:10.2f} "
+                  f"{t['adiciona_us']:12.2f} {t['contem_us']:10.2f} {t['faltantes_800_ms']:13.1f} "
+                  f"{t['to_list_ms']:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
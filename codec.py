@@ -0,0 +1,181 @@
+import json
+import socket
+import struct
+import zlib
+from config import *
+from mensagem import Mensagem
+
+# formato binário v1: cabeçalho fixo + nome + conteúdo (JSON) separados, para
+# que filtro de mensagens próprias, deduplicação e roteamento leiam só o cabeçalho
+CODEC_JSON = "json"
+CODEC_BINARIO = "bin1"
+# binário v1 com o conteúdo comprimido por zlib (dicionário v1) acima de LIMIAR_COMPRESSAO
+CODEC_ZLIB = "zlib1"
+CODECS_SUPORTADOS = [CODEC_JSON, CODEC_BINARIO, CODEC_ZLIB]
+
+MAGICO = 0xB1
+VERSAO = 1
+
+# mágico, versão, flags, tipo, origem_id, lamport, ip, porta, tam. nome, tam. conteúdo
+CABECALHO = struct.Struct(">BBBBiQ4sHBI")
+
+SEM_ORIGEM = -1
+
+# flags do cabeçalho
+FLAG_SEQ = 0x01
+# conteúdo comprimido com zlib e o DICIONARIO_ZLIB; cabeçalho e nome continuam legíveis
+FLAG_ZLIB = 0x02
+# sessão e número de sequência do multicast confiável, logo após o cabeçalho fixo
+SEQUENCIA = struct.Struct(">II")
+# origem_id, (lamport pulado), ip e porta de origem, a partir do 5º byte do cabeçalho
+ORIGEM_CABECALHO = struct.Struct(">i8x4sH")
+
+# dicionário pré-definido do zlib: trechos típicos dos conteúdos grandes (ASSIGN_ID,
+# COORDINATOR, PEERS_UPDATE, HISTORY), com as chaves mais repetidas no fim. Mensagens
+# de algumas centenas de bytes não têm repetição interna suficiente e dependem dele.
+# Mudar o conteúdo exige outro nome de codec: os dois lados precisam do mesmo
+DICIONARIO_ZLIB = (
+    b'{"assigned_id":2,"coordenador_id":1,"coordenador_addr":["127.0.0.1",10001],"coordenador_nome":"No:10001",'
+    b'"req":1,"op":"entrou","id":2,"info":{"addr":["127.0.0.1",10002],"nome":"No:10002","codecs":["json","bin1","zlib1"]},'
+    b'"resumo":{"1":[12,12],"2":[15,3]},"itens":[],"historico":[],'
+    b'"peers":{"1":{"addr":["127.0.0.1",10001],"nome":"No:10001","codecs":["json","bin1","zlib1"]},'
+    b'"2":{"addr":["127.0.0.1",10002],"nome":"No:10002","codecs":["json","bin1","zlib1"]}},"epoca":1,"versao":1,'
+    b'{"lamport":1,"origem_id":1,"origem_nome":"No:10001","texto":"oi","ts_real":1700000000.1234567,"ts_berkeley":1700000000.1234567},'
+    b'{"lamport":2,"origem_id":2,"origem_nome":"No:10002","texto":"tudo bem?","ts_real":1700000000.2345678,"ts_berkeley":1700000000.2345678}'
+)
+
+# a posição na lista é o id do tipo no fio; só acrescentar no fim
+TIPOS = [
+    "JOIN", "ASSIGN_ID", "HEARTBEAT", "ELECTION", "OK", "COORDINATOR", "CHAT",
+    "TIME_REQUEST", "TIME_RESPONSE", "TIME_ADJUST", "KICK_VOTE_START", "KICK_VOTE",
+    "KICK_RESULT", "PEERS_UPDATE", "PEERS_REQUEST", "PEERS_RESPONSE", "GOODBYE",
+    "HISTORY", "HISTORY_SYNC", "BATCH", "NACK_SEQ", "SEQ_STATUS", "PING", "PING_REQ", "ACK",
+]
+ID_TIPO = {tipo: i for i, tipo in enumerate(TIPOS)}
+
+
+def eh_binario(data):
+    return len(data) >= CABECALHO.size and data[0] == MAGICO
+
+
+def escolher_codec(listas_codecs):
+    # o codec mais capaz que todos os destinos anunciaram; sem destino conhecido, JSON
+    if CODEC_PREFERIDO != CODEC_BINARIO:
+        return CODEC_JSON
+    comuns = None
+    for codecs in listas_codecs:
+        comuns = set(codecs or ()) if comuns is None else comuns & set(codecs or ())
+    if not comuns:
+        return CODEC_JSON
+    if COMPRESSAO and CODEC_ZLIB in comuns and CODEC_BINARIO in comuns:
+        return CODEC_ZLIB
+    return CODEC_BINARIO if CODEC_BINARIO in comuns else CODEC_JSON
+
+
+def comprimir(corpo):
+    compressor = zlib.compressobj(NIVEL_COMPRESSAO, zdict=DICIONARIO_ZLIB)
+    return compressor.compress(corpo) + compressor.flush()
+
+
+def descomprimir(dados):
+    descompressor = zlib.decompressobj(zdict=DICIONARIO_ZLIB)
+    corpo = descompressor.decompress(dados, MAX_DESCOMPRIMIDO)
+    if descompressor.unconsumed_tail:
+        raise ValueError(f"conteúdo comprimido passa de {MAX_DESCOMPRIMIDO} bytes")
+    return corpo
+
+
+class _CorpoComprimido:
+    # conteudo_bruto ainda comprimido: Mensagem.conteudo faz bytes(bruto), então só
+    # descomprime quem lê o conteúdo, e duplicatas descartadas pelo cabeçalho não pagam
+    __slots__ = ("dados",)
+
+    def __init__(self, dados):
+        self.dados = dados
+
+    def __bytes__(self):
+        return descomprimir(self.dados)
+
+
+def _codificar_binario(msg, compressao=False):
+    tipo_id = ID_TIPO.get(msg.tipo)
+    if tipo_id is None:
+        return None
+    if msg.origem_addr:
+        try:
+            ip = socket.inet_aton(msg.origem_addr[0])
+        except OSError:
+            return None
+        porta = msg.origem_addr[1]
+    else:
+        ip, porta = b"\x00\x00\x00\x00", 0
+    nome = (msg.origem_nome or "").encode("utf-8")
+    if len(nome) > 0xFF:
+        return None
+    conteudo = msg.conteudo
+    corpo = b"" if conteudo is None else json.dumps(conteudo, separators=(",", ":")).encode("utf-8")
+    origem_id = SEM_ORIGEM if msg.origem_id is None else msg.origem_id
+    flags = 0
+    extra = b""
+    # CHAT e controle pequenos nem tentam: o custo fixo do zlib supera o ganho
+    if compressao and len(corpo) >= LIMIAR_COMPRESSAO:
+        comprimido = comprimir(corpo)
+        if len(comprimido) < len(corpo):
+            corpo = comprimido
+            flags |= FLAG_ZLIB
+    if msg.seq is not None:
+        flags |= FLAG_SEQ
+        extra = SEQUENCIA.pack(*msg.seq)
+    return CABECALHO.pack(MAGICO, VERSAO, flags, tipo_id, origem_id, msg.lamport, ip, porta,
+                          len(nome), len(corpo)) + extra + nome + corpo
+
+
+def codificar(msg, codec=CODEC_JSON):
+    # mensagens que não cabem no formato binário (tipo desconhecido, endereço
+    # que não é IPv4...) caem para JSON, que todo nó entende
+    if codec in (CODEC_BINARIO, CODEC_ZLIB):
+        data = _codificar_binario(msg, codec == CODEC_ZLIB)
+        if data is not None:
+            return data
+    return msg.to_json().encode("utf-8")
+
+
+def ler_cabecalho(data):
+    # decodifica só a parte fixa; o conteúdo fica como bytes brutos
+    (_, versao, flags, tipo_id, origem_id, lamport, ip, porta,
+     tam_nome, tam_corpo) = CABECALHO.unpack_from(data)
+    if versao != VERSAO:
+        raise ValueError(f"versão de codec desconhecida: {versao}")
+    inicio_nome = CABECALHO.size
+    seq = None
+    if flags & FLAG_SEQ:
+        seq = list(SEQUENCIA.unpack_from(data, inicio_nome))
+        inicio_nome += SEQUENCIA.size
+    inicio_corpo = inicio_nome + tam_nome
+    msg = Mensagem(
+        tipo=TIPOS[tipo_id] if tipo_id < len(TIPOS) else None,
+        origem_id=None if origem_id == SEM_ORIGEM else origem_id,
+        origem_addr=(socket.inet_ntoa(ip), porta) if porta else None,
+        origem_nome=bytes(data[inicio_nome:inicio_corpo]).decode("utf-8") or None,
+        lamport=lamport,
+    )
+    msg.seq = seq
+    if tam_corpo:
+        corpo = data[inicio_corpo:inicio_corpo + tam_corpo]
+        msg.conteudo_bruto = _CorpoComprimido(corpo) if flags & FLAG_ZLIB else corpo
+    return msg
+
+
+def ler_origem(data):
+    # só a origem do cabeçalho binário, sem montar a Mensagem: (origem_id, ip, porta),
+    # ou None para JSON e fragmentos
+    if not eh_binario(data):
+        return None
+    origem_id, ip, porta = ORIGEM_CABECALHO.unpack_from(data, 4)
+    return None if origem_id == SEM_ORIGEM else origem_id, ip, porta
+
+
+def decodificar(data):
+    if eh_binario(data):
+        return ler_cabecalho(data)
+    return Mensagem.from_json(bytes(data).decode("utf-8"))
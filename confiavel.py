@@ -0,0 +1,159 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from config import *
+
+# tipos multicast que recebem número de sequência e podem ser reparados por NACK
+TIPOS_CONFIAVEIS = {"CHAT", "BATCH", "KICK_VOTE_START", "KICK_VOTE", "KICK_RESULT", "PEERS_UPDATE"}
+
+
+class EmissorConfiavel:
+    # numera as mensagens confiáveis deste nó e guarda as últimas enviadas para
+    # reparo; a sessão muda a cada execução para o receptor não confundir reinícios
+    def __init__(self, retidos=MAX_RETIDOS_CONFIAVEL):
+        self.sessao = int.from_bytes(os.urandom(4), "big")
+        self.seq = 0
+        self.retidos = retidos
+        self.ultimo_envio = 0.0
+        # próximo anúncio do último seq e o intervalo até ele (dobra a cada repetição)
+        self.proximo_anuncio = None
+        self.intervalo_anuncio = INTERVALO_ANUNCIO_SEQ
+        self._enviados = OrderedDict()
+        self.lock = Lock()
+
+    def numerar(self, msg):
+        with self.lock:
+            self.seq += 1
+            self.ultimo_envio = time.time()
+            self.intervalo_anuncio = INTERVALO_ANUNCIO_SEQ
+            self.proximo_anuncio = self.ultimo_envio + self.intervalo_anuncio
+            msg.seq = [self.sessao, self.seq]
+            return self.seq
+
+    def guardar(self, seq, data):
+        with self.lock:
+            self._enviados[seq] = data
+            while len(self._enviados) > self.retidos:
+                self._enviados.popitem(last=False)
+
+    def buscar(self, seqs):
+        with self.lock:
+            return [self._enviados[s] for s in seqs if s in self._enviados]
+
+    def anuncio_pendente(self, agora=None):
+        # depois de um tempo parado, devolve o último seq para quem perdeu a cauda;
+        # repete (com o intervalo dobrando) enquanto não houver envio novo, então
+        # um anúncio perdido não deixa a cauda sem reparo até a próxima mensagem
+        if agora is None:
+            agora = time.time()
+        with self.lock:
+            if self.proximo_anuncio is None or agora < self.proximo_anuncio:
+                return None
+            self.intervalo_anuncio = min(self.intervalo_anuncio * 2, INTERVALO_MAX_ANUNCIO_SEQ)
+            self.proximo_anuncio = agora + self.intervalo_anuncio
+            return self.seq
+
+
+class _EstadoOrigem:
+    def __init__(self, maximo):
+        self.maximo = maximo
+        # seq faltando -> quantos NACKs já foram pedidos por ele
+        self.faltando = {}
+        self.ultimo_nack = 0.0
+        # a primeira mensagem vista pode ter passado à frente das anteriores: as que
+        # chegarem dentro da janela abaixo dela ainda valem, uma vez cada
+        self.primeiro = maximo + 1
+        self.anteriores = set()
+
+
+class ReceptorConfiavel:
+    # detecta lacunas por origem (addr, sessão), descarta duplicatas e guarda as
+    # mensagens recebidas para poder reparar também as lacunas de outros nós
+    def __init__(self, retidos=MAX_RETIDOS_CONFIAVEL):
+        self.retidos = retidos
+        self._origens = {}
+        self._cache = OrderedDict()
+        self.perdidas = 0
+        self.reparadas = 0
+        self.lock = Lock()
+
+    def _estado(self, chave, seq):
+        estado = self._origens.get(chave)
+        if estado is None:
+            # primeira mensagem vista desta origem. Toda sessão numera a partir de 1:
+            # perto do começo, o que veio antes dela é lacuna e vai por NACK; mais
+            # adiante, é responsabilidade da sincronização de histórico
+            estado = _EstadoOrigem(0 if seq <= JANELA_REORDEM_CONFIAVEL + 1 else seq - 1)
+            self._origens[chave] = estado
+        return estado
+
+    def _marcar_lacuna(self, estado, ate):
+        for seq in range(estado.maximo + 1, ate + 1):
+            estado.faltando[seq] = 0
+        # lacuna grande demais para reparar por NACK: desiste das mais antigas
+        while len(estado.faltando) > MAX_LACUNA_CONFIAVEL:
+            del estado.faltando[next(iter(estado.faltando))]
+            self.perdidas += 1
+
+    def aceitar(self, origem_addr, sessao, seq, data):
+        # devolve True se a mensagem é nova e deve ser tratada
+        chave = (tuple(origem_addr), sessao)
+        with self.lock:
+            estado = self._estado(chave, seq)
+            if seq > estado.maximo:
+                self._marcar_lacuna(estado, seq - 1)
+                estado.maximo = seq
+            elif seq in estado.faltando:
+                del estado.faltando[seq]
+                self.reparadas += 1
+            elif estado.primeiro - JANELA_REORDEM_CONFIAVEL <= seq < estado.primeiro and seq not in estado.anteriores:
+                estado.anteriores.add(seq)
+            else:
+                return False
+            self._cache[(chave, seq)] = data
+            while len(self._cache) > self.retidos:
+                self._cache.popitem(last=False)
+            return True
+
+    def anuncio(self, origem_addr, sessao, seq):
+        # a origem avisou qual foi o último seq enviado: revela perdas na cauda
+        chave = (tuple(origem_addr), sessao)
+        with self.lock:
+            estado = self._origens.get(chave)
+            if estado is None:
+                estado = self._origens[chave] = _EstadoOrigem(0 if seq <= JANELA_REORDEM_CONFIAVEL else seq)
+            if seq > estado.maximo:
+                self._marcar_lacuna(estado, seq)
+                estado.maximo = seq
+
+    def buscar(self, origem_addr, sessao, seqs):
+        chave = (tuple(origem_addr), sessao)
+        with self.lock:
+            return [self._cache[(chave, s)] for s in seqs if (chave, s) in self._cache]
+
+    def pendencias(self, agora=None):
+        # devolve ([(origem_addr, sessao, seqs, tentativas)], origens das quais desistiu de algum seq)
+        if agora is None:
+            agora = time.time()
+        nacks = []
+        desistiu = set()
+        with self.lock:
+            for (origem_addr, sessao), estado in self._origens.items():
+                if not estado.faltando or agora - estado.ultimo_nack < INTERVALO_NACK_CONFIAVEL:
+                    continue
+                estado.ultimo_nack = agora
+                seqs = []
+                tentativas = MAX_NACKS_CONFIAVEL
+                for seq, feitas in list(estado.faltando.items()):
+                    if feitas >= MAX_NACKS_CONFIAVEL:
+                        del estado.faltando[seq]
+                        self.perdidas += 1
+                        desistiu.add(origem_addr)
+                        continue
+                    estado.faltando[seq] = feitas + 1
+                    tentativas = min(tentativas, feitas)
+                    seqs.append(seq)
+                if seqs:
+                    nacks.append((origem_addr, sessao, seqs[:MAX_SEQS_NACK], tentativas))
+        return nacks, desistiu
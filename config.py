@@ -1,10 +1,63 @@
 import socket
+import sys
 import time
 #variável pra teste local usando porta
 TESTE_MAQUINA_UNICA_LOCAL = True
 ENDERECO_PADRAO_BIND = '0.0.0.0' if not TESTE_MAQUINA_UNICA_LOCAL else '127.0.0.1'
 #tamanho do buffer
 TAMANHO_BUFFER = 65536
+#buffers dos sockets UDP no kernel (SO_RCVBUF/SO_SNDBUF), em bytes; 0 = padrão do sistema.
+#no Linux o pedido é limitado por net.core.rmem_max/wmem_max; os descartes por fila cheia
+#aparecem no stats/métricas para dimensionar estes valores
+TAMANHO_RCVBUF = 4 * 1024 * 1024
+TAMANHO_SNDBUF = 1024 * 1024
+#codec preferido no fio: "bin1" (binário) ou "json"; JSON é sempre aceito na recepção
+CODEC_PREFERIDO = "bin1"
+#compressão zlib do conteúdo (codec "zlib1"), para quem anunciou suporte e acima do limiar em bytes
+COMPRESSAO = True
+LIMIAR_COMPRESSAO = 512
+NIVEL_COMPRESSAO = 6
+#teto do conteúdo descomprimido, contra datagramas que expandem demais
+MAX_DESCOMPRIMIDO = 32 * 1024 * 1024
+
+#runtime do nó: "thread" (threads e um agendador de timers) ou "async" (um loop asyncio)
+MODO_RUNTIME = "thread"
+TRABALHADORES_ASYNC = 4
+#agendador do modo thread: um heap de timers e um pool pequeno para os callbacks
+TRABALHADORES_AGENDADOR = 4
+#tarefas bloqueantes (eleição, rodada de Berkeley, sondas) rodam num pool à parte
+TRABALHADORES_FUNDO_AGENDADOR = 4
+RESOLUCAO_AGENDADOR = 0.01
+AMOSTRAS_JITTER_AGENDADOR = 1024
+#fila de recepção do modo thread: os listeners só enfileiram e estes trabalhadores
+#processam (0 = processa no próprio listener). A capacidade, em datagramas, vale para
+#todos juntos (fragmentos de 1400 bytes: ~25 MB cheia); cheia, "descartar" perde a
+#mensagem nova e "bloquear" faz o listener esperar, deixando o excesso no kernel
+TRABALHADORES_RECEPCAO = 4
+CAPACIDADE_FILA_RECEPCAO = 16384
+POLITICA_FILA_RECEPCAO = "descartar"
+
+#multicast confiável: retransmissão por NACK das mensagens numeradas
+MAX_RETIDOS_CONFIAVEL = 1024
+INTERVALO_NACK_CONFIAVEL = 0.1
+MAX_NACKS_CONFIAVEL = 5
+MAX_LACUNA_CONFIAVEL = 512
+#seqs abaixo da primeira mensagem vista de uma origem ainda aceitos (chegaram fora de ordem)
+JANELA_REORDEM_CONFIAVEL = 64
+MAX_SEQS_NACK = 256
+#parada a origem, o último seq é reanunciado até chegar tráfego novo: o primeiro
+#anúncio sai depois de INTERVALO_ANUNCIO_SEQ e o intervalo dobra até o máximo
+INTERVALO_ANUNCIO_SEQ = 0.1
+INTERVALO_MAX_ANUNCIO_SEQ = 5.0
+
+#fragmentação: mensagens maiores que TAMANHO_FRAGMENTO viram vários datagramas
+TAMANHO_FRAGMENTO = 1400
+MAX_ENVIADOS_RETIDOS = 64
+MAX_REMONTAGENS = 64
+MAX_BYTES_REMONTAGEM = 16 * 1024 * 1024
+TIMEOUT_REMONTAGEM = 5.0
+INTERVALO_NACK_FRAGMENTOS = 0.3
+MAX_NACKS_FRAGMENTOS = 5
 
 #grupo multicast para ser o único ponte de identificação
 GRUPO_MULTICAST = '224.1.1.1'
@@ -12,32 +65,132 @@ PORTA_MULTICAST = 5007
 
 
 #configurações para atualização do coordenador
+#o coordenador só manda HEARTBEAT explícito depois de ficar esse tempo sem enviar nada ao grupo
 INTERVALO_HEARTBEAT = 1.0
+#usado enquanto o detector ainda não tem amostras suficientes
 TIMEOUT_HEARTBEAT = 3.0
 TIMEOUT_ELEICAO = 5.0
+#eleição: "bully" (clássica) ou "rapida" (sonda os maiores primeiro, sem cascata)
+MODO_ELEICAO = "bully"
+SONDAS_PARALELAS_ELEICAO = 3
+TIMEOUT_SONDA_ELEICAO = 0.3
 TIMEOUT_SINCRONIZACAO_HISTORICO = 5.0
+#sem ouvir o coordenador por mais que isso, o nó pede a diferença do histórico ao voltar
+LIMIAR_LACUNA_SINCRONIZACAO = 2.0
+
+#detector de falhas phi-accrual sobre o tráfego do coordenador
+LIMIAR_PHI = 8.0
+JANELA_PHI = 100
+MIN_AMOSTRAS_PHI = 5
+MIN_DESVIO_PHI = 0.05
+#intervalos a partir desta fração do INTERVALO_HEARTBEAT contam como silêncio ocioso do coordenador
+FRACAO_OCIOSA_PHI = 0.9
+INTERVALO_VERIFICACAO_FALHA = 0.1
+
+#retenção da janela quente do histórico compacto: o que passar de qualquer limite vai,
+#das mensagens mais antigas para as mais novas, para segmentos frios comprimidos em disco
+#(armazenamento.ArquivoFrio); None desliga o limite
+RETENCAO_MAX_MENSAGENS = 100000
+RETENCAO_MAX_BYTES = 32 * 1024 * 1024
+#segundos, pelo ts_berkeley
+RETENCAO_MAX_IDADE = None
+#mensagens por segmento frio (também o mínimo despejado de uma vez)
+TAMANHO_SEGMENTO_FRIO = 4096
+SEGMENTOS_FRIOS_EM_CACHE = 2
+#segundos sem tentar despejar de novo depois de uma escrita de segmento frio que falhou
+ESPERA_FALHA_FRIO = 5.0
+#mensagens por HISTORY na sincronização e na entrada: o histórico vai em vários, lidos do disco aos poucos
+LOTE_HISTORICO = 1000
+#None: <--dados>/frio, parte do histórico durável; sem --dados, um temporário apagado quando o nó sai
+DIRETORIO_FRIO = None
+
+#histórico em disco (opcional, ativado com --dados): log em segmentos + snapshots
+TAMANHO_LOTE_LOG = 128
+INTERVALO_DESCARGA_LOG = 0.5
+TAMANHO_SEGMENTO_LOG = 8 * 1024 * 1024
+LIMITE_COMPACTACAO_LOG = 20000
+FSYNC_LOG = False
 
 
 #usei o berkley para sicronização dos relogios
-#ainda não funciona 100% procurando uns bugs ainda mas a parte pedida do condigo funciona legal!
-INTERVALO_SINCRONIZACAO_BERKELEY = 30000
+#uma rodada manda TIME_REQUEST a todos de uma vez e termina quando todos respondem
+#ou no prazo; cada amostra é compensada por meio RTT
+INTERVALO_SINCRONIZACAO_BERKELEY = 30
+#fração do intervalo sorteada para mais ou para menos (±5 s nos 30 s padrão)
+VARIACAO_SINCRONIZACAO_BERKELEY = 1 / 6
 TIMEOUT_REQUISICAO_BERKELEY = 3
 LIMITE_CORRECAO_TEMPO = 10
+#a correção é aplicada aos poucos: no máximo TAXA_SLEW_BERKELEY segundos por segundo
+TAXA_SLEW_BERKELEY = 0.1
+#amostras longe da mediana (FATOR * desvio absoluto mediano, no mínimo MIN) ficam fora da média
+FATOR_OUTLIER_BERKELEY = 3.0
+MIN_OUTLIER_BERKELEY = 0.05
 
-INTERVAL_PEERS_SYNC = 15
+#lista de peers versionada: o coordenador manda só deltas; quem vê lacuna pede
+#a lista inteira, no máximo uma vez por intervalo
+INTERVALO_PEDIDO_PEERS = 1.0
+
+#associação ao grupo: "coordenador" (lista versionada do coordenador) ou "swim" (fofoca)
+MODO_MEMBROS = "coordenador"
+PERIODO_SWIM = 1.0
+TIMEOUT_PING_SWIM = 0.3
+K_INDIRETO_SWIM = 3
+#suspeita vira morte depois de SUSPEITA_SWIM * log2(n) períodos sem refutação
+SUSPEITA_SWIM = 3
+LAMBDA_BOATOS_SWIM = 3
+MAX_BOATOS_SWIM = 6
+INTERVALO_PASSO_SWIM = 0.1
+
+#agrupamento opcional de CHATs do remetente num único BATCH (ativado com --lote-chat)
+LOTE_CHAT = False
+JANELA_LOTE_CHAT = 0.02
+MAX_LOTE_CHAT = 32
+MAX_BYTES_LOTE_CHAT = 1200
 
 #configuração para chutar de usuarios temporariamente
 DURACAO_VOTACAO = 30.0
 VOTOS_MINIMOS = 1
 TEMPO_CHUTE = 300.0
 
+#rede simulada em memória (transporte.RedeSimulada), para muitos nós num processo
+LATENCIA_SIMULADA = 0.001
+VARIACAO_LATENCIA_SIMULADA = 0.0005
+PERDA_SIMULADA = 0.0
+#bytes por segundo no enlace de saída de cada nó; 0 = sem limite
+BANDA_SIMULADA = 0
+
+#métricas (comando stats e endpoint Prometheus com --metricas PORTA); o endpoint só escuta localmente
+ENDERECO_METRICAS = '127.0.0.1'
+#faixas dos histogramas, em segundos: duração dos handlers e de eleições/rodadas Berkeley
+LIMITES_TRATAMENTO_METRICAS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                               0.25, 0.5, 1.0)
+LIMITES_DURACAO_METRICAS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+#diagnóstico opcional (--profile e --trace)
+INTERVALO_AMOSTRAGEM_PERFIL = 0.005
+#depois disso os spans só são contados, para o trace não crescer sem limite
+MAX_EVENTOS_RASTREIO = 500000
+
+
 
+def ajustar_buffers_socket(sock, rcvbuf=TAMANHO_RCVBUF, sndbuf=TAMANHO_SNDBUF):
+    # devolve o SO_RCVBUF efetivo (o Linux informa o dobro do que reserva para dados)
+    for opcao, tamanho in ((socket.SO_RCVBUF, rcvbuf), (socket.SO_SNDBUF, sndbuf)):
+        if tamanho:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, opcao, tamanho)
+            except OSError:
+                pass
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
 
-def criar_socket_multicast(endereco_bind=ENDERECO_PADRAO_BIND, porta=PORTA_MULTICAST):
+def criar_socket_multicast(endereco_bind=ENDERECO_PADRAO_BIND, porta=PORTA_MULTICAST,
+                           rcvbuf=TAMANHO_RCVBUF, sndbuf=TAMANHO_SNDBUF):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ajustar_buffers_socket(sock, rcvbuf, sndbuf)
     try:
-        sock.bind((endereco_bind, porta))
+        # fora do Windows o socket só recebe o grupo se estiver no endereço coringa
+        sock.bind((endereco_bind if sys.platform == "win32" else '', porta))
     except OSError:
         sock.bind(('', porta))
     mreq = socket.inet_aton(GRUPO_MULTICAST) + socket.inet_aton(endereco_bind)
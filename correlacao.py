@@ -0,0 +1,72 @@
+import itertools
+import threading
+
+
+class Futuro:
+    # respostas de uma requisição: o handler que recebe a resposta chama
+    # resolver() e quem espera acorda na hora, sem ficar sondando uma flag
+    def __init__(self, esperados=1):
+        self.esperados = esperados
+        self.respostas = {}
+        self._cond = threading.Condition()
+        self._callbacks = []
+
+    def _completo(self, respostas):
+        return len(respostas) >= self.esperados
+
+    def resolver(self, chave, valor=True):
+        with self._cond:
+            self.respostas[chave] = valor
+            self._cond.notify_all()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def satisfeito(self, condicao=None):
+        condicao = condicao or self._completo
+        with self._cond:
+            return condicao(self.respostas)
+
+    def aguardar(self, timeout, condicao=None):
+        # bloqueia até a condição valer (por padrão, todas as respostas esperadas)
+        # ou o prazo acabar; devolve se a condição foi atingida
+        condicao = condicao or self._completo
+        with self._cond:
+            return self._cond.wait_for(lambda: condicao(self.respostas), timeout)
+
+    def copiar(self):
+        with self._cond:
+            return dict(self.respostas)
+
+    def ao_resolver(self, callback):
+        # chamado a cada resposta, fora do lock (usado pelo runtime async)
+        with self._cond:
+            self._callbacks.append(callback)
+
+
+class Correlacionador:
+    # dá um id a cada requisição enviada; a resposta ecoa o id e o handler
+    # completa o futuro certo, descartando respostas atrasadas de rodadas velhas
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._pendentes = {}
+        self.lock = threading.Lock()
+
+    def nova(self, esperados=1):
+        futuro = Futuro(esperados)
+        with self.lock:
+            req = next(self._ids)
+            self._pendentes[req] = futuro
+        return req, futuro
+
+    def resolver(self, req, chave, valor=True):
+        with self.lock:
+            futuro = self._pendentes.get(req)
+        if futuro is None:
+            return False
+        futuro.resolver(chave, valor)
+        return True
+
+    def encerrar(self, req):
+        with self.lock:
+            self._pendentes.pop(req, None)
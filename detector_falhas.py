@@ -0,0 +1,81 @@
+import math
+import time
+from collections import deque
+from config import *
+
+
+class DetectorPhiAccrual:
+    # detector de falhas phi-accrual: aprende média e desvio dos intervalos
+    # entre mensagens do coordenador e devolve uma suspeita contínua (phi) em
+    # vez de um timeout fixo
+    def __init__(self, janela=JANELA_PHI, limiar=LIMIAR_PHI, intervalo_ocioso=INTERVALO_HEARTBEAT):
+        self.limiar = limiar
+        # o coordenador nunca fica mais que isso sem mandar nada (o HEARTBEAT ocioso)
+        self.intervalo_ocioso = intervalo_ocioso
+        self.intervalos = deque(maxlen=janela)
+        self._soma = 0.0
+        self._soma_quadrados = 0.0
+        # quanto cada silêncio que chegou até o heartbeat ocioso passou dele (atraso da rede e do agendador)
+        self.atrasos_ociosos = deque(maxlen=janela)
+        self._soma_atrasos = 0.0
+        self.ultimo = None
+
+    def reiniciar(self, agora=None):
+        self.intervalos.clear()
+        self._soma = 0.0
+        self._soma_quadrados = 0.0
+        self.atrasos_ociosos.clear()
+        self._soma_atrasos = 0.0
+        self.ultimo = time.time() if agora is None else agora
+
+    def registrar(self, agora=None):
+        if agora is None:
+            agora = time.time()
+        if self.ultimo is not None:
+            intervalo = agora - self.ultimo
+            if len(self.intervalos) == self.intervalos.maxlen:
+                antigo = self.intervalos[0]
+                self._soma -= antigo
+                self._soma_quadrados -= antigo * antigo
+            self.intervalos.append(intervalo)
+            self._soma += intervalo
+            self._soma_quadrados += intervalo * intervalo
+            if intervalo >= FRACAO_OCIOSA_PHI * self.intervalo_ocioso:
+                atraso = intervalo - self.intervalo_ocioso
+                if len(self.atrasos_ociosos) == self.atrasos_ociosos.maxlen:
+                    self._soma_atrasos -= self.atrasos_ociosos[0] ** 2
+                self.atrasos_ociosos.append(atraso)
+                self._soma_atrasos += atraso * atraso
+        self.ultimo = agora
+
+    def phi(self, agora=None):
+        if self.ultimo is None:
+            return 0.0
+        if agora is None:
+            agora = time.time()
+        decorrido = agora - self.ultimo
+        n = len(self.intervalos)
+        if n < MIN_AMOSTRAS_PHI:
+            # ainda sem estatística: equivale ao timeout fixo antigo
+            return self.limiar * decorrido / TIMEOUT_HEARTBEAT
+        media = self._soma / n
+        variancia = max(self._soma_quadrados / n - media * media, 0.0)
+        desvio = max(math.sqrt(variancia), MIN_DESVIO_PHI)
+        if media < self.intervalo_ocioso:
+            # tráfego misturado: depois da última mensagem o silêncio vai no máximo até
+            # o heartbeat ocioso, e a folga além dele vem do quanto os silêncios
+            # anteriores passaram do intervalo, não da mistura de intervalos curtos e longos
+            media = self.intervalo_ocioso
+            atrasos = len(self.atrasos_ociosos)
+            desvio = max(math.sqrt(self._soma_atrasos / atrasos) if atrasos else 0.0, MIN_DESVIO_PHI)
+        # aproximação logística da CDF normal, como no Akka
+        # limitado para exp() não estourar depois de um silêncio longo (e o log10 não
+        # receber zero); no limite phi já passa de 30
+        y = max(-10.0, min(10.0, (decorrido - media) / desvio))
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if decorrido > media:
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+    def suspeito(self, agora=None):
+        return self.phi(agora) > self.limiar
@@ -0,0 +1,201 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from config import *
+
+# ferramentas opcionais para descobrir onde o nó gasta tempo: --profile liga um
+# perfilador por amostragem em todos os threads e --trace grava um span por
+# mensagem recebida (decodificar → tratar → enviar) e as esperas nos locks
+
+
+class Amostrador:
+    # um thread lê a pilha de todos os outros a cada intervalo (sys._current_frames)
+    # e conta as pilhas iguais; o custo é fixo por amostra, não por chamada, então
+    # não distorce os caminhos quentes como o cProfile
+    def __init__(self, intervalo=INTERVALO_AMOSTRAGEM_PERFIL):
+        self.intervalo = intervalo
+        # (nome do thread, pilha da raiz para o topo) -> amostras
+        self.pilhas = Counter()
+        self.amostras = 0
+        self._nomes_funcao = {}
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._laco, daemon=True, name="no-perfil")
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _funcao(self, codigo):
+        nome = self._nomes_funcao.get(codigo)
+        if nome is None:
+            nome = f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+            self._nomes_funcao[codigo] = nome
+        return nome
+
+    def _laco(self):
+        proprio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            nomes = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                pilha = []
+                while frame is not None:
+                    pilha.append(self._funcao(frame.f_code))
+                    frame = frame.f_back
+                pilha.reverse()
+                self.pilhas[(nomes.get(ident, str(ident)), tuple(pilha))] += 1
+            self.amostras += 1
+
+    def gravar(self, caminho):
+        # pilhas dobradas ("thread;f1;f2 amostras"), lidas pelo flamegraph.pl, speedscope e inferno
+        with open(caminho, "w", encoding="utf-8") as f:
+            for (thread, pilha), n in sorted(self.pilhas.items()):
+                f.write(";".join((thread,) + pilha) + f" {n}\n")
+
+    def resumo(self, limite=5):
+        # por thread: amostras e as funções no topo da pilha (tempo próprio) que mais apareceram
+        por_thread = {}
+        for (thread, pilha), n in self.pilhas.items():
+            total, topo = por_thread.setdefault(thread, [0, Counter()])
+            por_thread[thread][0] = total + n
+            if pilha:
+                topo[pilha[-1]] += n
+        linhas = [f"{self.amostras} amostras a cada {self.intervalo * 1000:.0f} ms"]
+        for thread, (total, topo) in sorted(por_thread.items(), key=lambda item: -item[1][0]):
+            linhas.append(f"{thread}: {total} amostras")
+            for funcao, n in topo.most_common(limite):
+                linhas.append(f"    {n * 100 / total:5.1f}%  {funcao}")
+        return linhas
+
+
+class _Span:
+    __slots__ = ("rastreador", "nome", "inicio")
+
+    def __init__(self, rastreador, nome):
+        self.rastreador = rastreador
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.rastreador.registrar(self.nome, self.inicio, time.perf_counter())
+
+
+class LockRastreado:
+    # mesma interface de threading.Lock; quando o lock já está preso, mede a espera
+    def __init__(self, rastreador, lock, nome):
+        self._rastreador = rastreador
+        self._lock = lock
+        self.nome = nome
+
+    def acquire(self, blocking=True, timeout=-1):
+        # sem disputa não há o que medir: uma tentativa sem bloquear resolve
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        inicio = time.perf_counter()
+        obtido = self._lock.acquire(True, timeout)
+        self._rastreador.espera(self.nome, inicio, time.perf_counter())
+        return obtido
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self._lock.release()
+
+
+class Rastreador:
+    # spans no formato Trace Event do Chrome (eventos "X" com início e duração em
+    # microssegundos), que chrome://tracing, Perfetto e speedscope abrem direto
+    def __init__(self, maximo=MAX_EVENTOS_RASTREIO):
+        self.maximo = maximo
+        self.eventos = []
+        self.descartados = 0
+        self._pid = os.getpid()
+        self._origem = time.perf_counter()
+        self._threads = {}
+        # lock -> [esperas, segundos esperando, maior espera]
+        self.esperas = {}
+        self._lock_esperas = threading.Lock()
+
+    def span(self, nome, detalhe=None):
+        return _Span(self, nome if detalhe is None else f"{nome} {detalhe}")
+
+    def registrar(self, nome, inicio, fim, categoria="no"):
+        # list.append é atômico: os threads gravam sem lock; passando do máximo, só conta
+        if len(self.eventos) >= self.maximo:
+            self.descartados += 1
+            return
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        self.eventos.append({"name": nome, "cat": categoria, "ph": "X", "pid": self._pid, "tid": tid,
+                             "ts": round((inicio - self._origem) * 1e6, 1),
+                             "dur": round((fim - inicio) * 1e6, 1)})
+
+    def espera(self, nome, inicio, fim):
+        duracao = fim - inicio
+        with self._lock_esperas:
+            total = self.esperas.setdefault(nome, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duracao
+            total[2] = max(total[2], duracao)
+        self.registrar(f"espera {nome}", inicio, fim, categoria="lock")
+
+    def lock(self, lock, nome):
+        return LockRastreado(self, lock, nome)
+
+    def gravar(self, caminho):
+        nomes = [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": nome}}
+                 for tid, nome in list(self._threads.items())]
+        with self._lock_esperas:
+            esperas = {nome: {"esperas": n, "segundos": round(s, 6), "maior_s": round(m, 6)}
+                       for nome, (n, s, m) in self.esperas.items()}
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": nomes + list(self.eventos), "displayTimeUnit": "ms",
+                       "otherData": {"descartados": self.descartados, "esperas_lock": esperas}}, f)
+
+    def resumo(self):
+        linhas = [f"{len(self.eventos)} spans, {self.descartados} descartados"]
+        with self._lock_esperas:
+            for nome, (n, s, m) in sorted(self.esperas.items(), key=lambda item: -item[1][1]):
+                linhas.append(f"{nome}: {n} esperas, {s * 1000:.1f} ms no total, maior {m * 1000:.2f} ms")
+        return linhas
+
+
+class _SpanNulo:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class RastreadorNulo:
+    # sem --trace: spans que não fazem nada e os locks originais, sem embrulho
+    _span = _SpanNulo()
+
+    def span(self, nome, detalhe=None):
+        return self._span
+
+    def lock(self, lock, nome):
+        return lock
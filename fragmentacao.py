@@ -0,0 +1,170 @@
+import struct
+import time
+import itertools
+from collections import OrderedDict
+from threading import Lock
+from config import *
+
+# fragmentos e NACKs são binários e começam com \x00, que nunca inicia um JSON,
+# então convivem com as mensagens normais no mesmo socket
+PREFIXO_FRAGMENTO = b"\x00F"
+PREFIXO_NACK = b"\x00N"
+
+# msg_id, índice do fragmento, total de fragmentos
+CABECALHO_FRAGMENTO = struct.Struct(">IHH")
+# msg_id, quantidade de índices faltando
+CABECALHO_NACK = struct.Struct(">IH")
+
+MAX_FRAGMENTOS = 0xFFFF
+# mantém o próprio NACK dentro de um datagrama pequeno
+MAX_INDICES_NACK = 512
+
+
+def eh_fragmento(data):
+    return data[:2] == PREFIXO_FRAGMENTO
+
+
+def eh_nack(data):
+    return data[:2] == PREFIXO_NACK
+
+
+def montar_nack(msg_id, indices):
+    indices = list(indices)[:MAX_INDICES_NACK]
+    return (PREFIXO_NACK + CABECALHO_NACK.pack(msg_id, len(indices))
+            + struct.pack(f">{len(indices)}H", *indices))
+
+
+def ler_nack(data):
+    msg_id, n = CABECALHO_NACK.unpack_from(data, 2)
+    indices = struct.unpack_from(f">{n}H", data, 2 + CABECALHO_NACK.size)
+    return msg_id, indices
+
+
+class Fragmentador:
+    # quebra mensagens grandes em fragmentos numerados e guarda os últimos
+    # enviados para poder retransmitir só o que faltou do outro lado
+    def __init__(self, tamanho=TAMANHO_FRAGMENTO, retidos=MAX_ENVIADOS_RETIDOS):
+        self.tamanho = tamanho
+        self.retidos = retidos
+        self._ids = itertools.count(int(time.time() * 1000) & 0xFFFFFFFF)
+        self._enviados = OrderedDict()
+        self.lock = Lock()
+
+    def fragmentar(self, data):
+        if len(data) <= self.tamanho:
+            return [data]
+        total = (len(data) + self.tamanho - 1) // self.tamanho
+        if total > MAX_FRAGMENTOS:
+            raise ValueError(f"mensagem de {len(data)} bytes excede o limite de fragmentos")
+        msg_id = next(self._ids) & 0xFFFFFFFF
+        partes = []
+        for i in range(total):
+            pedaco = data[i * self.tamanho:(i + 1) * self.tamanho]
+            partes.append(PREFIXO_FRAGMENTO + CABECALHO_FRAGMENTO.pack(msg_id, i, total) + pedaco)
+        with self.lock:
+            self._enviados[msg_id] = partes
+            while len(self._enviados) > self.retidos:
+                self._enviados.popitem(last=False)
+        return partes
+
+    def retransmitir(self, msg_id, indices):
+        with self.lock:
+            partes = self._enviados.get(msg_id)
+        if partes is None:
+            return []
+        return [partes[i] for i in indices if 0 <= i < len(partes)]
+
+
+class _Remontagem:
+    def __init__(self, total, grupo=False):
+        self.total = total
+        # começou no socket do grupo: completa pelo caminho do multicast mesmo que
+        # o último fragmento venha por unicast (retransmissão depois de um NACK)
+        self.grupo = grupo
+        self.partes = {}
+        self.bytes = 0
+        self.ultimo = time.time()
+        self.ultimo_nack = 0.0
+        self.nacks = 0
+
+    def faltando(self):
+        return [i for i in range(self.total) if i not in self.partes]
+
+
+class Remontador:
+    # buffer limitado de mensagens parcialmente recebidas, por (addr, msg_id)
+    def __init__(self, max_mensagens=MAX_REMONTAGENS, max_bytes=MAX_BYTES_REMONTAGEM,
+                 timeout=TIMEOUT_REMONTAGEM):
+        self.max_mensagens = max_mensagens
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._pendentes = OrderedDict()
+        self._concluidas = OrderedDict()
+        self._bytes = 0
+        self.descartadas = 0
+        self.lock = Lock()
+
+    def _descartar(self, chave):
+        rem = self._pendentes.pop(chave)
+        self._bytes -= rem.bytes
+        self.descartadas += 1
+
+    def receber(self, data, addr, grupo=False):
+        # devolve (mensagem, veio do grupo) quando completa, None enquanto faltar algo
+        msg_id, indice, total = CABECALHO_FRAGMENTO.unpack_from(data, 2)
+        pedaco = data[2 + CABECALHO_FRAGMENTO.size:]
+        chave = (tuple(addr), msg_id)
+        with self.lock:
+            # fragmento atrasado ou retransmitido de mensagem já entregue
+            if chave in self._concluidas:
+                return None
+            rem = self._pendentes.get(chave)
+            if rem is None:
+                if total == 0 or indice >= total:
+                    return None
+                rem = _Remontagem(total, grupo)
+                self._pendentes[chave] = rem
+            if indice >= rem.total or indice in rem.partes:
+                return None
+            # os fragmentos do envio original podem chegar ao grupo depois de um retransmitido
+            rem.grupo = rem.grupo or grupo
+            rem.partes[indice] = pedaco
+            rem.bytes += len(pedaco)
+            rem.ultimo = time.time()
+            # houve progresso: volta a permitir NACKs se ainda faltar algo
+            rem.nacks = 0
+            self._bytes += len(pedaco)
+
+            if len(rem.partes) == rem.total:
+                del self._pendentes[chave]
+                self._bytes -= rem.bytes
+                self._concluidas[chave] = True
+                while len(self._concluidas) > self.max_mensagens * 4:
+                    self._concluidas.popitem(last=False)
+                return b"".join(rem.partes[i] for i in range(rem.total)), rem.grupo
+
+            # estourou o buffer: descarta as remontagens mais antigas
+            while self._pendentes and (len(self._pendentes) > self.max_mensagens
+                                       or self._bytes > self.max_bytes):
+                self._descartar(next(iter(self._pendentes)))
+            return None
+
+    def pendencias(self, agora=None):
+        # expira remontagens antigas e devolve (addr, nack) para as que pararam
+        if agora is None:
+            agora = time.time()
+        nacks = []
+        with self.lock:
+            for chave, rem in list(self._pendentes.items()):
+                if agora - rem.ultimo > self.timeout:
+                    self._descartar(chave)
+                    continue
+                if rem.nacks >= MAX_NACKS_FRAGMENTOS:
+                    continue
+                parado = agora - rem.ultimo >= INTERVALO_NACK_FRAGMENTOS
+                if parado and agora - rem.ultimo_nack >= INTERVALO_NACK_FRAGMENTOS:
+                    rem.ultimo_nack = agora
+                    rem.nacks += 1
+                    addr, msg_id = chave
+                    nacks.append((addr, montar_nack(msg_id, rem.faltando())))
+        return nacks
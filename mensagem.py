@@ -1,10 +1,14 @@
+import sys
 import json
 import time
+import bisect
 import threading
+import statistics
+from array import array
 from threading import Lock
 from config import *
+from correlacao import Futuro
 
-lock_lamport = Lock()
 
 class Mensagem:
     def __init__(self, tipo, origem_id=None, origem_addr=None, origem_nome=None, lamport=0, conteudo=None):
@@ -14,21 +18,40 @@ class Mensagem:
         self.origem_nome = origem_nome
         self.lamport = lamport
         self.conteudo = conteudo
+        # conteúdo ainda codificado (codec binário); só é lido se alguém acessar
+        self.conteudo_bruto = None
+        # [sessão, seq] do multicast confiável; None nas demais mensagens
+        self.seq = None
+
+    @property
+    def conteudo(self):
+        if self.conteudo_bruto is not None:
+            bruto, self.conteudo_bruto = self.conteudo_bruto, None
+            self._conteudo = json.loads(bytes(bruto))
+        return self._conteudo
+
+    @conteudo.setter
+    def conteudo(self, valor):
+        self._conteudo = valor
+        self.conteudo_bruto = None
 
     def to_json(self):
-        return json.dumps({
+        data = {
             "tipo": self.tipo,
             "origem_id": self.origem_id,
             "origem_addr": self.origem_addr,
             "origem_nome": self.origem_nome,
             "lamport": self.lamport,
             "conteudo": self.conteudo
-        })
+        }
+        if self.seq is not None:
+            data["seq"] = self.seq
+        return json.dumps(data)
 
     @staticmethod
     def from_json(s):
         data = json.loads(s)
-        return Mensagem(
+        msg = Mensagem(
             tipo=data.get("tipo"),
             origem_id=data.get("origem_id"),
             origem_addr=data.get("origem_addr"),
@@ -36,67 +59,556 @@ class Mensagem:
             lamport=data.get("lamport", 0),
             conteudo=data.get("conteudo")
         )
+        msg.seq = data.get("seq")
+        return msg
 
-class Historico:
-    def __init__(self):
-        self.itens = []
+# chave compacta: lamport nos bits altos e origem_id + 1 nos 24 baixos (0 = sem origem),
+# então a ordem dos inteiros é a ordem (lamport, origem_id)
+BITS_ORIGEM = 24
+# estimativa por item das colunas (chave, nome, dois tempos e o ponteiro do texto), fora o texto
+BYTES_COLUNAS_ITEM = 40
+MASCARA_ORIGEM = (1 << BITS_ORIGEM) - 1
+SEM_NOME = -1
+SEM_TEMPO = float("nan")
+
+
+def chave_compacta(lamport, origem_id):
+    origem = 0 if origem_id is None else origem_id + 1
+    if not 0 <= origem <= MASCARA_ORIGEM or lamport < 0 or lamport >> (63 - BITS_ORIGEM):
+        raise ValueError(f"item fora da faixa do histórico compacto: ({lamport}, {origem_id})")
+    return (lamport << BITS_ORIGEM) | origem
+
+
+def chave_item(item):
+    return chave_compacta(item["lamport"], item["origem_id"])
+
+
+class HistoricoCompacto:
+    # histórico ordenado por (lamport, origem_id), guardado em colunas: uma chave int64 ordenada por
+    # item (serve para a ordem, a busca binária e as duplicatas), os tempos em
+    # array('d'), o remetente como índice numa tabela de nomes e só o texto como
+    # objeto. Os dicts são montados sob demanda em to_list e faltantes.
+    # Com um ArquivoFrio (armazenamento.py), a janela quente fica limitada por
+    # quantidade, bytes estimados e idade (ts_berkeley); o que passa disso sai pelo
+    # começo da ordem para segmentos comprimidos em disco, lidos de volta só quando
+    # uma sincronização, o comando 'historico' ou uma duplicata antiga precisam
+    def __init__(self, armazenamento=None, frio=None, max_mensagens=RETENCAO_MAX_MENSAGENS,
+                 max_bytes=RETENCAO_MAX_BYTES, max_idade=RETENCAO_MAX_IDADE,
+                 tamanho_segmento=TAMANHO_SEGMENTO_FRIO):
+        self._chaves = array("q")
+        self._nomes = array("l")
+        self._textos = []
+        self._ts_real = array("d")
+        self._ts_berkeley = array("d")
+        # nome -> índice em _tabela_nomes: cada remetente guardado uma vez
+        self._tabela_nomes = []
+        self._indice_nomes = {}
+        # lamports de cada origem, ordenados, para os resumos de anti-entropia
+        self._por_origem = {}
         self.lock = Lock()
+        self.armazenamento = armazenamento
+        self.frio = frio
+        self.max_mensagens = max_mensagens
+        self.max_bytes = max_bytes
+        self.max_idade = max_idade
+        self.tamanho_segmento = tamanho_segmento
+        # soma de sys.getsizeof dos textos quentes, para o limite de bytes
+        self._bytes_textos = 0
+        # origem -> [quantidade, maior lamport] do que já foi para os segmentos frios
+        self._frios_por_origem = {}
+        # um despejo por vez: as linhas dele continuam quentes até o segmento ser gravado
+        self._despejando = False
+        # depois de uma escrita que falhou, só tenta de novo passado ESPERA_FALHA_FRIO
+        self._falha_frio = None
+
+    def _nome(self, item):
+        if "origem_nome" not in item:
+            return SEM_NOME
+        nome = item["origem_nome"]
+        indice = self._indice_nomes.get(nome)
+        if indice is None:
+            indice = self._indice_nomes[nome] = len(self._tabela_nomes)
+            self._tabela_nomes.append(nome)
+        return indice
+
+    def _colunas(self, posicoes=None):
+        # cópia das colunas nas posições pedidas (todas, sem posicoes)
+        colunas = (self._chaves, self._nomes, self._textos, self._ts_real, self._ts_berkeley)
+        if posicoes is None:
+            return [coluna[:] for coluna in colunas]
+        return [list(map(coluna.__getitem__, posicoes)) for coluna in colunas]
+
+    def _montar(self, posicoes=None):
+        return self._dicts(self._colunas(posicoes))
+
+    def _dicts(self, colunas):
+        # dicts a partir das colunas copiadas, num laço só; a tabela de nomes só
+        # cresce, então pode ser lida sem o lock
+        tabela = self._tabela_nomes
+        itens = []
+        for chave, nome, texto, real, berkeley in zip(*colunas):
+            origem = chave & MASCARA_ORIGEM
+            # NaN (real != real) e SEM_NOME marcam o campo que não veio no item original
+            if nome != SEM_NOME and real == real and berkeley == berkeley:
+                itens.append({"lamport": chave >> BITS_ORIGEM, "origem_id": origem - 1 if origem else None,
+                              "origem_nome": tabela[nome], "texto": texto, "ts_real": real,
+                              "ts_berkeley": berkeley})
+                continue
+            item = {"lamport": chave >> BITS_ORIGEM, "origem_id": origem - 1 if origem else None}
+            if nome != SEM_NOME:
+                item["origem_nome"] = tabela[nome]
+            item["texto"] = texto
+            if real == real:
+                item["ts_real"] = real
+            if berkeley == berkeley:
+                item["ts_berkeley"] = berkeley
+            itens.append(item)
+        return itens
+
+    def _contem(self, chave):
+        i = bisect.bisect_left(self._chaves, chave)
+        return i < len(self._chaves) and self._chaves[i] == chave
+
+    def _registra_origem(self, lamport, origem_id):
+        lamports = self._por_origem.get(origem_id)
+        if lamports is None:
+            lamports = self._por_origem[origem_id] = array("q")
+        if not lamports or lamport >= lamports[-1]:
+            lamports.append(lamport)
+        else:
+            bisect.insort(lamports, lamport)
+
+    def _tem(self, chave):
+        if self._contem(chave):
+            return True
+        return self.frio is not None and chave <= self.frio.ultima_chave and self.frio.contem(chave)
+
+    def _insere(self, item):
+        chave = chave_compacta(item["lamport"], item["origem_id"])
+        if self._tem(chave):
+            return False
+        self._registra_origem(item["lamport"], item["origem_id"])
+        nome, texto = self._nome(item), item.get("texto")
+        ts_real, ts_berkeley = item.get("ts_real", SEM_TEMPO), item.get("ts_berkeley", SEM_TEMPO)
+        self._bytes_textos += sys.getsizeof(texto)
+        # caso comum: lamport crescente, entra direto no fim
+        if not self._chaves or chave > self._chaves[-1]:
+            self._chaves.append(chave)
+            self._nomes.append(nome)
+            self._textos.append(texto)
+            self._ts_real.append(ts_real)
+            self._ts_berkeley.append(ts_berkeley)
+        else:
+            pos = bisect.bisect_left(self._chaves, chave)
+            self._chaves.insert(pos, chave)
+            self._nomes.insert(pos, nome)
+            self._textos.insert(pos, texto)
+            self._ts_real.insert(pos, ts_real)
+            self._ts_berkeley.insert(pos, ts_berkeley)
+        return True
 
     def adiciona(self, lamport, origem_id, origem_nome, texto, ts_berkeley=None):
         with self.lock:
             if ts_berkeley is None:
                 ts_berkeley = time.time()
-            self.itens.append({
+            item = {
                 "lamport": lamport,
                 "origem_id": origem_id,
                 "origem_nome": origem_nome,
                 "texto": texto,
                 "ts_real": time.time(),
                 "ts_berkeley": ts_berkeley
-            })
-            self.itens.sort(key=lambda x: (x["lamport"], x["origem_id"]))
+            }
+            novo = self._insere(item)
+            if novo and self.armazenamento is not None:
+                self.armazenamento.anexar([item])
+            lote = self._reter() if novo else None
+        if lote is not None:
+            self._despejar(lote)
+        return novo
+
+    def contem(self, lamport, origem_id):
+        with self.lock:
+            return self._tem(chave_compacta(lamport, origem_id))
 
     def estende(self, lista):
         with self.lock:
-            for item in lista:
-                existe = any((it["lamport"] == item["lamport"] and 
-                            it["origem_id"] == item["origem_id"] and 
-                            it["texto"] == item["texto"]) for it in self.itens)
-                if not existe:
-                    self.itens.append(item)
-            self.itens.sort(key=lambda x: (x["lamport"], x["origem_id"]))
+            novos = self._mescla(lista)
+            if novos and self.armazenamento is not None:
+                self.armazenamento.anexar(novos)
+            lote = self._reter() if novos else None
+        if lote is not None:
+            self._despejar(lote)
+        return len(novos)
+
+    def _mescla(self, lista, conferir_frio=True):
+        # chamado com o lock tomado; devolve só os itens que eram novos
+        candidatos = sorted(((chave_compacta(item["lamport"], item["origem_id"]), item) for item in lista),
+                            key=lambda candidato: candidato[0])
+        # acima da maior chave guardada só pode haver repetição dentro do próprio lote
+        ultima = self._chaves[-1] if self._chaves else -1
+        ultima_fria = self.frio.ultima_chave if self.frio is not None and conferir_frio else -1
+        novos = []
+        chaves = []
+        for chave, item in candidatos:
+            if (chaves and chave == chaves[-1]) or (chave <= ultima and self._contem(chave)) or \
+                    (chave <= ultima_fria and self.frio.contem(chave)):
+                continue
+            chaves.append(chave)
+            novos.append(item)
+        if not novos:
+            return novos
+        for item in novos:
+            self._registra_origem(item["lamport"], item["origem_id"])
+        textos = [item.get("texto") for item in novos]
+        self._bytes_textos += sum(map(sys.getsizeof, textos))
+        valores = (chaves, [self._nome(item) for item in novos], textos,
+                   [item.get("ts_real", SEM_TEMPO) for item in novos],
+                   [item.get("ts_berkeley", SEM_TEMPO) for item in novos])
+        colunas = (self._chaves, self._nomes, self._textos, self._ts_real, self._ts_berkeley)
+        if chaves[0] > ultima:
+            for coluna, novos_valores in zip(colunas, valores):
+                coluna.extend(novos_valores)
+            return novos
+        # intercalado com o que já existe: cada coluna é remontada por fatias (cópia
+        # em C), sem um insert por item que moveria o array inteiro a cada vez
+        posicoes = [bisect.bisect_left(self._chaves, chave) for chave in chaves]
+        (self._chaves, self._nomes, self._textos, self._ts_real,
+         self._ts_berkeley) = (self._intercalar(coluna, posicoes, novos_valores)
+                               for coluna, novos_valores in zip(colunas, valores))
+        return novos
+
+    @staticmethod
+    def _sem(coluna, posicoes):
+        # a coluna sem as posições dadas (em ordem crescente), copiada por fatias
+        resultado = coluna[:0]
+        anterior = 0
+        for pos in posicoes:
+            resultado.extend(coluna[anterior:pos])
+            anterior = pos + 1
+        resultado.extend(coluna[anterior:])
+        return resultado
+
+    @staticmethod
+    def _intercalar(coluna, posicoes, valores):
+        resultado = coluna[:0]
+        anterior = 0
+        for pos, valor in zip(posicoes, valores):
+            resultado.extend(coluna[anterior:pos])
+            resultado.append(valor)
+            anterior = pos
+        resultado.extend(coluna[anterior:])
+        return resultado
+
+    def carregar(self):
+        # restaura o que está em disco sem regravar: os segmentos frios voltam só
+        # pelos descritores do manifesto, e a janela quente é remontada do snapshot
+        # (que só tem a janela do momento da compactação) mais a cauda do log
+        if self.armazenamento is None:
+            return 0
+        if self.frio is not None:
+            self.frio.restaurar(self.armazenamento.frios())
+        itens = self.armazenamento.carregar()
+        with self.lock:
+            frios = 0
+            if self.frio is not None:
+                frios = self.frio.mensagens
+                for segmento in self.frio.segmentos:
+                    for origem_id, (quantidade, _, maior) in segmento["por_origem"].items():
+                        resumo = self._frios_por_origem.setdefault(origem_id, [0, maior])
+                        resumo[0] += quantidade
+                        resumo[1] = max(resumo[1], maior)
+            # snapshot e cauda só têm o que não estava frio quando o snapshot foi
+            # feito, então a carga não precisa ler os segmentos para deduplicar
+            restaurados = frios + len(self._mescla(itens, conferir_frio=False))
+            lote = self._reter()
+        if lote is not None:
+            self._despejar(lote)
+        return restaurados
+
+    def _reter(self):
+        # chamado com o lock tomado; devolve o lote (chaves, itens) que passou dos
+        # limites, para o _despejar gravar depois de soltar o lock. O excesso sai
+        # em blocos de pelo menos tamanho_segmento, então a janela quente fica entre
+        # o limite menos um bloco e o limite, e cada segmento frio junta muitas mensagens
+        if self.frio is None or self._despejando or not self._chaves:
+            return None
+        if self._falha_frio is not None and time.monotonic() - self._falha_frio < ESPERA_FALHA_FRIO:
+            return None
+        n = len(self._chaves)
+        excesso = 0
+        if self.max_mensagens is not None and n > self.max_mensagens:
+            excesso = n - self.max_mensagens
+        if self.max_bytes is not None:
+            sobra = n * BYTES_COLUNAS_ITEM + self._bytes_textos - self.max_bytes
+            i = 0
+            while sobra > 0 and i < n:
+                sobra -= BYTES_COLUNAS_ITEM + sys.getsizeof(self._textos[i])
+                i += 1
+            excesso = max(excesso, i)
+        if self.max_idade is not None:
+            # pela ordem do histórico: para no primeiro item que ainda está dentro do prazo
+            limite = time.time() - self.max_idade
+            i = 0
+            while i < n and self._ts_berkeley[i] < limite:
+                i += 1
+            excesso = max(excesso, i)
+        if not excesso:
+            return None
+        k = min(n, max(excesso, self.tamanho_segmento))
+        self._despejando = True
+        return self._chaves[:k], self._montar(range(k))
+
+    def _despejar(self, lote):
+        # chamado sem o lock: a compressão e a escrita não seguram os handlers de
+        # chat. As linhas de cada segmento continuam quentes (contem, resumo e
+        # faltantes as veem) até ele estar gravado; se a escrita falhar, ficam onde estão
+        while lote is not None:
+            chaves, itens = lote
+            # despejos grandes (a entrada com um histórico longo) viram vários segmentos,
+            # para cada um ser lido de volta sem passar do MAX_DESCOMPRIMIDO
+            for inicio in range(0, len(itens), self.tamanho_segmento):
+                fim = inicio + self.tamanho_segmento
+                try:
+                    descritor = self.frio.escrever(itens[inicio:fim])
+                except OSError as e:
+                    print(f"[WARN] falha gravando segmento frio, as mensagens ficam na memória: {e}")
+                    with self.lock:
+                        self._falha_frio = time.monotonic()
+                        self._despejando = False
+                    return
+                with self.lock:
+                    self.frio.registrar(descritor)
+                    self._remover_quentes(chaves[inicio:fim], itens[inicio:fim])
+            with self.lock:
+                self._falha_frio = None
+                self._despejando = False
+                lote = self._reter()
+
+    def _remover_quentes(self, chaves, itens):
+        # tira da janela quente as linhas que acabaram de ir para o disco
+        for item in itens:
+            resumo = self._frios_por_origem.setdefault(item["origem_id"], [0, item["lamport"]])
+            resumo[0] += 1
+            resumo[1] = max(resumo[1], item["lamport"])
+        self._bytes_textos -= sum(sys.getsizeof(item.get("texto")) for item in itens)
+        k = len(chaves)
+        colunas = (self._chaves, self._nomes, self._textos, self._ts_real, self._ts_berkeley)
+        if self._chaves[:k] == chaves:
+            # caso comum: nada entrou no meio enquanto gravava, e as k menores chaves
+            # são, em cada origem, os lamports quentes mais baixos dela
+            despejados = {}
+            for item in itens:
+                despejados[item["origem_id"]] = item["lamport"]
+            for origem_id, maior in despejados.items():
+                lamports = self._por_origem[origem_id]
+                del lamports[:bisect.bisect_right(lamports, maior)]
+                if not lamports:
+                    del self._por_origem[origem_id]
+            for coluna in colunas:
+                del coluna[:k]
+            return
+        # mensagens atrasadas entraram entre as linhas do lote: remove uma a uma
+        despejados = {}
+        for item in itens:
+            despejados.setdefault(item["origem_id"], set()).add(item["lamport"])
+        for origem_id, lamports in despejados.items():
+            restantes = array("q", (lamport for lamport in self._por_origem[origem_id] if lamport not in lamports))
+            if restantes:
+                self._por_origem[origem_id] = restantes
+            else:
+                del self._por_origem[origem_id]
+        posicoes = [bisect.bisect_left(self._chaves, chave) for chave in chaves]
+        (self._chaves, self._nomes, self._textos, self._ts_real,
+         self._ts_berkeley) = (self._sem(coluna, posicoes) for coluna in colunas)
+
+    def descarregar(self):
+        if self.armazenamento is None:
+            return
+        self.armazenamento.descarregar()
+        if self.armazenamento.precisa_compactar():
+            self.compactar()
+
+    def compactar(self):
+        # sob o lock só as colunas quentes são copiadas; a parte fria entra no
+        # manifesto pelos descritores, e os dicts, o fsync dos segmentos e a escrita
+        # ficam fora dele. Um ArquivoFrio temporário some com o processo: aí o
+        # snapshot cobre tudo, com os segmentos lidos também fora do lock
+        frios = None
+        with self.lock:
+            if self.frio is not None and self.frio.temporario:
+                foto = self._foto(None)
+            else:
+                foto = (self._colunas(), {}, [])
+                if self.frio is not None:
+                    frios = self.frio.descritores()
+            ate = self.armazenamento.rotacionar()
+        itens = [item for lote in self._lotes(foto, LOTE_HISTORICO) for item in lote]
+        itens.sort(key=chave_item)
+        if frios:
+            self.frio.sincronizar(frios)
+        self.armazenamento.compactar(itens, ate, frios)
+
+    def ultimo_lamport(self):
+        with self.lock:
+            ultima = self._chaves[-1] if self._chaves else 0
+            if self.frio is not None:
+                ultima = max(ultima, self.frio.ultima_chave)
+            return ultima >> BITS_ORIGEM
+
+    def resumo(self):
+        # marca d'água por origem: {origem_id: [maior lamport, quantidade]}, somando a parte fria
+        with self.lock:
+            resumo = {str(origem_id): [maior, quantidade]
+                      for origem_id, (quantidade, maior) in self._frios_por_origem.items()}
+            for origem_id, lamports in self._por_origem.items():
+                marca = resumo.get(str(origem_id))
+                if marca is None:
+                    resumo[str(origem_id)] = [lamports[-1], len(lamports)]
+                else:
+                    marca[0] = max(marca[0], lamports[-1])
+                    marca[1] += len(lamports)
+            return resumo
+
+    def _foto(self, resumo):
+        # chamado com o lock tomado: o que falta ao dono do resumo (None: tudo), como
+        # colunas quentes copiadas, {origem: lamport a partir do qual a parte fria vai
+        # junto, ou None para toda} e a lista dos segmentos frios, que não mudam depois de gravados
+        frios = self._frios_por_origem
+        segmentos = list(self.frio.segmentos) if frios else []
+        if resumo is None:
+            return self._colunas(), dict.fromkeys(frios), segmentos
+        marcas = {origem_id: resumo.get(str(origem_id)) for origem_id in set(self._por_origem) | set(frios)}
+        # quantos itens frios estão até a marca: só vai ao disco quando a marca
+        # cai no meio da parte fria da origem
+        ate_marca = {}
+        if frios:
+            ate_marca = self.frio.contar_ate({origem_id: marca[0] for origem_id, marca in marcas.items()
+                                              if marca is not None and origem_id in frios
+                                              and marca[0] < frios[origem_id][1]})
+        posicoes = []
+        desde = {}
+        for origem_id, marca in marcas.items():
+            lamports = self._por_origem.get(origem_id, ())
+            fria = frios.get(origem_id)
+            if marca is None:
+                inicio, minimo = 0, None
+            else:
+                maior, quantidade = marca
+                inicio, minimo = bisect.bisect_right(lamports, maior), maior
+                # o outro lado tem buracos abaixo da marca: reenvia a origem
+                # inteira até ela e deixa a deduplicação de lá resolver
+                if quantidade < inicio + ate_marca.get(origem_id, fria[0] if fria else 0):
+                    inicio, minimo = 0, None
+            if fria is not None and (minimo is None or minimo < fria[1]):
+                desde[origem_id] = minimo
+            posicoes.extend(bisect.bisect_left(self._chaves, chave_compacta(lamport, origem_id))
+                            for lamport in lamports[inicio:])
+        posicoes.sort()
+        return self._colunas(posicoes), desde, segmentos if desde else []
+
+    def _lotes(self, foto, tamanho):
+        # chamado sem o lock: monta os dicts da parte quente e lê os segmentos frios
+        # um por vez, devolvendo lotes de até tamanho itens, sem ordem entre eles
+        colunas, desde, segmentos = foto
+        for inicio in range(0, len(colunas[0]), tamanho):
+            yield self._dicts([coluna[inicio:inicio + tamanho] for coluna in colunas])
+        lote = []
+        for itens in self.frio.percorrer(desde, segmentos) if desde else ():
+            lote.extend(itens)
+            while len(lote) >= tamanho:
+                yield lote[:tamanho]
+                lote = lote[tamanho:]
+        if lote:
+            yield lote
+
+    def lotes_faltantes(self, resumo, tamanho=LOTE_HISTORICO):
+        # itens que o dono do resumo ainda não tem (sem resumo, todos), em lotes: sob
+        # o lock só as colunas quentes são copiadas, e a memória fica em um lote por vez
+        with self.lock:
+            foto = self._foto(resumo)
+        yield from self._lotes(foto, tamanho)
+
+    def faltantes(self, resumo):
+        itens = [item for lote in self.lotes_faltantes(resumo) for item in lote]
+        itens.sort(key=chave_item)
+        return itens
+
+    def __len__(self):
+        with self.lock:
+            return len(self._chaves) + (self.frio.mensagens if self.frio is not None else 0)
 
     def to_list(self):
+        return self.faltantes(None)
+
+    def retencao(self):
+        # janela quente e parte fria, para o stats e as métricas
         with self.lock:
-            return list(self.itens)
+            estatisticas = {"quentes": len(self._chaves),
+                            "bytes_quentes": len(self._chaves) * BYTES_COLUNAS_ITEM + self._bytes_textos}
+        frio = self.frio.estatisticas() if self.frio is not None else {}
+        estatisticas.update({f"frios_{campo}": valor for campo, valor in frio.items()})
+        return estatisticas
+
+def filtrar_outliers(desvios):
+    # descarta desvios longe da mediana (relógio quebrado ou resposta muito atrasada)
+    valores = list(desvios.values())
+    mediana = statistics.median(valores)
+    mad = statistics.median(abs(v - mediana) for v in valores)
+    limite = max(FATOR_OUTLIER_BERKELEY * mad, MIN_OUTLIER_BERKELEY)
+    return {k: v for k, v in desvios.items() if abs(v - mediana) <= limite}
 
 class GerenciadorTempoBerkeley:
-    def __init__(self):
+    # a correção não salta para o valor novo: caminha até o alvo a no máximo
+    # TAXA_SLEW_BERKELEY segundos por segundo, então o tempo sincronizado nunca volta
+    def __init__(self, desvio=0.0):
+        # desvio artificial do relógio local, para simular máquinas dessincronizadas
+        self.desvio = desvio
         self.correcao = 0.0
+        self.alvo = 0.0
+        self._atualizado = time.time()
         self.lock = Lock()
         self.ultima_sincronizacao = 0
+
+    def relogio(self):
+        # relógio local sem correção: é o que vai nas respostas de tempo
+        return time.time() + self.desvio
+
+    def _avancar(self):
+        agora = time.time()
+        passo = TAXA_SLEW_BERKELEY * (agora - self._atualizado)
+        self._atualizado = agora
+        diferenca = self.alvo - self.correcao
+        if abs(diferenca) <= passo:
+            self.correcao = self.alvo
+        else:
+            self.correcao += passo if diferenca > 0 else -passo
         
     def get_tempo(self):
         with self.lock:
-            return time.time() + self.correcao
+            self._avancar()
+            return self.relogio() + self.correcao
             
     def get_correcao(self):
         with self.lock:
+            self._avancar()
             return self.correcao
             
     def set_correcao(self, nova_correcao):
         with self.lock:
+            self._avancar()
             if abs(nova_correcao) > LIMITE_CORRECAO_TEMPO:
                 nova_correcao = LIMITE_CORRECAO_TEMPO if nova_correcao > 0 else -LIMITE_CORRECAO_TEMPO
-            self.correcao = nova_correcao
+            self.alvo = nova_correcao
             self.ultima_sincronizacao = time.time()
             
     def ajustar_correcao(self, delta):
         with self.lock:
-            nova_correcao = self.correcao + delta
+            self._avancar()
+            nova_correcao = self.alvo + delta
             if abs(nova_correcao) > LIMITE_CORRECAO_TEMPO:
                 return
-            self.correcao = nova_correcao
+            self.alvo = nova_correcao
             self.ultima_sincronizacao = time.time()
             
     def formatar_tempo(self, timestamp=None):
@@ -104,8 +616,32 @@ class GerenciadorTempoBerkeley:
             timestamp = self.get_tempo()
         return time.strftime("%H:%M:%S", time.localtime(timestamp))
 
+class LoteChat:
+    # acumula os CHATs do remetente para saírem juntos num único BATCH
+    def __init__(self, max_itens=MAX_LOTE_CHAT, max_bytes=MAX_BYTES_LOTE_CHAT):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.itens = []
+        self.bytes = 0
+        self.lock = Lock()
+
+    def adicionar(self, lamport, texto):
+        # devolve (primeiro, cheio): o primeiro item arma a janela, cheio pede envio já
+        with self.lock:
+            self.itens.append([lamport, texto])
+            self.bytes += len(texto.encode("utf-8")) + 16
+            cheio = len(self.itens) >= self.max_itens or self.bytes >= self.max_bytes
+            return len(self.itens) == 1, cheio
+
+    def retirar(self):
+        with self.lock:
+            itens = self.itens
+            self.itens = []
+            self.bytes = 0
+            return itens
+
 class VotacaoChute:
-    def __init__(self, alvo_id, alvo_nome, iniciador_id, iniciador_nome):
+    def __init__(self, alvo_id, alvo_nome, iniciador_id, iniciador_nome, req=None):
         self.alvo_id = alvo_id
         self.alvo_nome = alvo_nome
         self.iniciador_id = iniciador_id
@@ -115,13 +651,25 @@ class VotacaoChute:
         self.encerrada = False
         self.resultado = None
         self.lock = threading.Lock()
+        # id da votação, ecoado nos votos; a apuração acorda a cada voto ou no resultado
+        self.req = req
+        self.apuracao = Futuro()
         
     def adicionar_voto(self, voter_id, voto):
         with self.lock:
             if self.encerrada:
                 return False
             self.votos[voter_id] = voto
-            return True
+        self.apuracao.resolver(voter_id, voto)
+        return True
+
+    def decidida(self, total_usuarios):
+        # mesma regra de verificar_resultado, sem encerrar a votação
+        with self.lock:
+            votos_favor = sum(1 for v in self.votos.values() if v)
+            votos_contra = sum(1 for v in self.votos.values() if not v)
+            return (self.encerrada or votos_favor >= VOTOS_MINIMOS + 1 or votos_contra > total_usuarios / 2
+                    or time.time() - self.inicio_tempo > DURACAO_VOTACAO)
             
     def verificar_resultado(self, total_usuarios):
         with self.lock:
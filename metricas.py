@@ -0,0 +1,269 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import *
+
+PREFIXO = "chat_"
+
+
+class Histograma:
+    # contagens por faixa (limites fixos), soma e total; observar() roda sob o lock do registro
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def quantil(self, q):
+        # limite superior da faixa onde cai o quantil; None se vazio ou acima do último limite
+        if not self.total:
+            return None
+        alvo = q * self.total
+        acumulado = 0
+        for limite, contagem in zip(self.limites, self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return limite
+        return None
+
+
+def memoria_residente():
+    # RSS do processo em bytes: /proc no Linux, pico do getrusage em outros Unix, None no Windows
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # o macOS informa em bytes, o resto em KiB
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+class Metricas:
+    # registro de métricas do nó: contadores por tipo de mensagem, histogramas de
+    # latência dos handlers, eleições e rodadas Berkeley, e medidores lidos só na
+    # hora da consulta (histórico, peers, memória). Cada mensagem custa duas
+    # leituras de relógio, um lock e uma busca binária nas faixas
+    def __init__(self):
+        self._lock = threading.Lock()
+        # tipo -> [mensagens, bytes]
+        self.recebidas = {}
+        self.enviadas = {}
+        # tipo -> Histograma da duração do handler
+        self.tratamento = {}
+        self.erros_tratamento = {}
+        # tipo -> destinos somados e Histograma da duração de cada difusão (mesma mensagem a vários peers)
+        self.destinos_difusao = {}
+        self.duracao_difusao = {}
+        self.eleicoes_iniciadas = 0
+        self.eleicoes_concluidas = 0
+        self.duracao_eleicao = Histograma(LIMITES_DURACAO_METRICAS)
+        self._inicio_eleicao = None
+        self.rodadas_berkeley = 0
+        self.duracao_berkeley = Histograma(LIMITES_DURACAO_METRICAS)
+        self.media_berkeley = 0.0
+        # nome -> (tipo prometheus, ajuda, função que devolve o valor ou {rótulo: valor})
+        self._medidores = {}
+        self._servidor = None
+
+    def recebida(self, tipo, tamanho, duracao):
+        with self._lock:
+            contagem = self.recebidas.get(tipo)
+            if contagem is None:
+                contagem = self.recebidas[tipo] = [0, 0]
+                self.tratamento[tipo] = Histograma(LIMITES_TRATAMENTO_METRICAS)
+            contagem[0] += 1
+            contagem[1] += tamanho
+            self.tratamento[tipo].observar(duracao)
+
+    def enviada(self, tipo, tamanho, vezes=1):
+        with self._lock:
+            contagem = self.enviadas.get(tipo)
+            if contagem is None:
+                contagem = self.enviadas[tipo] = [0, 0]
+            contagem[0] += vezes
+            contagem[1] += tamanho * vezes
+
+    def difusao(self, tipo, destinos, duracao):
+        with self._lock:
+            h = self.duracao_difusao.get(tipo)
+            if h is None:
+                h = self.duracao_difusao[tipo] = Histograma(LIMITES_TRATAMENTO_METRICAS)
+                self.destinos_difusao[tipo] = 0
+            self.destinos_difusao[tipo] += destinos
+            h.observar(duracao)
+
+    def erro_tratamento(self, tipo):
+        with self._lock:
+            self.erros_tratamento[tipo] = self.erros_tratamento.get(tipo, 0) + 1
+
+    def eleicao_iniciada(self):
+        # a duração conta da primeira eleição aberta até um coordenador ser conhecido
+        with self._lock:
+            self.eleicoes_iniciadas += 1
+            if self._inicio_eleicao is None:
+                self._inicio_eleicao = time.perf_counter()
+
+    def eleicao_concluida(self):
+        with self._lock:
+            if self._inicio_eleicao is None:
+                return
+            self.duracao_eleicao.observar(time.perf_counter() - self._inicio_eleicao)
+            self._inicio_eleicao = None
+            self.eleicoes_concluidas += 1
+
+    def rodada_berkeley(self, duracao, media):
+        with self._lock:
+            self.rodadas_berkeley += 1
+            self.duracao_berkeley.observar(duracao)
+            self.media_berkeley = media
+
+    def medidor(self, nome, ajuda, funcao, tipo="gauge"):
+        self._medidores[nome] = (tipo, ajuda, funcao)
+
+    def _ler_medidores(self):
+        valores = {}
+        for nome, (tipo, ajuda, funcao) in self._medidores.items():
+            try:
+                valores[nome] = (tipo, ajuda, funcao())
+            except Exception:
+                continue
+        return valores
+
+    def exposicao(self):
+        # texto no formato de exposição do Prometheus (0.0.4)
+        linhas = []
+
+        def cabecalho(nome, tipo, ajuda):
+            linhas.append(f"# HELP {PREFIXO}{nome} {ajuda}")
+            linhas.append(f"# TYPE {PREFIXO}{nome} {tipo}")
+
+        def amostra(nome, valor, rotulos=""):
+            linhas.append(f"{PREFIXO}{nome}{{{rotulos}}} {valor}" if rotulos else f"{PREFIXO}{nome} {valor}")
+
+        def histograma(nome, h, rotulos=""):
+            separador = "," if rotulos else ""
+            acumulado = 0
+            for limite, contagem in zip(h.limites, h.contagens):
+                acumulado += contagem
+                amostra(f"{nome}_bucket", acumulado, f'{rotulos}{separador}le="{limite}"')
+            amostra(f"{nome}_bucket", h.total, f'{rotulos}{separador}le="+Inf"')
+            amostra(f"{nome}_sum", h.soma, rotulos)
+            amostra(f"{nome}_count", h.total, rotulos)
+
+        medidores = self._ler_medidores()
+        with self._lock:
+            for nome, contagens, indice, ajuda in (
+                    ("mensagens_recebidas_total", self.recebidas, 0, "Mensagens recebidas por tipo"),
+                    ("bytes_recebidos_total", self.recebidas, 1, "Bytes recebidos por tipo (mensagem remontada)"),
+                    ("mensagens_enviadas_total", self.enviadas, 0, "Mensagens enviadas por tipo"),
+                    ("bytes_enviados_total", self.enviadas, 1, "Bytes enviados por tipo")):
+                cabecalho(nome, "counter", ajuda)
+                for tipo, contagem in sorted(contagens.items()):
+                    amostra(nome, contagem[indice], f'tipo="{tipo}"')
+            cabecalho("tratamento_segundos", "histogram", "Duração do handler por tipo de mensagem")
+            for tipo, h in sorted(self.tratamento.items()):
+                histograma("tratamento_segundos", h, f'tipo="{tipo}"')
+            cabecalho("erros_tratamento_total", "counter", "Exceções nos handlers por tipo de mensagem")
+            for tipo, erros in sorted(self.erros_tratamento.items()):
+                amostra("erros_tratamento_total", erros, f'tipo="{tipo}"')
+            cabecalho("difusao_segundos", "histogram", "Duração de cada envio da mesma mensagem a vários peers")
+            for tipo, h in sorted(self.duracao_difusao.items()):
+                histograma("difusao_segundos", h, f'tipo="{tipo}"')
+            cabecalho("difusao_destinos_total", "counter", "Destinos somados das difusões por tipo")
+            for tipo, destinos in sorted(self.destinos_difusao.items()):
+                amostra("difusao_destinos_total", destinos, f'tipo="{tipo}"')
+            cabecalho("eleicoes_iniciadas_total", "counter", "Eleições iniciadas por este nó")
+            amostra("eleicoes_iniciadas_total", self.eleicoes_iniciadas)
+            cabecalho("eleicoes_concluidas_total", "counter", "Eleições que terminaram com um coordenador conhecido")
+            amostra("eleicoes_concluidas_total", self.eleicoes_concluidas)
+            cabecalho("eleicao_segundos", "histogram", "Da abertura da eleição até conhecer o coordenador")
+            histograma("eleicao_segundos", self.duracao_eleicao)
+            cabecalho("rodadas_berkeley_total", "counter", "Rodadas Berkeley feitas como coordenador")
+            amostra("rodadas_berkeley_total", self.rodadas_berkeley)
+            cabecalho("rodada_berkeley_segundos", "histogram", "Duração das rodadas Berkeley")
+            histograma("rodada_berkeley_segundos", self.duracao_berkeley)
+            cabecalho("media_berkeley_segundos", "gauge", "Média dos desvios na última rodada Berkeley")
+            amostra("media_berkeley_segundos", self.media_berkeley)
+        for nome, (tipo, ajuda, valor) in sorted(medidores.items()):
+            if valor is None:
+                continue
+            cabecalho(nome, tipo, ajuda)
+            if isinstance(valor, dict):
+                for rotulo, v in sorted(valor.items()):
+                    amostra(nome, v, rotulo)
+            else:
+                amostra(nome, valor)
+        return "\n".join(linhas) + "\n"
+
+    def resumo(self):
+        # linhas do comando 'stats' do REPL
+        medidores = self._ler_medidores()
+        linhas = [f"{'tipo':<18} {'receb.':>8} {'bytes':>10} {'enviad.':>8} {'bytes':>10} {'p50 ms':>8} {'p99 ms':>8}"]
+        with self._lock:
+            for tipo in sorted(set(self.recebidas) | set(self.enviadas)):
+                rec = self.recebidas.get(tipo, [0, 0])
+                env = self.enviadas.get(tipo, [0, 0])
+                h = self.tratamento.get(tipo)
+                p50 = h.quantil(0.5) if h else None
+                p99 = h.quantil(0.99) if h else None
+                linhas.append(f"{tipo:<18} {rec[0]:>8} {rec[1]:>10} {env[0]:>8} {env[1]:>10} "
+                              f"{'-' if p50 is None else f'{p50 * 1000:.2f}':>8} "
+                              f"{'-' if p99 is None else f'{p99 * 1000:.2f}':>8}")
+            erros = sum(self.erros_tratamento.values())
+            for tipo, h in sorted(self.duracao_difusao.items()):
+                linhas.append(f"difusão {tipo}: {h.total}x, média {self.destinos_difusao[tipo] / h.total:.1f} "
+                              f"destinos em {h.soma / h.total * 1000:.3f} ms")
+            eleicao = self.duracao_eleicao
+            linhas.append(f"eleições: {self.eleicoes_iniciadas} iniciadas, {self.eleicoes_concluidas} concluídas"
+                          + (f", média {eleicao.soma / eleicao.total:.3f}s" if eleicao.total else ""))
+            berkeley = self.duracao_berkeley
+            linhas.append(f"berkeley: {self.rodadas_berkeley} rodadas"
+                          + (f", média {berkeley.soma / berkeley.total * 1000:.1f} ms" if berkeley.total else ""))
+        for nome, (_, _, valor) in sorted(medidores.items()):
+            if isinstance(valor, dict):
+                valor = ", ".join(f"{rotulo} {v}" for rotulo, v in sorted(valor.items()))
+            linhas.append(f"{nome}: {valor}")
+        linhas.append(f"erros nos handlers: {erros}")
+        return linhas
+
+    def servir(self, endereco, porta):
+        # endpoint HTTP local para o Prometheus raspar (GET /metrics), num thread daemon
+        metricas = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                corpo = metricas.exposicao().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer((endereco, porta), Handler)
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, daemon=True, name="no-metricas").start()
+
+    def parar(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
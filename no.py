@@ -1,24 +1,47 @@
+import os
 import socket
 import threading
 import time
 import argparse
+import functools
 import random
 from config import *
-from mensagem import Mensagem, Historico, lock_lamport, GerenciadorTempoBerkeley, VotacaoChute
+from mensagem import Mensagem, HistoricoCompacto, GerenciadorTempoBerkeley, VotacaoChute, LoteChat, filtrar_outliers
+from armazenamento import LogHistorico, ArquivoFrio
+from codec import codificar, decodificar, ler_origem, escolher_codec, CODEC_JSON, CODECS_SUPORTADOS
+from confiavel import EmissorConfiavel, ReceptorConfiavel, TIPOS_CONFIAVEIS
+from detector_falhas import DetectorPhiAccrual
+from correlacao import Correlacionador
+from agendador import Agendador
+from recepcao import FilaRecepcao
+from transporte import TransporteUDP
+from metricas import Metricas, memoria_residente
+from diagnostico import Amostrador, Rastreador, RastreadorNulo
+from swim import MembrosSwim
+from fragmentacao import Fragmentador, Remontador, eh_fragmento, eh_nack, ler_nack
 import json
 
 class No:
-    def __init__(self, porta, nome=None):
+    def __init__(self, porta, nome=None, dados=None, lote_chat=LOTE_CHAT, eleicao=MODO_ELEICAO,
+                 membros=MODO_MEMBROS, desvio_relogio=0.0, transporte=None, agendador=None,
+                 intervalo_berkeley=INTERVALO_SINCRONIZACAO_BERKELEY, porta_metricas=None, rastreio=None,
+                 recepcao=None):
         self.nome = nome or f"No:{porta}"
         self.porta = porta
-        self.ip = ENDERECO_PADRAO_BIND if TESTE_MAQUINA_UNICA_LOCAL else socket.gethostbyname(socket.gethostname())
-        self.addr = (self.ip, self.porta)
+        # spans por mensagem e espera nos locks (diagnostico.Rastreador, --trace); sem ele, nada é medido
+        self.rastreio = rastreio or RastreadorNulo()
+        if transporte is None:
+            ip = ENDERECO_PADRAO_BIND if TESTE_MAQUINA_UNICA_LOCAL else socket.gethostbyname(socket.gethostname())
+            transporte = TransporteUDP(ip, porta)
+        # sockets UDP reais ou uma ponta da rede simulada (transporte.RedeSimulada)
+        self.transporte = transporte
+        self.addr = transporte.addr
+        self.ip = self.addr[0]
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((self.ip, self.porta))
-
-        self.msock = criar_socket_multicast(endereco_bind=self.ip, porta=PORTA_MULTICAST)
+        self.fragmentador = Fragmentador()
+        self.remontador = Remontador()
+        self.emissor = EmissorConfiavel()
+        self.receptor = ReceptorConfiavel()
 
         self.eh_coordenador = False
         self.coordenador_id = None
@@ -28,22 +51,39 @@ class No:
         self.id = None
         self.proximo_id = 1
         self.peers = {}
-        self.lock_peers = threading.Lock()
+        self.lock_peers = self.rastreio.lock(threading.Lock(), "lock_peers")
 
-        self.historico = Historico()
-        self.lamport = 0
+        armazenamento = LogHistorico(dados) if dados else None
+        # segmentos frios da retenção; com --dados ficam junto do log e entram no
+        # manifesto dele, sem --dados num temporário
+        diretorio_frio = DIRETORIO_FRIO or (os.path.join(dados, "frio") if dados else None)
+        self.frio = ArquivoFrio(diretorio_frio)
+        self.historico = HistoricoCompacto(armazenamento=armazenamento, frio=self.frio)
+        self.historico.lock = self.rastreio.lock(self.historico.lock, "historico")
+        restaurados = self.historico.carregar()
+        if restaurados:
+            print(f"[INFO] {restaurados} mensagens restauradas de {dados}")
+        # continua o relógio de onde o histórico salvo parou
+        self.lamport = self.historico.ultimo_lamport()
+        self.lock_lamport = self.rastreio.lock(threading.Lock(), "lock_lamport")
 
-        self.gerenciador_tempo = GerenciadorTempoBerkeley()
+        self.gerenciador_tempo = GerenciadorTempoBerkeley(desvio_relogio)
+        self.lote_chat = LoteChat() if lote_chat else None
 
         self.ultimo_heartbeat = time.time()
         self.lock_heartbeat = threading.Lock()
+        self.detector = DetectorPhiAccrual()
+        # última vez que este nó mandou algo ao grupo (para o heartbeat só quando ocioso)
+        self._ultimo_multicast = 0.0
 
-        self._eleicao_recebeu_ok = False
-        self._em_eleicao = False
+        # requisições à espera de resposta (JOIN, ELECTION, TIME_REQUEST): a
+        # resposta ecoa o "req" e acorda quem espera assim que chega
+        self.requisicoes = Correlacionador()
+        self._req_entrada = None
 
-        self._respostas_tempo = {}
-        self._lock_tempo = threading.Lock()
-        self._aguardando_respostas_tempo = False
+        self._em_eleicao = False
+        self.modo_eleicao = eleicao
+        self._evento_coordenador = threading.Event()
 
         self.votacao_ativa = None
         self.lock_votacoes = threading.Lock()
@@ -51,54 +91,306 @@ class No:
         self.usuarios_chutados = {}
         self.lock_chutados = threading.Lock()
         
-        # controle para sincronização periódica de peers (coordenador)
-        self._peers_sync_running = False
-        self._peers_sync_lock = threading.Lock()
+        # versão da lista de peers: a época muda a cada coordenador, a versão a cada delta
+        self.epoca_peers = 0
+        self.versao_peers = 0
+        self._deltas_pendentes = {}
+        self._ultimo_pedido_peers = 0.0
+        # serializa mudança de versão e envio do delta no coordenador
+        self._lock_versao_peers = threading.Lock()
+        self.swim = MembrosSwim(self) if membros == "swim" else None
 
         self.rodando = True
+        # runtime assíncrono (runtime_async.RuntimeAsync); None no modo thread
+        self.runtime = None
+        # no modo thread, todos os timers e tarefas de fundo passam pelo agendador;
+        # nós simulados no mesmo processo podem compartilhar um só
+        self._agendador_proprio = agendador is None
+        self.agendador = agendador or Agendador()
+        # fila entre os listeners e o processamento (recepcao.FilaRecepcao); também compartilhável
+        self._recepcao_propria = recepcao is None
+        self.recepcao = recepcao or FilaRecepcao()
+        # endereço -> origem_id visto no último cabeçalho que veio direto dele
+        self._ids_por_endereco = {}
+        self._timer_berkeley = None
+        self.intervalo_berkeley = intervalo_berkeley
+        # marcado quando o nó para (saída ou chute); o modo sem REPL espera por ele
+        self._parado = threading.Event()
+        # contadores por tipo, latência dos handlers etc.; --metricas expõe no formato Prometheus
+        self.metricas = Metricas()
+        self.porta_metricas = porta_metricas
+        self._registrar_medidores()
+
+    def _registrar_medidores(self):
+        # lidos só quando alguém consulta as métricas
+        m = self.metricas
+        m.medidor("historico_mensagens", "Mensagens no histórico", lambda: len(self.historico))
+        m.medidor("peers", "Participantes conhecidos", lambda: len(self.peers))
+        m.medidor("coordenador", "1 se este nó é o coordenador", lambda: int(self.eh_coordenador))
+        m.medidor("correcao_relogio_segundos", "Correção Berkeley aplicada ao relógio local",
+                  self.gerenciador_tempo.get_correcao)
+        m.medidor("memoria_residente_bytes", "Memória residente do processo", memoria_residente)
+        m.medidor("erros_socket_total", "Erros de socket por operação",
+                  lambda: {'operacao="envio"': self.transporte.erros_envio,
+                           'operacao="recepcao"': self.transporte.erros_recepcao}, tipo="counter")
+        # fila cheia no kernel: datagramas descartados antes de o listener ler (só Linux)
+        for nome, campo, ajuda, tipo in (
+                ("descartes_kernel_total", "descartes", "Datagramas descartados pelo kernel com a fila cheia", "counter"),
+                ("fila_kernel_bytes", "fila_bytes", "Bytes esperando na fila de recepção do kernel", "gauge"),
+                ("rcvbuf_bytes", "rcvbuf", "SO_RCVBUF efetivo do socket", "gauge")):
+            m.medidor(nome, ajuda, lambda campo=campo: {f'socket="{s}"': dados[campo] for s, dados in
+                                                        self.transporte.estatisticas_kernel().items()} or None,
+                      tipo=tipo)
+        # fila entre os listeners e os trabalhadores de recepção
+        for nome, campo, ajuda, tipo in (
+                ("fila_recepcao_mensagens", "profundidade", "Datagramas esperando um trabalhador de recepção", "gauge"),
+                ("fila_recepcao_descartes_total", "descartadas", "Datagramas descartados com a fila de recepção cheia", "counter"),
+                ("fila_recepcao_bloqueios_total", "bloqueios", "Vezes em que o listener esperou a fila de recepção", "counter"),
+                ("fila_recepcao_processadas_total", "processadas", "Datagramas tirados da fila pelos trabalhadores", "counter"),
+                ("fila_recepcao_espera_segundos_total", "espera_segundos", "Tempo somado dos datagramas na fila", "counter"),
+                ("fila_recepcao_espera_maxima_segundos", "espera_maxima", "Maior tempo de um datagrama na fila", "gauge")):
+            m.medidor(nome, ajuda, lambda campo=campo: self.recepcao.estatisticas()[campo], tipo=tipo)
+        # janela quente do histórico e o que foi para os segmentos frios
+        for nome, campo, ajuda, tipo in (
+                ("historico_quente_mensagens", "quentes", "Mensagens na janela quente do histórico", "gauge"),
+                ("historico_quente_bytes", "bytes_quentes", "Bytes estimados da janela quente", "gauge"),
+                ("historico_frio_mensagens", "frios_mensagens", "Mensagens nos segmentos frios em disco", "gauge"),
+                ("historico_frio_segmentos", "frios_segmentos", "Segmentos frios em disco", "gauge"),
+                ("historico_frio_bytes", "frios_bytes", "Bytes comprimidos dos segmentos frios", "gauge"),
+                ("historico_paginacoes_total", "frios_paginacoes", "Segmentos frios lidos de volta do disco", "counter")):
+            m.medidor(nome, ajuda, lambda campo=campo: self.historico.retencao()[campo], tipo=tipo)
 
     def incrementa_lamport(self):
-        with lock_lamport:
+        with self.lock_lamport:
             self.lamport += 1
             return self.lamport
 
     def atualiza_lamport_recebendo(self, valor):
-        with lock_lamport:
+        with self.lock_lamport:
             self.lamport = max(self.lamport, valor) + 1
             return self.lamport
 
+    def _enviar_dados(self, data, destino):
+        for parte in self.fragmentador.fragmentar(data):
+            self.transporte.enviar(parte, destino)
+
+    def _codec_para(self, addr=None):
+        # binário (e comprimido) só para quem anunciou suporte; no multicast, todos precisam ter anunciado
+        with self.lock_peers:
+            if addr is None:
+                listas = [info.get("codecs") for pid, info in self.peers.items() if pid != self.id]
+            else:
+                addr = tuple(addr)
+                listas = [info.get("codecs") for info in self.peers.values()
+                          if tuple(info.get("addr") or ()) == addr]
+        return escolher_codec(listas)
+
+    def _agrupar_por_codec(self, addrs):
+        # codec -> destinos, com a mesma regra do _codec_para numa passada só pelos peers
+        with self.lock_peers:
+            codecs = {}
+            for info in self.peers.values():
+                codecs.setdefault(tuple(info.get("addr") or ()), []).append(info.get("codecs"))
+        grupos = {}
+        for addr in addrs:
+            addr = tuple(addr)
+            grupos.setdefault(escolher_codec(codecs.get(addr, ())), []).append(addr)
+        return grupos
+
     def multicast_enviar(self, mensagem):
-        data = mensagem.to_json().encode('utf-8')
-        self.sock.sendto(data, (GRUPO_MULTICAST, PORTA_MULTICAST))
+        with self.rastreio.span("enviar", mensagem.tipo):
+            seq = None
+            if mensagem.tipo in TIPOS_CONFIAVEIS:
+                seq = self.emissor.numerar(mensagem)
+            data = codificar(mensagem, self._codec_para())
+            if seq is not None:
+                self.emissor.guardar(seq, data)
+            self.metricas.enviada(mensagem.tipo, len(data))
+            self._enviar_dados(data, (GRUPO_MULTICAST, PORTA_MULTICAST))
+        self._ultimo_multicast = time.time()
 
     def unicast_enviar(self, addr, mensagem):
         try:
-            data = mensagem.to_json().encode('utf-8')
-            self.sock.sendto(data, tuple(addr))
+            with self.rastreio.span("enviar", mensagem.tipo):
+                data = codificar(mensagem, self._codec_para(addr))
+                self.metricas.enviada(mensagem.tipo, len(data))
+                self._enviar_dados(data, tuple(addr))
         except Exception as e:
             print(f"[WARN] falha ao enviar para {addr}: {e}")
 
-    def listener_multicast(self):
-        while self.rodando:
-            try:
-                data, addr = self.msock.recvfrom(TAMANHO_BUFFER)
-                msg = Mensagem.from_json(data.decode('utf-8'))
-                if msg.origem_addr and tuple(msg.origem_addr) == self.addr:
+    def unicast_difundir(self, addrs, mensagem):
+        # a mesma mensagem para vários peers: codifica e fragmenta uma vez por codec
+        # e só repete o sendto; devolve {destino: exceção} dos envios que falharam
+        inicio = time.perf_counter()
+        erros = {}
+        with self.rastreio.span("difundir", mensagem.tipo):
+            for codec, destinos in self._agrupar_por_codec(addrs).items():
+                try:
+                    data = codificar(mensagem, codec)
+                    partes = self.fragmentador.fragmentar(data)
+                except Exception as e:
+                    erros.update((destino, e) for destino in destinos)
                     continue
-                self.tratar_mensagem_multicast(msg, addr)
-            except Exception as e:
-                if self.rodando:
-                    print(f"[ERROR] erro listener_multicast: {e}")
+                enviados = 0
+                for destino in destinos:
+                    try:
+                        for parte in partes:
+                            self.transporte.enviar(parte, destino)
+                        enviados += 1
+                    except Exception as e:
+                        erros[destino] = e
+                self.metricas.enviada(mensagem.tipo, len(data), enviados)
+        self.metricas.difusao(mensagem.tipo, len(addrs), time.perf_counter() - inicio)
+        for destino, e in erros.items():
+            print(f"[WARN] falha ao enviar {mensagem.tipo} para {destino}: {e}")
+        return erros
+
+    def _receber_dados(self, data, addr, grupo=False):
+        # devolve (mensagem completa, veio do grupo), ou None enquanto faltarem fragmentos
+        if eh_nack(data):
+            msg_id, indices = ler_nack(data)
+            for parte in self.fragmentador.retransmitir(msg_id, indices):
+                self.metricas.enviada("FRAGMENTO", len(parte))
+                self.transporte.enviar(parte, addr)
+            return None
+        if eh_fragmento(data):
+            return self.remontador.receber(data, addr, grupo)
+        return data, grupo
+
+    def _enfileirar_multicast(self, data, addr):
+        # no listener: descarta o eco do próprio envio ao grupo e enfileira o resto
+        if tuple(addr) == self.addr:
+            return
+        self.recepcao.enfileirar(self._origem_recepcao(data, addr), self.processar_multicast, data, addr)
+
+    def _enfileirar_unicast(self, data, addr):
+        # mesma chave do multicast: tudo de uma origem vai para o mesmo trabalhador
+        self.recepcao.enfileirar(self._origem_recepcao(data, addr), self.processar_unicast, data, addr)
+
+    def _origem_recepcao(self, data, addr):
+        # a chave é o origem_id do cabeçalho, então uma mensagem repassada pelo
+        # coordenador (reparo de lacuna) cai no trabalhador das que vieram direto
+        # da origem. Sem id no cabeçalho (fragmento, JSON, nó ainda sem id) vale o
+        # id visto por último vindo daquele endereço, e só por fim o endereço
+        origem = ler_origem(data)
+        if origem is not None and origem[0] is not None:
+            origem_id, ip, porta = origem
+            if porta == addr[1]:
+                try:
+                    if ip == socket.inet_aton(addr[0]):
+                        self._ids_por_endereco[addr] = origem_id
+                except OSError:
+                    pass
+            return origem_id
+        return self._ids_por_endereco.get(addr, addr)
+
+    def processar_multicast(self, data, addr):
+        # datagramas que eu mesmo enviei ao grupo
+        if tuple(addr) == self.addr:
+            return
+        with self.rastreio.span("receber", "multicast"):
+            self._verificar_origem_coordenador(addr)
+            recebido = self._receber_dados(data, addr, grupo=True)
+            if recebido is None:
+                return
+            self._entregar_do_grupo(recebido[0], addr)
+
+    def _entregar_do_grupo(self, data, addr):
+        # no formato binário só o cabeçalho é lido aqui
+        with self.rastreio.span("decodificar"):
+            msg = decodificar(data)
+        if msg.origem_addr and tuple(msg.origem_addr) == self.addr:
+            return
+        # duplicata de mensagem confiável (ex.: chegou antes por retransmissão)
+        if msg.seq is not None and not self.receptor.aceitar(msg.origem_addr, msg.seq[0], msg.seq[1], data):
+            return
+        self._tratar(self.tratar_mensagem_multicast, msg, addr, len(data))
 
-    def listener_unicast(self):
-        while self.rodando:
+    def processar_unicast(self, data, addr):
+        with self.rastreio.span("receber", "unicast"):
+            self._verificar_origem_coordenador(addr)
+            recebido = self._receber_dados(data, addr)
+            if recebido is None:
+                return
+            data, grupo = recebido
+            if grupo:
+                # mensagem do grupo completada por um fragmento reenviado por unicast
+                self._entregar_do_grupo(data, addr)
+                return
+            with self.rastreio.span("decodificar"):
+                msg = decodificar(data)
+            if msg.seq is not None:
+                # retransmissão de uma mensagem multicast confiável
+                if msg.origem_addr and self.receptor.aceitar(msg.origem_addr, msg.seq[0], msg.seq[1], data):
+                    self._tratar(self.tratar_mensagem_multicast, msg, addr, len(data))
+                return
+            self._tratar(self.tratar_mensagem_unicast, msg, addr, len(data))
+
+    def _tratar(self, tratar, msg, addr, tamanho):
+        # conta a mensagem por tipo e mede o handler
+        inicio = time.perf_counter()
+        try:
+            with self.rastreio.span("tratar", msg.tipo):
+                tratar(msg, addr)
+        except Exception:
+            self.metricas.erro_tratamento(msg.tipo)
+            raise
+        finally:
+            self.metricas.recebida(msg.tipo, tamanho, time.perf_counter() - inicio)
+
+    def pedir_fragmentos(self):
+        # pede de volta só os fragmentos que faltam nas remontagens paradas
+        for addr, nack in self.remontador.pendencias():
             try:
-                data, addr = self.sock.recvfrom(TAMANHO_BUFFER)
-                msg = Mensagem.from_json(data.decode('utf-8'))
-                self.tratar_mensagem_unicast(msg, addr)
+                self.metricas.enviada("NACK_FRAGMENTO", len(nack))
+                self.transporte.enviar(nack, addr)
             except Exception as e:
                 if self.rodando:
-                    print(f"[ERROR] erro listener_unicast: {e}")
+                    print(f"[WARN] falha ao enviar NACK para {addr}: {e}")
+
+    def reparar_multicast(self):
+        # anuncia o último seq depois de uma pausa, para quem perdeu a cauda
+        seq = self.emissor.anuncio_pendente()
+        if seq is not None and self.id is not None:
+            status = Mensagem("SEQ_STATUS", origem_id=self.id, origem_addr=self.addr,
+                              origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                              conteudo={"sessao": self.emissor.sessao, "seq": seq})
+            self.multicast_enviar(status)
+        nacks, desistiu = self.receptor.pendencias()
+        for origem_addr, sessao, seqs, tentativas in nacks:
+            # primeiro pede à origem; se ela não responder, a qualquer nó que tenha a mensagem
+            destino = origem_addr
+            if tentativas >= 2 and self.coordenador_addr and tuple(self.coordenador_addr) != self.addr:
+                destino = self.coordenador_addr
+            nack = Mensagem("NACK_SEQ", origem_id=self.id, origem_addr=self.addr,
+                            origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                            conteudo={"origem": list(origem_addr), "sessao": sessao, "seqs": seqs})
+            self.unicast_enviar(destino, nack)
+        # perdas que o NACK não recuperou ficam para a anti-entropia do histórico:
+        # com o coordenador, ou, sendo ele, com a própria origem (ou outro peer, se ela saiu)
+        if desistiu and not self.eh_coordenador:
+            self.sincronizar_historico(self.coordenador_addr)
+        elif desistiu:
+            with self.lock_peers:
+                outros = [tuple(peer["addr"]) for pid, peer in self.peers.items() if pid != self.id]
+            for origem_addr in desistiu:
+                if tuple(origem_addr) in outros:
+                    self.sincronizar_historico(origem_addr)
+                elif outros:
+                    self.sincronizar_historico(random.choice(outros))
+
+    def _disparar(self, alvo, *args):
+        # tarefas de fundo: pool do agendador no modo thread, o loop de eventos no modo async
+        if self.runtime is not None:
+            self.runtime.disparar(alvo, *args)
+        else:
+            self.agendador.executar(alvo, *args)
+
+    def _agendar(self, atraso, funcao, *args):
+        # executa funcao uma vez depois do atraso, sem prender quem chamou
+        if self.runtime is not None:
+            return self.runtime.agendar(atraso, funcao, *args)
+        return self.agendador.agendar(atraso, funcao, *args)
 
     def tratar_mensagem_multicast(self, msg, addr):
         tipo = msg.tipo
@@ -108,37 +400,48 @@ class No:
             if self.eh_coordenador:
                 novo_id = self.proximo_id
                 self.proximo_id += 1
-                with self.lock_peers:
-                    self.peers[novo_id] = {
-                        "addr": tuple(msg.origem_addr),
-                        "nome": msg.origem_nome
-                    }
+                self._alterar_peers("entrou", novo_id, {
+                    "addr": tuple(msg.origem_addr),
+                    "nome": msg.origem_nome,
+                    "codecs": (msg.conteudo or {}).get("codecs", [CODEC_JSON])
+                })
                 payload = {
                     "assigned_id": novo_id,
                     "coordenador_id": self.id,
                     "coordenador_addr": self.addr,
                     "coordenador_nome": self.nome,
-                    "peers": self.peers,
-                    "historico": self.historico.to_list()
+                    "peers": self._peers_serializaveis(),
+                    "epoca": self.epoca_peers,
+                    "versao": self.versao_peers,
+                    "req": (msg.conteudo or {}).get("req"),
                 }
                 resposta = Mensagem("ASSIGN_ID", origem_id=self.id, origem_addr=self.addr, 
                                   origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=payload)
                 destino = tuple(msg.origem_addr)
                 print(f"[COORD] atribuindo id {novo_id} ao nó {msg.origem_nome} ({destino})")
                 self.unicast_enviar(destino, resposta)
+                # só o que o nó novo ainda não tem, pelo resumo enviado no JOIN, em lotes à parte
+                self._disparar(self.enviar_historico, destino, (msg.conteudo or {}).get("resumo"))
                 
         elif tipo == "HEARTBEAT":
-            if msg.origem_id is not None:
+            # do coordenador conhecido, o datagrama já contou como sinal de vida
+            if msg.origem_id is not None and msg.origem_id != self.coordenador_id:
                 with self.lock_heartbeat:
-                    self.ultimo_heartbeat = time.time()
                     self.coordenador_id = msg.origem_id
                     self.coordenador_addr = tuple(msg.origem_addr) if msg.origem_addr else None
                     self.coordenador_nome = msg.origem_nome
+                self._reiniciar_detector()
+            # o heartbeat anuncia a versão da lista: revela delta perdido no fim
+            versao = (msg.conteudo or {}).get("peers") if isinstance(msg.conteudo, dict) else None
+            if versao and tuple(versao) > (self.epoca_peers, self.versao_peers):
+                self.pedir_peers()
                     
         elif tipo == "ELECTION":
             candidato_id = msg.origem_id
             print(f"[ELEIÇÃO] Recebida mensagem ELECTION de {msg.origem_nome} (id {candidato_id})")
             
+            conteudo = msg.conteudo if isinstance(msg.conteudo, dict) else {}
+            rapida = conteudo.get("rapida")
             if self.id is not None and self.id > candidato_id:
                 # Este nó tem ID maior, deve responder com OK
                 print(f"[ELEIÇÃO] Respondendo com OK para {msg.origem_nome} (meu id {self.id} > {candidato_id})")
@@ -147,7 +450,7 @@ class No:
                             origem_addr=self.addr, 
                             origem_nome=self.nome, 
                             lamport=self.incrementa_lamport(), 
-                            conteudo=None)
+                            conteudo={"req": conteudo.get("req")})
                 
                 # Responde via UNICAST diretamente ao solicitante
                 if msg.origem_addr:
@@ -157,51 +460,50 @@ class No:
                     except Exception as e:
                         print(f"[ELEIÇÃO] Falha ao enviar OK: {e}")
                 
+                if rapida:
+                    # eleição rápida: quem sondou decide; só assume se for designado
+                    if conteudo.get("assumir") and not self.eh_coordenador:
+                        print(f"[ELEIÇÃO] Designado por {msg.origem_nome} como maior nó vivo, assumindo coordenação")
+                        self.anunciar_coordenador()
                 # Inicia própria eleição se não estiver em uma
-                if not self._em_eleicao:
+                elif not self._em_eleicao:
                     print(f"[ELEIÇÃO] Iniciando própria eleição como nó maior...")
-                    threading.Thread(target=self.iniciar_eleicao, daemon=True).start()
+                    self._disparar(self.iniciar_eleicao)
             else:
                 print(f"[ELEIÇÃO] Ignorando ELECTION (meu id {self.id} <= {candidato_id})")
                             
         elif tipo == "OK":
             print(f"[ELEIÇÃO] Recebido OK de {msg.origem_nome} (id {msg.origem_id})")
-            self._eleicao_recebeu_ok = True
+            req = msg.conteudo.get("req") if isinstance(msg.conteudo, dict) else None
+            self.requisicoes.resolver(req, msg.origem_id)
             
         elif tipo == "COORDINATOR":
             self.coordenador_id = msg.origem_id
             self.coordenador_addr = tuple(msg.origem_addr) if msg.origem_addr else None
             self.coordenador_nome = msg.origem_nome
-            # tenta sincronizar lista de peers enviada pelo novo coordenador (se houver)
+            # o novo coordenador abre uma época com a lista inteira
             payload = msg.conteudo or {}
-            peers_payload = payload.get("peers")
-            if peers_payload:
-                with self.lock_peers:
-                    # converte chaves para int e endereços para tuplas
-                    try:
-                        new_peers = {}
-                        for pid, info in peers_payload.items():
-                            pid_int = int(pid)
-                            if isinstance(info.get("addr"), (list, tuple)):
-                                info = dict(info)
-                                info["addr"] = tuple(info["addr"])
-                            new_peers[pid_int] = info
-                        self.peers = new_peers
-                        # atualiza próximo id razoavelmente
-                        if self.peers:
-                            self.proximo_id = max(self.peers.keys()) + 1
-                    except Exception:
-                        pass
+            if payload.get("peers"):
+                try:
+                    self._aplicar_lista_peers(payload["peers"], payload.get("epoca"), payload.get("versao"),
+                                              forcar=True)
+                except Exception:
+                    pass
             self.eh_coordenador = (self.coordenador_id == self.id)
-            with self.lock_heartbeat:
-                self.ultimo_heartbeat = time.time()
+            self._reiniciar_detector()
+            self._evento_coordenador.set()
+            self.metricas.eleicao_concluida()
             if self.eh_coordenador:
                 print(f"[INFO] {self.nome} foi eleito coordenador.")
-                threading.Thread(target=self.iniciar_sincronizacao_berkeley, daemon=True).start()
+                self._disparar(self.iniciar_sincronizacao_berkeley)
             else:
                 print(f"[INFO] Novo coordenador: {self.coordenador_nome} (id {self.coordenador_id})")
+                self.sincronizar_historico(self.coordenador_addr)
                 
         elif tipo == "CHAT":
+            # duplicata descartada pelo cabeçalho, sem decodificar o conteúdo
+            if self.historico.contem(msg.lamport, msg.origem_id):
+                return
             conteudo = msg.conteudo
             if isinstance(conteudo, dict) and "texto" in conteudo:
                 texto = conteudo["texto"]
@@ -213,19 +515,28 @@ class No:
                 tempo_formatado = self.gerenciador_tempo.formatar_tempo(ts_berkeley)
                 print(f"\n[{tempo_formatado}] {origem_nome}: {texto}\n> ", end="")
                 
+        elif tipo == "BATCH":
+            self.tratar_lote_chat(msg)
+
+        elif tipo == "SEQ_STATUS":
+            conteudo = msg.conteudo or {}
+            if msg.origem_addr and "seq" in conteudo:
+                self.receptor.anuncio(msg.origem_addr, conteudo.get("sessao"), conteudo["seq"])
+
         elif tipo == "TIME_REQUEST":
             if not self.eh_coordenador:
-                tempo_local = time.time()
+                tempo_local = self.gerenciador_tempo.relogio()
                 resposta = Mensagem("TIME_RESPONSE", origem_id=self.id, origem_addr=self.addr,
                                   origem_nome=self.nome, lamport=self.incrementa_lamport(),
-                                  conteudo={"tempo_local": tempo_local})
+                                  conteudo={"tempo_local": tempo_local,
+                                            "req": (msg.conteudo or {}).get("req")})
                 self.unicast_enviar(tuple(msg.origem_addr), resposta)
                 
         elif tipo == "TIME_ADJUST":
             if not self.eh_coordenador:
                 correcao = msg.conteudo.get("correcao", 0)
                 self.gerenciador_tempo.set_correcao(correcao)
-                print(f"[TEMPO] Tempo ajustado: correção de {correcao:.2f} segundos aplicada")
+                print(f"[TEMPO] Nova correção de {correcao:+.3f}s, aplicada gradualmente")
                 
         elif tipo == "KICK_VOTE_START":
             self.tratar_inicio_votacao_chute(msg)
@@ -237,7 +548,7 @@ class No:
             self.tratar_resultado_chute(msg)
         
         elif tipo == "PEERS_UPDATE":
-            # atualização autoritativa de peers enviada pelo coordenador
+            # delta (ou lista inteira, de versões antigas) enviado pelo coordenador
             try:
                 self.tratar_peers_update(msg)
             except Exception as e:
@@ -250,18 +561,22 @@ class No:
             except Exception:
                 saiu_id = None
             if saiu_id is not None:
-                with self.lock_peers:
-                    if saiu_id in self.peers:
-                        nome_saiu = self.peers[saiu_id].get("nome", f"Unknown_{saiu_id}")
-                        del self.peers[saiu_id]
-                        print(f"[INFO] {nome_saiu} saiu do chat.")
+                self._remover_peer(saiu_id)
                 # se o coordenador saiu, dispara eleição
                 if saiu_id == self.coordenador_id:
                     print(f"[ALERTA] Coordenador ({self.coordenador_nome}) saiu — iniciando eleição...")
-                    threading.Thread(target=self.iniciar_eleicao, daemon=True).start()
+                    self._disparar(self.iniciar_eleicao)
 
     def tratar_mensagem_unicast(self, msg, addr):
         tipo = msg.tipo
+        if tipo in ("ELECTION", "OK", "TIME_REQUEST", "TIME_ADJUST"):
+            # eleição e Berkeley trocam mensagens por unicast, mas o tratamento fica no handler do grupo
+            self.tratar_mensagem_multicast(msg, addr)
+            return
+        if tipo in ("PING", "PING_REQ", "ACK"):
+            if self.swim is not None:
+                self.swim.tratar(msg)
+            return
         self.atualiza_lamport_recebendo(msg.lamport)
         
         if tipo == "ASSIGN_ID":
@@ -271,35 +586,21 @@ class No:
             self.coordenador_id = payload.get("coordenador_id")
             self.coordenador_addr = tuple(payload.get("coordenador_addr"))
             self.coordenador_nome = payload.get("coordenador_nome")
-            peers = payload.get("peers", {})
-            with self.lock_peers:
-                new_peers = {}
-                for pid, peer_info in peers.items():
-                    try:
-                        pid_int = int(pid)
-                    except Exception:
-                        pid_int = pid
-                    # garante que addr seja tupla
-                    if isinstance(peer_info.get("addr"), list):
-                        peer_info = dict(peer_info)
-                        peer_info["addr"] = tuple(peer_info["addr"])
-                    new_peers[pid_int] = peer_info
-                self.peers = new_peers
-            hist = payload.get("historico", [])
-            self.historico.estende(hist)
+            self._reiniciar_detector()
+            self._aplicar_lista_peers(payload.get("peers", {}), payload.get("epoca"), payload.get("versao"),
+                                      forcar=True)
             peer_nomes = [info.get("nome", f"Unknown_{pid}") for pid, info in self.peers.items() if pid != self.id]
             print(f"[INFO] Recebi ID {self.id} do coordenador {self.coordenador_nome}. Peers ativos: {peer_nomes}")
+            self.requisicoes.resolver(payload.get("req", self._req_entrada), "assign_id", assigned_id)
             
         elif tipo == "PEERS_REQUEST":
             # um nó solicitou a lista de peers; responde se eu for coordenador
             if self.eh_coordenador:
-                with self.lock_peers:
-                    peers_for_send = {}
-                    for pid, info in self.peers.items():
-                        addr = info.get("addr")
-                        peers_for_send[str(pid)] = {"addr": list(addr) if isinstance(addr, (list, tuple)) else addr, "nome": info.get("nome")}
+                with self._lock_versao_peers:
+                    conteudo = {"peers": self._peers_serializaveis(),
+                                "epoca": self.epoca_peers, "versao": self.versao_peers}
                 resp = Mensagem("PEERS_RESPONSE", origem_id=self.id, origem_addr=self.addr,
-                                origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo={"peers": peers_for_send})
+                                origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=conteudo)
                 # envia de volta para o solicitante
                 self.unicast_enviar(tuple(msg.origem_addr), resp)
         elif tipo == "PEERS_RESPONSE":
@@ -308,24 +609,49 @@ class No:
                 self.tratar_peers_update(msg)
             except Exception as e:
                 print(f"[WARN] falha aplicando PEERS_RESPONSE: {e}")
+        elif tipo == "NACK_SEQ":
+            # reenvia as mensagens pedidas: minhas, ou de outro nó se estiverem no cache
+            conteudo = msg.conteudo or {}
+            origem = tuple(conteudo.get("origem") or ())
+            sessao = conteudo.get("sessao")
+            seqs = conteudo.get("seqs", [])
+            if origem == self.addr and sessao == self.emissor.sessao:
+                dados = self.emissor.buscar(seqs)
+            else:
+                dados = self.receptor.buscar(origem, sessao, seqs)
+            for data in dados:
+                try:
+                    self.metricas.enviada("RETRANSMISSAO", len(data))
+                    self._enviar_dados(data, tuple(msg.origem_addr))
+                except Exception as e:
+                    print(f"[WARN] falha ao retransmitir para {msg.origem_addr}: {e}")
+
+        elif tipo == "HISTORY_SYNC":
+            # responde só com o que falta ao solicitante e manda meu resumo de volta
+            resumo = (msg.conteudo or {}).get("resumo")
+            self._disparar(self.enviar_historico, tuple(msg.origem_addr), resumo, True)
+
         elif tipo == "HISTORY":
             hist = msg.conteudo
-            self.historico.estende(hist)
+            if isinstance(hist, dict):
+                self.historico.estende(hist.get("itens", []))
+                # o outro lado mandou o resumo dele: devolve o que só eu tenho
+                resumo = hist.get("resumo")
+                if resumo is not None and msg.origem_addr:
+                    self._disparar(self.enviar_historico, tuple(msg.origem_addr), resumo)
+            else:
+                self.historico.estende(hist)
             
         elif tipo == "GOODBYE":
-            saiu_id = msg.conteudo.get("id")
-            with self.lock_peers:
-                if saiu_id in self.peers:
-                    nome_saiu = self.peers[saiu_id].get("nome", f"Unknown_{saiu_id}")
-                    del self.peers[saiu_id]
-            print(f"[INFO] {nome_saiu} saiu do chat.")
+            self._remover_peer(msg.conteudo.get("id"))
             
         elif tipo == "TIME_RESPONSE":
-            if self.eh_coordenador and self._aguardando_respostas_tempo:
-                origem_id = msg.origem_id
-                tempo_local = msg.conteudo.get("tempo_local")
-                with self._lock_tempo:
-                    self._respostas_tempo[origem_id] = tempo_local
+            recebido = self.gerenciador_tempo.relogio()
+            conteudo = msg.conteudo or {}
+            # resposta atrasada de uma rodada anterior traz um req já encerrado e é ignorada
+            if self.eh_coordenador:
+                self.requisicoes.resolver(conteudo.get("req"), msg.origem_id,
+                                          (conteudo.get("tempo_local"), recebido))
 
     def tratar_inicio_votacao_chute(self, msg):
 
@@ -345,14 +671,16 @@ class No:
                     print(f"[VOTAÇÃO] Já existe uma votação ativa")
                     return
                     
-                self.votacao_ativa = VotacaoChute(alvo_id, alvo_nome, iniciador_id, iniciador_nome)
+                self.votacao_ativa = VotacaoChute(alvo_id, alvo_nome, iniciador_id, iniciador_nome,
+                                                  conteudo.get("req"))
                 
             payload = {
                 "alvo_id": alvo_id,
                 "alvo_nome": alvo_nome,
                 "iniciador_id": iniciador_id,
                 "iniciador_nome": iniciador_nome,
-                "duracao": DURACAO_VOTACAO
+                "duracao": DURACAO_VOTACAO,
+                "req": conteudo.get("req")
             }
             vote_start_msg = Mensagem("KICK_VOTE_START", origem_id=self.id, origem_addr=self.addr,
                                     origem_nome=self.nome, lamport=self.incrementa_lamport(),
@@ -363,7 +691,7 @@ class No:
             print(f"[VOTAÇÃO] Use 'votar sim' ou 'votar não' para participar")
             print(f"[VOTAÇÃO] Tempo restante: {DURACAO_VOTACAO} segundos\n> ", end="")
             
-            threading.Thread(target=self.monitorar_votacao, daemon=True).start()
+            self._disparar(self.monitorar_votacao)
 
             
 
@@ -374,8 +702,10 @@ class No:
             voto = conteudo.get("voto")
             
             with self.lock_votacoes:
-                if self.votacao_ativa and not self.votacao_ativa.encerrada:
-                    sucesso = self.votacao_ativa.adicionar_voto(voter_id, voto)
+                vot = self.votacao_ativa
+                # voto atrasado de uma votação anterior traz outro req
+                if vot and not vot.encerrada and conteudo.get("req", vot.req) == vot.req:
+                    sucesso = vot.adicionar_voto(voter_id, voto)
                     if sucesso:
                         print(f"[VOTAÇÃO] Voto recebido de {msg.origem_nome}: {'SIM' if voto else 'NÃO'}")
 
@@ -388,7 +718,10 @@ class No:
         votos_contra = conteudo.get("votos_contra", 0)
         
         with self.lock_votacoes:
+            vot = self.votacao_ativa
             self.votacao_ativa = None
+        if vot is not None:
+            vot.apuracao.resolver("resultado", chutado)
             
         if chutado:
             with self.lock_chutados:
@@ -402,72 +735,82 @@ class No:
                 print(f"[CHUTE] Você ({self.nome}) foi chutado — desconectando...")
                 # marca como não rodando e fecha sockets sem enviar GOODBYE
                 self.rodando = False
-                try:
-                    self.msock.close()
-                except:
-                    pass
-                try:
-                    self.sock.close()
-                except:
-                    pass
+                self._parar_servicos()
                 return
             
             if self.eh_coordenador:
                 with self.lock_peers:
-                    if alvo_id in self.peers:
-                        KICK_msg = Mensagem("KICK_RESULT", origem_id=self.id, origem_addr=self.addr,
-                                         origem_nome=self.nome, lamport=self.incrementa_lamport(),
-                                         conteudo={"chutado": True, "motivo": "Votação da comunidade"})
-                        alvo_addr = self.peers[alvo_id]["addr"]
-                        self.unicast_enviar(alvo_addr, KICK_msg)
-                        del self.peers[alvo_id]
-                        # informa todos que o usuário saiu (propaga remoção)
-                        goodbye = Mensagem("GOODBYE", origem_id=self.id, origem_addr=self.addr,
-                                           origem_nome=self.nome, lamport=self.incrementa_lamport(),
-                                           conteudo={"id": alvo_id})
-                        self.multicast_enviar(goodbye)
+                    alvo_addr = self.peers.get(alvo_id, {}).get("addr")
+                if alvo_addr is not None:
+                    KICK_msg = Mensagem("KICK_RESULT", origem_id=self.id, origem_addr=self.addr,
+                                     origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                                     conteudo={"chutado": True, "motivo": "Votação da comunidade"})
+                    self.unicast_enviar(alvo_addr, KICK_msg)
+                    # propaga a remoção como delta da lista de peers
+                    self._alterar_peers("chutado", alvo_id)
         else:
             print(f"\n[VOTAÇÃO] {alvo_nome} NÃO foi chutado")
             print(f"[VOTAÇÃO] Votos: {votos_favor} a favor, {votos_contra} contra\n> ", end="")
 
-    def monitorar_votacao(self):
-        while self.rodando:
-            time.sleep(1)
-            # captura cópia segura da votação atual
+    def verificar_votacao(self):
+        # uma rodada de apuração; devolve True quando não há mais o que monitorar
+        # captura cópia segura da votação atual
+        with self.lock_votacoes:
+            vot = self.votacao_ativa
+        if not vot:
+            return True
+        if vot.encerrada:
             with self.lock_votacoes:
-                vot = self.votacao_ativa
-            if not vot:
-                break
-            if vot.encerrada:
-                with self.lock_votacoes:
-                    self.votacao_ativa = None
-                break
+                self.votacao_ativa = None
+            return True
 
-            with self.lock_peers:
-                total_usuarios = len(self.peers)
+        with self.lock_peers:
+            total_usuarios = len(self.peers)
 
-            resultado = vot.verificar_resultado(total_usuarios)
+        resultado = vot.verificar_resultado(total_usuarios)
 
-            if resultado is not None:
-                with self.lock_votacoes:
-                    votos_favor = sum(1 for v in vot.votos.values() if v)
-                    votos_contra = sum(1 for v in vot.votos.values() if not v)
-                    
-                    payload = {
-                        "alvo_id": vot.alvo_id,
-                        "alvo_nome": vot.alvo_nome,
-                        "chutado": resultado,
-                        "votos_favor": votos_favor,
-                        "votos_contra": votos_contra
-                    }
-                    
-                    result_msg = Mensagem("KICK_RESULT", origem_id=self.id, origem_addr=self.addr,
-                                        origem_nome=self.nome, lamport=self.incrementa_lamport(),
-                                        conteudo=payload)
-                    self.multicast_enviar(result_msg)
-                    
-                    self.votacao_ativa = None
-                break
+        if resultado is not None:
+            with self.lock_votacoes:
+                votos_favor = sum(1 for v in vot.votos.values() if v)
+                votos_contra = sum(1 for v in vot.votos.values() if not v)
+                
+                payload = {
+                    "alvo_id": vot.alvo_id,
+                    "alvo_nome": vot.alvo_nome,
+                    "chutado": resultado,
+                    "votos_favor": votos_favor,
+                    "votos_contra": votos_contra
+                }
+                
+                result_msg = Mensagem("KICK_RESULT", origem_id=self.id, origem_addr=self.addr,
+                                    origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                                    conteudo=payload)
+                self.multicast_enviar(result_msg)
+                
+                self.votacao_ativa = None
+            return True
+        return False
+
+    def _aguardar_apuracao(self):
+        # devolve (futuro, prazo, condição) da espera pela próxima apuração, ou None
+        with self.lock_votacoes:
+            vot = self.votacao_ativa
+        if vot is None:
+            return None
+        with self.lock_peers:
+            total_usuarios = len(self.peers)
+        condicao = lambda respostas: "resultado" in respostas or vot.decidida(total_usuarios)
+        return vot.apuracao, vot.tempo_restante() + 0.05, condicao
+
+    def monitorar_votacao(self):
+        # apura quando um voto decide a votação, o resultado chega ou o prazo acaba
+        if not self.rodando or self.verificar_votacao():
+            return
+        espera = self._aguardar_apuracao()
+        if espera is None:
+            return
+        futuro, prazo, condicao = espera
+        self.agendador.ao_concluir(futuro, prazo, lambda _: self.monitorar_votacao(), condicao)
 
     def iniciar_votacao_chute(self, alvo_nome):
         if not self.eh_coordenador:
@@ -496,7 +839,8 @@ class No:
                 
         payload = {
             "alvo_id": alvo_id,
-            "alvo_nome": self.peers[alvo_id]["nome"]
+            "alvo_nome": self.peers[alvo_id]["nome"],
+            "req": random.getrandbits(32)
         }
         vote_start = Mensagem("KICK_VOTE_START", origem_id=self.id, origem_addr=self.addr,
                             origem_nome=self.nome, lamport=self.incrementa_lamport(),
@@ -514,7 +858,7 @@ class No:
             
         voto_bool = voto.lower() in ['sim', 's', 'yes', 'y', 'true']
         
-        payload = {"voto": voto_bool}
+        payload = {"voto": voto_bool, "req": self.votacao_ativa.req}
         vote_msg = Mensagem("KICK_VOTE", origem_id=self.id, origem_addr=self.addr,
                           origem_nome=self.nome, lamport=self.incrementa_lamport(),
                           conteudo=payload)
@@ -526,27 +870,75 @@ class No:
         with self.lock_chutados:
             return user_id in self.usuarios_chutados
 
-    def entrar_na_rede(self):
+    def _enviar_join(self):
         if self.verificar_chute(self.id):
             print("[ERRO] Você está chutado e não pode entrar no chat")
             self.rodando = False
-            return
+            return False
             
         print(f"[ENTRADA] {self.nome} enviando JOIN via multicast")
-        payload = {"addr": self.addr}
+        # devolve o futuro que o ASSIGN_ID completa
+        self._req_entrada, futuro = self.requisicoes.nova()
+        payload = {"addr": self.addr, "resumo": self.historico.resumo(), "codecs": CODECS_SUPORTADOS,
+                   "req": self._req_entrada}
         join = Mensagem("JOIN", origem_id=self.id, origem_addr=self.addr, 
                        origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=payload)
         self.multicast_enviar(join)
-        espera = 0.0
-        while self.id is None and espera < TIMEOUT_SINCRONIZACAO_HISTORICO:
-            time.sleep(0.2)
-            espera += 0.2
+        return futuro
+
+    def entrar_na_rede(self, esperar=True):
+        # sem esperar, a entrada conclui num callback do agendador quando o ASSIGN_ID chegar
+        futuro = self._enviar_join()
+        if not futuro:
+            return
+        if not esperar:
+            self.agendador.ao_concluir(futuro, TIMEOUT_SINCRONIZACAO_HISTORICO, lambda _: self._concluir_entrada())
+            return
+        futuro.aguardar(TIMEOUT_SINCRONIZACAO_HISTORICO)
+        self._concluir_entrada()
+
+    def _concluir_entrada(self):
+        self.requisicoes.encerrar(self._req_entrada)
         if self.id is None:
             print("[WARN] não recebeu ASSIGN_ID — assumindo coordenador (rede vazia)")
             self.tornar_coordenador_inicial()
         else:
             print(f"[OK] {self.nome} entrou com id {self.id}")
 
+    def descarregar_historico(self):
+        # descarrega o lote pendente do log e compacta de tempos em tempos
+        try:
+            self.historico.descarregar()
+        except Exception as e:
+            print(f"[WARN] falha gravando histórico em disco: {e}")
+
+    def enviar_historico(self, destino, resumo, responder=False):
+        # manda ao destino o que falta a ele, um HISTORY por lote de LOTE_HISTORICO;
+        # roda no pool de fundo, e os segmentos frios são lidos com o lock do histórico
+        # livre. Respondendo a um HISTORY_SYNC, o primeiro vai com o meu resumo
+        conteudo = {"resumo": self.historico.resumo()} if responder else {}
+        for itens in self.historico.lotes_faltantes(resumo):
+            conteudo["itens"] = itens
+            self.unicast_enviar(destino, Mensagem("HISTORY", origem_id=self.id, origem_addr=self.addr,
+                                                  origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                                                  conteudo=conteudo))
+            conteudo = {}
+        if conteudo:
+            # nada faltava: o resumo vai sozinho
+            conteudo["itens"] = []
+            self.unicast_enviar(destino, Mensagem("HISTORY", origem_id=self.id, origem_addr=self.addr,
+                                                  origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                                                  conteudo=conteudo))
+
+    def sincronizar_historico(self, addr):
+        # anti-entropia: manda o resumo e recebe de volta só a diferença
+        if self.id is None or addr is None or tuple(addr) == self.addr:
+            return
+        req = Mensagem("HISTORY_SYNC", origem_id=self.id, origem_addr=self.addr,
+                       origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                       conteudo={"resumo": self.historico.resumo()})
+        self.unicast_enviar(addr, req)
+
     def tornar_coordenador_inicial(self):
         self.id = 1
         self.eh_coordenador = True
@@ -556,42 +948,76 @@ class No:
         with self.lock_peers:
             self.peers[self.id] = {
                 "addr": self.addr,
-                "nome": self.nome
+                "nome": self.nome,
+                "codecs": CODECS_SUPORTADOS
             }
         self.proximo_id = 2
+        with self._lock_versao_peers:
+            self.epoca_peers += 1
+            self.versao_peers = 0
         print(f"[COORDENADOR] {self.nome} criado como coordenador inicial com id 1")
-        threading.Thread(target=self.iniciar_sincronizacao_berkeley, daemon=True).start()
-        # inicia broadcast periódico da lista de peers
-        threading.Thread(target=self._peers_sync_loop, daemon=True).start()
+        self._disparar(self.iniciar_sincronizacao_berkeley)
 
-    def loop_heartbeat(self):
-        while self.rodando:
-            if self.eh_coordenador:
-                hb = Mensagem("HEARTBEAT", origem_id=self.id, origem_addr=self.addr, 
-                             origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=None)
-                self.multicast_enviar(hb)
-            time.sleep(INTERVALO_HEARTBEAT)
-
-    def monitor_heartbeat(self):
-        while self.rodando:
-            time.sleep(0.5)
-            with self.lock_heartbeat:
-                delta = time.time() - self.ultimo_heartbeat
-            if not self.eh_coordenador and self.coordenador_id is not None and delta > TIMEOUT_HEARTBEAT:
-                print(f"[ALERTA] Não houve heartbeat do coordenador {self.coordenador_nome}. Iniciando eleição...")
-                threading.Thread(target=self.iniciar_eleicao, daemon=True).start()
-                with self.lock_heartbeat:
-                    self.ultimo_heartbeat = time.time()
+    def enviar_heartbeat(self):
+        # chat, PEERS_UPDATE etc. do coordenador já servem de heartbeat: só manda
+        # um explícito quando o grupo ficou sem ouvir nada dele
+        if self.eh_coordenador and time.time() - self._ultimo_multicast >= INTERVALO_HEARTBEAT:
+            hb = Mensagem("HEARTBEAT", origem_id=self.id, origem_addr=self.addr, 
+                         origem_nome=self.nome, lamport=self.incrementa_lamport(),
+                         conteudo={"peers": [self.epoca_peers, self.versao_peers]})
+            self.multicast_enviar(hb)
 
-    def iniciar_eleicao(self):
+    def _tique_heartbeat(self):
+        # reagenda para o instante em que o grupo completaria INTERVALO_HEARTBEAT
+        # sem ouvir o coordenador; com chat passando, só empurra o prazo adiante
+        if not self.rodando:
+            return
+        self.enviar_heartbeat()
+        atraso = INTERVALO_HEARTBEAT
+        if self.eh_coordenador:
+            atraso = max(self._ultimo_multicast + INTERVALO_HEARTBEAT - time.time(), 0.0)
+        self._agendar(atraso, self._tique_heartbeat)
+
+    def _verificar_origem_coordenador(self, addr):
+        # todo envio sai pelo socket unicast do nó, então o endereço de origem
+        # do datagrama identifica o coordenador sem decodificar nada
+        if self.coordenador_addr is not None and tuple(addr) == self.coordenador_addr and not self.eh_coordenador:
+            self._coordenador_vivo()
+
+    def _coordenador_vivo(self):
+        agora = time.time()
+        with self.lock_heartbeat:
+            lacuna = agora - self.ultimo_heartbeat
+            self.ultimo_heartbeat = agora
+            self.detector.registrar(agora)
+        # ficamos um tempo sem ouvir o coordenador: pode ter perdido mensagens
+        if lacuna > LIMIAR_LACUNA_SINCRONIZACAO:
+            self.sincronizar_historico(self.coordenador_addr)
+
+    def _reiniciar_detector(self):
+        # coordenador novo: as amostras do anterior não valem mais
+        with self.lock_heartbeat:
+            self.ultimo_heartbeat = time.time()
+            self.detector.reiniciar(self.ultimo_heartbeat)
+
+    def verificar_heartbeat(self):
+        with self.lock_heartbeat:
+            phi = self.detector.phi()
+        if not self.eh_coordenador and self.coordenador_id is not None and phi > self.detector.limiar:
+            print(f"[ALERTA] Coordenador {self.coordenador_nome} suspeito (phi {phi:.1f}). Iniciando eleição...")
+            self._disparar(self.iniciar_eleicao)
+            self._reiniciar_detector()
+
+    def _preparar_eleicao(self):
+        # envia ELECTION aos maiores; devolve (req, futuro) se é preciso esperar por OK
         self.enviar_atualizacao_peers()
         if self.id is None:
-            return
+            return None
             
         self._em_eleicao = True
-        self._eleicao_recebeu_ok = False
         
         print(f"[ELEIÇÃO] {self.nome} (id {self.id}) iniciou eleição!")
+        self.metricas.eleicao_iniciada()
         
         # Envia mensagem ELECTION via UNICAST para todos os nós com id maior
         maiores = []
@@ -605,210 +1031,275 @@ class No:
             print(f"[ELEIÇÃO] {self.nome} não encontrou nó maior, tornando-se coordenador!")
             self.anunciar_coordenador()
             self._em_eleicao = False
-            return
+            return None
             
-        # Envia ELECTION via UNICAST para cada nó maior
-        election_sent = False
+        # Envia ELECTION via UNICAST para cada nó maior; o primeiro OK completa o futuro
+        req, futuro = self.requisicoes.nova()
+        msg = Mensagem("ELECTION", 
+                    origem_id=self.id, 
+                    origem_addr=self.addr, 
+                    origem_nome=self.nome, 
+                    lamport=self.incrementa_lamport(), 
+                    conteudo={"req": req})
         for pid, peer in maiores:
-            try:
-                msg = Mensagem("ELECTION", 
-                            origem_id=self.id, 
-                            origem_addr=self.addr, 
-                            origem_nome=self.nome, 
-                            lamport=self.incrementa_lamport(), 
-                            conteudo=None)
-                print(f"[ELEIÇÃO] Enviando ELECTION para {peer['nome']} (id {pid}) em {peer['addr']}")
-                self.unicast_enviar(peer["addr"], msg)
-                election_sent = True
-            except Exception as e:
-                print(f"[ELEIÇÃO] Falha ao enviar ELECTION para {peer['nome']}: {e}")
+            print(f"[ELEIÇÃO] Enviando ELECTION para {peer['nome']} (id {pid}) em {peer['addr']}")
+        erros = self.unicast_difundir([peer["addr"] for _, peer in maiores], msg)
+        election_sent = len(erros) < len(maiores)
         
         if not election_sent:
             print(f"[ELEIÇÃO] Não foi possível enviar ELECTION para nenhum nó maior")
+            self.requisicoes.encerrar(req)
             self.anunciar_coordenador()
             self._em_eleicao = False
-            return
+            return None
         
-        # Aguarda OK por um tempo limitado
         print(f"[ELEIÇÃO] Aguardando respostas OK por {TIMEOUT_ELEICAO} segundos...")
-        inicio = time.time()
-        
-        while time.time() - inicio < TIMEOUT_ELEICAO:
-            if self._eleicao_recebeu_ok:
-                print(f"[ELEIÇÃO] {self.nome} recebeu OK de nó maior, aguardando anúncio de coordenador...")
-                # Reseta flag para eleições futuras
-                self._eleicao_recebeu_ok = False
-                self._em_eleicao = False
-                return
-            time.sleep(0.1)
+        return req, futuro
+
+    def _concluir_eleicao(self, req, recebeu_ok):
+        self.requisicoes.encerrar(req)
+        if recebeu_ok:
+            print(f"[ELEIÇÃO] {self.nome} recebeu OK de nó maior, aguardando anúncio de coordenador...")
+            self._em_eleicao = False
+            return
         
         # Se não recebeu OK dentro do timeout, assume coordenação
         print(f"[ELEIÇÃO] {self.nome} não recebeu OK dentro do timeout, tornando-se coordenador!")
         self.anunciar_coordenador()
         self._em_eleicao = False
 
+    def iniciar_eleicao(self):
+        if self.modo_eleicao == "rapida":
+            self.eleicao_rapida()
+            return
+        espera = self._preparar_eleicao()
+        if espera is None:
+            return
+        # Aguarda OK por um tempo limitado; conclui no primeiro que chegar, sem
+        # prender um thread durante a espera
+        req, futuro = espera
+        self.agendador.ao_concluir(futuro, TIMEOUT_ELEICAO, lambda recebeu: self._concluir_eleicao(req, recebeu))
+
+    def _enviar_election(self, peer, conteudo):
+        msg = Mensagem("ELECTION", origem_id=self.id, origem_addr=self.addr, origem_nome=self.nome,
+                       lamport=self.incrementa_lamport(), conteudo=conteudo)
+        self.unicast_enviar(peer["addr"], msg)
+
+    def _sondar_lote(self, lote):
+        # manda ELECTION ao lote inteiro de uma vez e devolve o maior que respondeu
+        ids = {pid for pid, _ in lote}
+        maior = max(ids)
+        req, futuro = self.requisicoes.nova(esperados=len(ids))
+        for pid, peer in lote:
+            print(f"[ELEIÇÃO] Sondando {peer['nome']} (id {pid}) em {peer['addr']}")
+        msg = Mensagem("ELECTION", origem_id=self.id, origem_addr=self.addr, origem_nome=self.nome,
+                       lamport=self.incrementa_lamport(), conteudo={"rapida": True, "req": req})
+        self.unicast_difundir([peer["addr"] for _, peer in lote], msg)
+        # o maior do lote respondeu: nenhum outro pode ganhar dele
+        futuro.aguardar(TIMEOUT_SONDA_ELEICAO, lambda oks: maior in oks)
+        self.requisicoes.encerrar(req)
+        vivos = set(futuro.copiar()) & ids
+        if not vivos:
+            return None
+        vencedor = max(vivos)
+        return next((pid, peer) for pid, peer in lote if pid == vencedor)
+
+    def eleicao_rapida(self):
+        # sonda os maiores em ordem decrescente, em lotes paralelos; o maior que
+        # responder é designado coordenador, sem cada nó abrir a própria eleição
+        if self.id is None or self._em_eleicao:
+            return
+        self._em_eleicao = True
+        self.metricas.eleicao_iniciada()
+        try:
+            while self.rodando and not self.eh_coordenador:
+                # limpo antes de sondar: um anúncio que chegue durante a sondagem conta
+                self._evento_coordenador.clear()
+                with self.lock_peers:
+                    maiores = sorted(((pid, peer) for pid, peer in self.peers.items() if pid > self.id),
+                                     key=lambda item: item[0], reverse=True)
+                print(f"[ELEIÇÃO] {self.nome} (id {self.id}) iniciou eleição rápida com {len(maiores)} nós maiores")
+                vencedor = None
+                for i in range(0, len(maiores), SONDAS_PARALELAS_ELEICAO):
+                    vencedor = self._sondar_lote(maiores[i:i + SONDAS_PARALELAS_ELEICAO])
+                    if vencedor is not None:
+                        break
+                if vencedor is None:
+                    print(f"[ELEIÇÃO] {self.nome} não encontrou nó maior vivo, tornando-se coordenador!")
+                    self.anunciar_coordenador()
+                    return
+                pid, peer = vencedor
+                print(f"[ELEIÇÃO] Designando {peer['nome']} (id {pid}) como coordenador")
+                self._enviar_election(peer, {"rapida": True, "assumir": True})
+                if self._evento_coordenador.wait(TIMEOUT_ELEICAO) and self.coordenador_id is not None \
+                        and self.coordenador_id >= pid:
+                    return
+                # o designado caiu antes de se anunciar: sonda de novo
+                print(f"[ELEIÇÃO] {peer['nome']} não se anunciou, repetindo a sondagem")
+        finally:
+            self._em_eleicao = False
+
     def anunciar_coordenador(self):
         self.eh_coordenador = True
+        self._evento_coordenador.set()
+        self.metricas.eleicao_concluida()
         self.coordenador_id = self.id
         self.coordenador_addr = self.addr
         self.coordenador_nome = self.nome
         with self.lock_peers:
             self.peers[self.id] = {
                 "addr": self.addr,
-                "nome": self.nome
+                "nome": self.nome,
+                "codecs": CODECS_SUPORTADOS
             }
+        # nova época: a lista inteira vai uma vez no anúncio, depois só deltas
+        with self._lock_versao_peers:
+            self.epoca_peers += 1
+            self.versao_peers = 0
+            conteudo = {"peers": self._peers_serializaveis(), "epoca": self.epoca_peers, "versao": 0}
         coord_msg = Mensagem("COORDINATOR", origem_id=self.id, origem_addr=self.addr, 
-                           origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo={"peers": self.peers})
+                           origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=conteudo)
         self.multicast_enviar(coord_msg)
         print(f"[COORDENADOR] {self.nome} anunciado como coordenador via multicast")
-        threading.Thread(target=self.iniciar_sincronizacao_berkeley, daemon=True).start()
-        # inicia broadcast periódico da lista de peers
-        threading.Thread(target=self._peers_sync_loop, daemon=True).start()
+        self._disparar(self.iniciar_sincronizacao_berkeley)
 
     def iniciar_sincronizacao_berkeley(self):
-        # Reescrita do algoritmo de sincronização Berkeley
-        if not self.eh_coordenador:
+        # agenda a próxima rodada; cada rodada agenda a seguinte enquanto eu for coordenador
+        if self._timer_berkeley is not None:
+            self._timer_berkeley.cancelar()
+            self._timer_berkeley = None
+        if not self.rodando or not self.eh_coordenador:
+            return
+        # a rodada espera as respostas: o timer só a entrega ao pool de tarefas bloqueantes
+        self._timer_berkeley = self._agendar(self.proxima_rodada_berkeley(), self._disparar, self._rodada_berkeley)
+
+    def proxima_rodada_berkeley(self):
+        # espera até a próxima rodada, sorteada em volta do intervalo para os coordenadores não alinharem
+        return self.intervalo_berkeley * (1 + random.uniform(-VARIACAO_SINCRONIZACAO_BERKELEY,
+                                                             VARIACAO_SINCRONIZACAO_BERKELEY))
+
+    def _rodada_berkeley(self):
+        if not self.rodando or not self.eh_coordenador:
             return
-        while self.rodando and self.eh_coordenador:
-            time.sleep(INTERVALO_SINCRONIZACAO_BERKELEY + random.uniform(-5, 5))
-            if not self.rodando or not self.eh_coordenador:
-                break
-            print("[TEMPO] Iniciando sincronização de tempo Berkeley...")
-            self._sincronizar_berkeley()
+        print("[TEMPO] Iniciando sincronização de tempo Berkeley...")
+        self.sincronizar_berkeley()
+        self.iniciar_sincronizacao_berkeley()
+
     def sincronizar_berkeley(self):
-        # 1. Envia TIME_REQUEST para todos os peers
+        # uma rodada Berkeley: TIME_REQUEST a todos de uma vez e espera até todos
+        # responderem ou o prazo acabar; cada amostra é compensada por meio RTT
+        if not self.eh_coordenador:
+            return
         with self.lock_peers:
             peers_ativos = {pid: peer for pid, peer in self.peers.items() if pid != self.id}
         if not peers_ativos:
             print("[TEMPO] Nenhum nó ativo para sincronização")
             return
-        respostas = {}
-        # 2. Envia requisição de tempo
-        msg_req = Mensagem("TIME_REQUEST", origem_id=self.id, origem_addr=self.addr, origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo={})
-        for pid, peer in peers_ativos.items():
-            try:
-                self.unicast_enviar(peer["addr"], msg_req)
-            except Exception as e:
-                print(f"[TEMPO] Falha ao enviar requisição de tempo para {peer['nome']}: {e}")
-        # 3. Aguarda respostas
+        # id -> (tempo_local do nó, meu relógio na chegada), completo quando todos respondem
+        req, futuro = self.requisicoes.nova(esperados=len(peers_ativos))
         inicio = time.time()
-        while time.time() - inicio < TIMEOUT_REQUISICAO_BERKELEY:
-            with self._lock_tempo:
-                respostas.update(self._respostas_tempo)
-            if len(respostas) >= len(peers_ativos):
-                break
-            time.sleep(0.2)
+        msg_req = Mensagem("TIME_REQUEST", origem_id=self.id, origem_addr=self.addr, origem_nome=self.nome,
+                           lamport=self.incrementa_lamport(), conteudo={"req": req})
+        # um só instante de envio para todos: o laço de sendto leva microssegundos por peer
+        enviado = self.gerenciador_tempo.relogio()
+        erros = self.unicast_difundir([peer["addr"] for peer in peers_ativos.values()], msg_req)
+        enviados = {pid: enviado for pid, peer in peers_ativos.items() if tuple(peer["addr"]) not in erros}
+        futuro.aguardar(TIMEOUT_REQUISICAO_BERKELEY)
+        self.requisicoes.encerrar(req)
+        respostas = {pid: r for pid, r in futuro.copiar().items() if pid in enviados}
+        duracao = time.time() - inicio
         if not respostas:
             print("[TEMPO] Nenhuma resposta recebida para sincronização")
             return
-        # 4. Calcula média
-        tempos = [time.time()] + list(respostas.values())
-        media = sum(tempos) / len(tempos)
-        print(f"[TEMPO] Média calculada: {time.strftime('%H:%M:%S', time.localtime(media))} (de {len(tempos)} nós)")
-        # 5. Calcula correções e envia TIME_ADJUST
-        for pid, peer in peers_ativos.items():
-            correcao = media - respostas.get(pid, time.time())
-            msg_adj = Mensagem("TIME_ADJUST", origem_id=self.id, origem_addr=self.addr, origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo={"correcao": correcao})
-            try:
-                self.unicast_enviar(peer["addr"], msg_adj)
-                print(f"[TEMPO] Enviando correção de {correcao:.2f}s para nó {pid}")
-            except Exception as e:
-                print(f"[TEMPO] Falha ao enviar ajuste de tempo para {peer['nome']}: {e}")
-        # Aplica correção local
-        correcao_local = media - time.time()
-        self.gerenciador_tempo.ajustar_correcao(correcao_local)
-        print(f"[TEMPO] Correção local aplicada: {correcao_local:.2f}s")
 
-    def executar_berkeley_sync(self):
-        if not self.eh_coordenador:
-            return
-            
-        with self.lock_peers:
-            peers_ativos = [pid for pid in self.peers.keys() if pid != self.id]
-            
-        if not peers_ativos:
-            print("[TEMPO] Nenhum nó ativo para sincronização")
-            return
-            
-        with self._lock_tempo:
-            self._respostas_tempo = {}
-            self._aguardando_respostas_tempo = True
-            
-        time_request = Mensagem("TIME_REQUEST", origem_id=self.id, origem_addr=self.addr,
-                              origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo={})
-        
-        for peer_id in peers_ativos:
-            peer_addr = self.peers[peer_id]["addr"]
-            self.unicast_enviar(peer_addr, time_request)
-            
-        time.sleep(TIMEOUT_REQUISICAO_BERKELEY)
-        
-        with self._lock_tempo:
-            self._aguardando_respostas_tempo = False
-            respostas_recebidas = len(self._respostas_tempo)
-            
-        if respostas_recebidas == 0:
-            print("[TEMPO] Nenhuma resposta recebida para sincronização")
-            return
-            
-        todos_tempos = {self.id: time.time()}
-        todos_tempos.update(self._respostas_tempo)
-        tempos = list(todos_tempos.values())
-        media = sum(tempos) / len(tempos)
-        print(f"[TEMPO] Média calculada: {time.strftime('%H:%M:%S', time.localtime(media))} (de {len(tempos)} nós)")
-        correcoes = {}
-        for node_id, node_time in todos_tempos.items():
-            correcao = media - node_time
-            correcoes[node_id] = correcao
-        correcao_local = correcoes.get(self.id, 0)
-        self.gerenciador_tempo.ajustar_correcao(correcao_local)
-        print(f"[TEMPO] Correção local aplicada: {correcao_local:.2f}s")
-        for peer_id in peers_ativos:
-            if peer_id in correcoes:
-                correcao_peer = correcoes[peer_id]
-                time_adjust = Mensagem("TIME_ADJUST", origem_id=self.id, origem_addr=self.addr,
-                                     origem_nome=self.nome, lamport=self.incrementa_lamport(),
-                                     conteudo={"correcao": correcao_peer})
-                peer_addr = self.peers[peer_id]["addr"]
-                self.unicast_enviar(peer_addr, time_adjust)
-                print(f"[TEMPO] Enviando correção de {correcao_peer:.2f}s para nó {peer_id}")
+        # desvio de cada relógio em relação ao meu, supondo o caminho de ida igual ao de volta
+        desvios = {self.id: 0.0}
+        for pid, (tempo_local, recebido) in respostas.items():
+            rtt = recebido - enviados[pid]
+            desvios[pid] = tempo_local - (enviados[pid] + rtt / 2)
+        aceitos = filtrar_outliers(desvios)
+        media = sum(aceitos.values()) / len(aceitos)
+        print(f"[TEMPO] Rodada em {duracao * 1000:.1f} ms: {len(respostas)}/{len(peers_ativos)} respostas, "
+              f"{len(desvios) - len(aceitos)} descartadas, média {media:+.3f}s")
+        self.metricas.rodada_berkeley(duracao, media)
 
-    # envia a lista autoritativa de peers em formato serializável (addr -> [ip,port])
-    def enviar_atualizacao_peers(self):
-        if not self.eh_coordenador:
-            return
+        # correções absolutas sobre o relógio de cada um: reaplicar a rodada não acumula erro
+        for pid, desvio in desvios.items():
+            if pid == self.id:
+                continue
+            correcao = media - desvio
+            msg_adj = Mensagem("TIME_ADJUST", origem_id=self.id, origem_addr=self.addr, origem_nome=self.nome,
+                               lamport=self.incrementa_lamport(), conteudo={"correcao": correcao})
+            self.unicast_enviar(peers_ativos[pid]["addr"], msg_adj)
+            print(f"[TEMPO] Enviando correção de {correcao:+.3f}s para nó {pid}")
+        self.gerenciador_tempo.set_correcao(media)
+        print(f"[TEMPO] Correção local: {media:+.3f}s")
+
+    # lista de peers em formato serializável (addr -> [ip,port])
+    def _peers_serializaveis(self):
         with self.lock_peers:
             peers_for_send = {}
             for pid, info in self.peers.items():
                 addr = info.get("addr")
                 addr_list = list(addr) if isinstance(addr, (list, tuple)) else addr
-                peers_for_send[str(pid)] = {"addr": addr_list, "nome": info.get("nome")}
+                peers_for_send[str(pid)] = {"addr": addr_list, "nome": info.get("nome"),
+                                            "codecs": info.get("codecs", [CODEC_JSON])}
+        return peers_for_send
 
-        msg = Mensagem("PEERS_UPDATE", origem_id=self.id, origem_addr=self.addr,
-                       origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo={"peers": peers_for_send})
-        self.multicast_enviar(msg)
+    # envia a lista inteira de peers com a versão atual
+    def enviar_atualizacao_peers(self):
+        if not self.eh_coordenador:
+            return
+        with self._lock_versao_peers:
+            conteudo = {"peers": self._peers_serializaveis(),
+                        "epoca": self.epoca_peers, "versao": self.versao_peers}
+            msg = Mensagem("PEERS_UPDATE", origem_id=self.id, origem_addr=self.addr,
+                           origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=conteudo)
+            self.multicast_enviar(msg)
 
-    def _peers_sync_loop(self):
-        with self._peers_sync_lock:
-            if self._peers_sync_running:
-                return
-            self._peers_sync_running = True
+    def _alterar_peers(self, op, pid, info=None):
+        if self.swim is not None:
+            # no modo SWIM a mudança se espalha por fofoca, sem versão do coordenador
+            self.swim.alterar(op, pid, info)
+            return
+        # só o coordenador muda a lista: cada mudança é uma versão nova e vai ao grupo como delta
+        with self._lock_versao_peers:
+            with self.lock_peers:
+                if op == "entrou":
+                    self.peers[pid] = info
+                elif self.peers.pop(pid, None) is None:
+                    return
+            self.versao_peers += 1
+            delta = {"epoca": self.epoca_peers, "versao": self.versao_peers, "op": op, "id": pid}
+            if info is not None:
+                delta["info"] = {"addr": list(info["addr"]), "nome": info.get("nome"),
+                                 "codecs": info.get("codecs", [CODEC_JSON])}
+            msg = Mensagem("PEERS_UPDATE", origem_id=self.id, origem_addr=self.addr,
+                           origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=delta)
+            # enviado dentro do lock para os deltas saírem na ordem das versões
+            self.multicast_enviar(msg)
 
-        try:
-            while self.rodando and self.eh_coordenador:
-                try:
-                    self.enviar_atualizacao_peers()
-                except Exception as e:
-                    print(f"[AVISO] falha enviando PEERS_UPDATE: {e}")
-                time.sleep(INTERVAL_PEERS_SYNC)
-        finally:
-            with self._peers_sync_lock:
-                self._peers_sync_running = False
+    def _remover_peer(self, saiu_id):
+        with self.lock_peers:
+            info = self.peers.get(saiu_id)
+            # fora do coordenador a remoção é local; a versão vem depois pelo delta
+            if info is not None and not self.eh_coordenador and self.swim is None:
+                del self.peers[saiu_id]
+        if info is None:
+            return
+        print(f"[INFO] {info.get('nome', f'Unknown_{saiu_id}')} saiu do chat.")
+        if self.eh_coordenador or self.swim is not None:
+            self._alterar_peers("saiu", saiu_id)
 
-    def tratar_peers_update(self, msg):
-        payload = msg.conteudo or {}
-        peers = payload.get("peers", {})
+    def _aplicar_lista_peers(self, peers, epoca=None, versao=None, forcar=False):
+        # lista inteira: só substitui a atual se for mais nova (ou vier sem versão, de nó antigo)
         with self.lock_peers:
+            if epoca is not None and versao is not None:
+                if not forcar and (epoca, versao) <= (self.epoca_peers, self.versao_peers):
+                    return False
+                self.epoca_peers, self.versao_peers = epoca, versao
+                self._deltas_pendentes = {v: d for v, d in self._deltas_pendentes.items()
+                                          if (d["epoca"], v) > (epoca, versao)}
             new_peers = {}
             for pid, info in peers.items():
                 try:
@@ -819,14 +1310,72 @@ class No:
                 if isinstance(info_copy.get("addr"), list):
                     info_copy["addr"] = tuple(info_copy["addr"])
                 new_peers[pid_int] = info_copy
-            # substitui pela lista autoritativa
             self.peers = new_peers
-            # atualiza proximo_id
             if self.peers:
                 try:
                     self.proximo_id = max(self.peers.keys()) + 1
                 except Exception:
                     pass
+        # deltas que chegaram adiantados podem ter ficado contíguos agora
+        self._aplicar_deltas_pendentes()
+        if self.swim is not None:
+            self.swim.conhecer(new_peers)
+        return True
+
+    def _aplicar_delta(self, delta):
+        pid = delta["id"]
+        if delta["op"] == "entrou":
+            info = dict(delta.get("info") or {})
+            if isinstance(info.get("addr"), list):
+                info["addr"] = tuple(info["addr"])
+            self.peers[pid] = info
+            self.proximo_id = max(self.proximo_id, pid + 1)
+        else:
+            self.peers.pop(pid, None)
+        self.versao_peers = delta["versao"]
+
+    def _aplicar_deltas_pendentes(self):
+        with self.lock_peers:
+            while True:
+                delta = self._deltas_pendentes.pop(self.versao_peers + 1, None)
+                if delta is None:
+                    break
+                if delta["epoca"] == self.epoca_peers:
+                    self._aplicar_delta(delta)
+
+    def pedir_peers(self):
+        # pede a lista inteira ao coordenador, sem repetir o pedido a cada delta adiantado
+        agora = time.time()
+        if self.eh_coordenador or self.coordenador_addr is None or agora - self._ultimo_pedido_peers < INTERVALO_PEDIDO_PEERS:
+            return
+        self._ultimo_pedido_peers = agora
+        req = Mensagem("PEERS_REQUEST", origem_id=self.id, origem_addr=self.addr,
+                       origem_nome=self.nome, lamport=self.incrementa_lamport(), conteudo=None)
+        self.unicast_enviar(self.coordenador_addr, req)
+
+    def tratar_peers_update(self, msg):
+        payload = msg.conteudo or {}
+        if "op" not in payload:
+            self._aplicar_lista_peers(payload.get("peers", {}), payload.get("epoca"), payload.get("versao"))
+            return
+        epoca, versao = payload["epoca"], payload["versao"]
+        lacuna = False
+        with self.lock_peers:
+            atual = (self.epoca_peers, self.versao_peers)
+            if (epoca, versao) <= atual:
+                # já estou nessa versão (ou depois): nada a aplicar
+                return
+            if epoca == self.epoca_peers and versao == self.versao_peers + 1:
+                self._aplicar_delta(payload)
+            else:
+                # delta de outra época ou adiantado: guarda e pede a lista inteira
+                if epoca == self.epoca_peers:
+                    self._deltas_pendentes[versao] = payload
+                lacuna = True
+        if lacuna:
+            self.pedir_peers()
+        else:
+            self._aplicar_deltas_pendentes()
 
     def enviar_chat(self, texto):
         if self.id is None:
@@ -841,15 +1390,61 @@ class No:
                       origem_nome=self.nome, lamport=lam, conteudo=payload)
         ts_berkeley = self.gerenciador_tempo.get_tempo()
         self.historico.adiciona(lam, self.id, self.nome, texto, ts_berkeley)
-        self.multicast_enviar(msg)
+        if self.lote_chat is None:
+            self.multicast_enviar(msg)
+        else:
+            primeiro, cheio = self.lote_chat.adicionar(lam, texto)
+            if cheio:
+                self.enviar_lote_chat()
+            elif primeiro:
+                self._agendar(JANELA_LOTE_CHAT, self.enviar_lote_chat)
         tempo_formatado = self.gerenciador_tempo.formatar_tempo(ts_berkeley)
         print(f"[{tempo_formatado}] {self.nome}: {texto}")
 
+    def enviar_lote_chat(self):
+        chats = self.lote_chat.retirar()
+        if not chats:
+            return
+        if len(chats) == 1:
+            lam, texto = chats[0]
+            msg = Mensagem("CHAT", origem_id=self.id, origem_addr=self.addr,
+                           origem_nome=self.nome, lamport=lam, conteudo={"texto": texto})
+        else:
+            # o lamport do BATCH é o do último CHAT, então o receptor atualiza o relógio uma vez só
+            msg = Mensagem("BATCH", origem_id=self.id, origem_addr=self.addr,
+                           origem_nome=self.nome, lamport=chats[-1][0], conteudo={"chats": chats})
+        self.multicast_enviar(msg)
+
+    def tratar_lote_chat(self, msg):
+        origem_id = msg.origem_id
+        origem_nome = msg.origem_nome or f"Unknown_{origem_id}"
+        ts_berkeley = self.gerenciador_tempo.get_tempo()
+        agora = time.time()
+        itens = [{
+            "lamport": lam,
+            "origem_id": origem_id,
+            "origem_nome": origem_nome,
+            "texto": texto,
+            "ts_real": agora,
+            "ts_berkeley": ts_berkeley
+        } for lam, texto in (msg.conteudo or {}).get("chats", [])
+            if not self.historico.contem(lam, origem_id)]
+        if not itens:
+            return
+        # uma única mescla no histórico para o lote inteiro
+        self.historico.estende(itens)
+        tempo_formatado = self.gerenciador_tempo.formatar_tempo(ts_berkeley)
+        linhas = "\n".join(f"[{tempo_formatado}] {origem_nome}: {it['texto']}" for it in itens)
+        print(f"\n{linhas}\n> ", end="")
+
     def sair(self):
         if self.id is None:
             self.rodando = False
 
             return
+        # não deixa para trás um lote ainda na janela de espera
+        if self.lote_chat is not None:
+            self.enviar_lote_chat()
         # sempre multicast para que todos atualizem suas listas de peers
         goodbye = Mensagem("GOODBYE", origem_id=self.id, origem_addr=self.addr, 
                          origem_nome=self.nome, lamport=self.incrementa_lamport(), 
@@ -865,15 +1460,24 @@ class No:
                     pass
         print(f"[INFO] {self.nome} saindo...")
         self.rodando = False
-        try:
-            self.msock.close()
-            self.sock.close()
-        except:
-            pass
+        if self.historico.armazenamento is not None:
+            self.historico.armazenamento.fechar()
+        self._parar_servicos()
+
+    def _parar_servicos(self):
+        # num agendador compartilhado, os timers deste nó se cancelam ao ver rodando falso
+        if self._agendador_proprio:
+            self.agendador.parar()
+        self.transporte.fechar()
+        if self._recepcao_propria:
+            self.recepcao.parar()
+        self.frio.fechar()
+        self.metricas.parar()
+        self._parado.set()
 
     def repl(self):
         print(f"[REPL] {self.nome} conectado. Digite mensagens para enviar.")
-        print("Comandos: 'historico' mostra histórico, 'usuarios' lista participantes, 'tempo' mostra tempo, 'chutar <nome>' inicia votação, 'votar <sim/não>' vota, 'sair' deixa o chat, 'ajuda' para ver os comandos")
+        print("Comandos: 'historico' mostra histórico, 'usuarios' lista participantes, 'tempo' mostra tempo, 'chutar <nome>' inicia votação, 'votar <sim/não>' vota, 'timers' mostra o agendador, 'stats' mostra as métricas, 'sair' deixa o chat, 'ajuda' para ver os comandos")
         try:
             while self.rodando:
                 cmd = input("> ").strip()
@@ -905,8 +1509,22 @@ class No:
                     correcao = self.gerenciador_tempo.get_correcao()
                     tempo_formatado = self.gerenciador_tempo.formatar_tempo(tempo_atual)
                     print(f"\n[TEMPO] Tempo sincronizado: {tempo_formatado}")
-                    print(f"[TEMPO] Correção aplicada: {correcao:.2f} segundos")
-                    print(f"[TEMPO] Tempo local: {time.strftime('%H:%M:%S', time.localtime(time.time()))}\n")
+                    print(f"[TEMPO] Correção aplicada: {correcao:.3f} segundos")
+                    tempo_local = self.gerenciador_tempo.relogio()
+                    print(f"[TEMPO] Tempo local: {time.strftime('%H:%M:%S', time.localtime(tempo_local))}\n")
+                elif cmd.lower() == "timers":
+                    est = self.agendador.estatisticas()
+                    print(f"\n[TIMERS] {est['pendentes']} pendentes, {est['disparos']} disparos, "
+                          f"{est['despertares']} despertares, {threading.active_count()} threads")
+                    if "jitter_medio" in est:
+                        print(f"[TIMERS] jitter médio {est['jitter_medio'] * 1000:.2f} ms, p50 "
+                              f"{est['jitter_p50'] * 1000:.2f} ms, p99 {est['jitter_p99'] * 1000:.2f} ms, "
+                              f"máximo {est['jitter_max'] * 1000:.2f} ms\n")
+                elif cmd.lower() == "stats":
+                    print("\n--- MÉTRICAS ---")
+                    for linha in self.metricas.resumo():
+                        print(f"  {linha}")
+                    print("--- FIM DAS MÉTRICAS ---\n")
                 elif cmd.lower().startswith("chutar "):
                     partes = cmd.split(" ", 1)
                     if len(partes) > 1:
@@ -931,19 +1549,115 @@ class No:
         except EOFError:
             self.sair()
 
-    def start(self):
-        threading.Thread(target=self.listener_multicast, daemon=True).start()
-        threading.Thread(target=self.listener_unicast, daemon=True).start()
-        threading.Thread(target=self.loop_heartbeat, daemon=True).start()
-        threading.Thread(target=self.monitor_heartbeat, daemon=True).start()
-        self.entrar_na_rede()
-        self.repl()
+    def aguardar_parada(self):
+        # modo sem REPL (--sem-repl): o nó fica no ar até ser chutado ou receber Ctrl+C;
+        # a espera acorda de tempos em tempos para o Ctrl+C funcionar também no Windows
+        try:
+            while self.rodando and not self._parado.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            self.sair()
+
+    def start(self, modo=MODO_RUNTIME, repl=True):
+        if modo == "async":
+            from runtime_async import RuntimeAsync
+            RuntimeAsync(self).rodar(repl)
+            return
+        self.iniciar_servicos()
+        try:
+            self.entrar_na_rede()
+            if repl:
+                self.repl()
+            else:
+                self.aguardar_parada()
+        except KeyboardInterrupt:
+            # Ctrl+C ainda na entrada
+            self.sair()
+        finally:
+            self._parar_servicos()
+
+    def _periodico(self, intervalo, funcao):
+        # o timer se cancela sozinho quando o nó para
+        @functools.wraps(funcao)
+        def tique():
+            if not self.rodando:
+                timer.cancelar()
+                return
+            funcao()
+        timer = self.agendador.periodico(intervalo, tique)
+        return timer
+
+    def servir_metricas(self):
+        if self.porta_metricas is None:
+            return
+        try:
+            self.metricas.servir(ENDERECO_METRICAS, self.porta_metricas)
+            print(f"[METRICAS] formato Prometheus em http://{ENDERECO_METRICAS}:{self.porta_metricas}/metrics")
+        except OSError as e:
+            print(f"[WARN] não foi possível abrir o endpoint de métricas: {e}")
+
+    def iniciar_servicos(self):
+        # recepção e timers do modo thread, sem entrar na rede nem abrir o REPL
+        if self._agendador_proprio:
+            self.agendador.iniciar()
+        if self._recepcao_propria:
+            self.recepcao.iniciar()
+        self.transporte.iniciar(self._enfileirar_unicast, self._enfileirar_multicast)
+        self.servir_metricas()
+        self._agendar(0.0, self._tique_heartbeat)
+        self._periodico(INTERVALO_VERIFICACAO_FALHA, self.verificar_heartbeat)
+        self._periodico(INTERVALO_NACK_FRAGMENTOS, self.pedir_fragmentos)
+        self._periodico(INTERVALO_NACK_CONFIAVEL, self.reparar_multicast)
+        if self.swim is not None:
+            self._periodico(INTERVALO_PASSO_SWIM, self.swim.passo)
+        if self.historico.armazenamento is not None:
+            self._periodico(INTERVALO_DESCARGA_LOG, self.descarregar_historico)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Nó do sistema de chat distribuído")
     parser.add_argument("--port", type=int, required=True, help="porta UDP do nó")
     parser.add_argument("--name", type=str, default=None, help="nome do nó")
+    parser.add_argument("--dados", type=str, default=None, help="diretório para guardar o histórico em disco")
+    parser.add_argument("--lote-chat", action="store_true", default=LOTE_CHAT,
+                        help="agrupa rajadas de mensagens num único datagrama BATCH")
+    parser.add_argument("--modo", choices=["thread", "async"], default=MODO_RUNTIME,
+                        help="runtime: uma thread por tarefa ou um único loop asyncio")
+    parser.add_argument("--eleicao", choices=["bully", "rapida"], default=MODO_ELEICAO,
+                        help="algoritmo de eleição: bully clássico ou sondagem rápida dos maiores")
+    parser.add_argument("--membros", choices=["coordenador", "swim"], default=MODO_MEMBROS,
+                        help="lista de participantes: versionada pelo coordenador ou por fofoca SWIM")
+    parser.add_argument("--desvio-relogio", type=float, default=0.0,
+                        help="segundos somados ao relógio local, para testar a sincronização numa máquina só")
+    parser.add_argument("--intervalo-berkeley", type=float, default=INTERVALO_SINCRONIZACAO_BERKELEY,
+                        help="segundos entre rodadas Berkeley quando este nó for coordenador")
+    parser.add_argument("--metricas", type=int, default=None, metavar="PORTA",
+                        help="expõe as métricas no formato Prometheus em http://127.0.0.1:PORTA/metrics")
+    parser.add_argument("--profile", type=str, default=None, metavar="ARQUIVO",
+                        help="perfil por amostragem de todos os threads, gravado em pilhas dobradas (flame graph) ao sair")
+    parser.add_argument("--trace", type=str, default=None, metavar="ARQUIVO",
+                        help="spans por mensagem e esperas nos locks, gravados em JSON Trace Event (Perfetto) ao sair")
+    parser.add_argument("--sem-repl", action="store_true",
+                        help="roda sem o prompt interativo (benchmarks, serviços); Ctrl+C sai")
     args = parser.parse_args()
 
-    no = No(porta=args.port, nome=args.name)
-    no.start()
\ No newline at end of file
+    rastreador = Rastreador() if args.trace else None
+    no = No(porta=args.port, nome=args.name, dados=args.dados, lote_chat=args.lote_chat,
+            eleicao=args.eleicao, membros=args.membros, desvio_relogio=args.desvio_relogio,
+            intervalo_berkeley=args.intervalo_berkeley, porta_metricas=args.metricas, rastreio=rastreador)
+    amostrador = Amostrador() if args.profile else None
+    if amostrador is not None:
+        amostrador.iniciar()
+    try:
+        no.start(modo=args.modo, repl=not args.sem_repl)
+    finally:
+        if amostrador is not None:
+            amostrador.parar()
+            amostrador.gravar(args.profile)
+            print(f"\n[PERFIL] pilhas gravadas em {args.profile}")
+            for linha in amostrador.resumo():
+                print(f"[PERFIL] {linha}")
+        if rastreador is not None:
+            rastreador.gravar(args.trace)
+            print(f"\n[TRACE] eventos gravados em {args.trace}")
+            for linha in rastreador.resumo():
+                print(f"[TRACE] {linha}")
\ No newline at end of file
@@ -0,0 +1,44 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# nós no.py em subprocessos para os benchmarks em loopback: cada linha impressa
+# pelo nó vai para o callback registrar(nome, linha) assim que é lida do pipe
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+TIMEOUT_SAIDA = 5.0
+
+
+class ProcessoNo:
+    def __init__(self, porta, nome, registrar, *extras):
+        self.nome = nome
+        self.inicio = time.perf_counter()
+        ambiente = dict(os.environ, PYTHONIOENCODING="utf-8")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-u", "no.py", "--port", str(porta), "--name", nome, "--sem-repl", *extras],
+            cwd=DIRETORIO, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, encoding="utf-8", errors="replace", env=ambiente)
+        self._registrar = registrar
+        threading.Thread(target=self._ler, daemon=True).start()
+
+    def _ler(self):
+        for linha in self.proc.stdout:
+            self._registrar(self.nome, linha.rstrip())
+
+    def encerrar(self):
+        # Ctrl+C: o nó manda GOODBYE e sai da lista dos outros
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+            try:
+                self.proc.wait(TIMEOUT_SAIDA)
+            except subprocess.TimeoutExpired:
+                pass
+        self.matar()
+
+    def matar(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from config import *
+
+POLITICAS_FILA = ("descartar", "bloquear")
+
+
+class FilaRecepcao:
+    # os listeners só leem o socket e enfileiram; um pool de trabalhadores roda a
+    # remontagem, a decodificação e os handlers. Cada origem cai sempre no mesmo
+    # trabalhador (hash da chave que o nó passa: o origem_id, ou o endereço), então
+    # as mensagens de uma origem continuam em ordem, e um handler lento só atrasa
+    # as origens que dividem o trabalhador
+    def __init__(self, trabalhadores=TRABALHADORES_RECEPCAO, capacidade=CAPACIDADE_FILA_RECEPCAO,
+                 politica=POLITICA_FILA_RECEPCAO):
+        if politica not in POLITICAS_FILA:
+            raise ValueError(f"política de fila desconhecida: {politica}")
+        self.trabalhadores = trabalhadores
+        self.politica = politica
+        # limite somado de todas as filas: um trabalhador preso num handler lento
+        # pode acumular a capacidade inteira sem descartar o que é dos outros
+        self.capacidade = capacidade
+        self._filas = [queue.SimpleQueue() for _ in range(trabalhadores)]
+        self._rodando = False
+        self._lock = threading.Lock()
+        # com "bloquear", o listener dorme aqui até um trabalhador tirar algo da fila
+        self._espaco = threading.Condition()
+        self._esperando = 0
+        self.descartadas = 0
+        self.bloqueios = 0
+        self.tempo_bloqueado = 0.0
+        # por trabalhador, escrito só por ele: [processadas, segundos na fila, maior espera]
+        self._esperas = [[0, 0.0, 0.0] for _ in range(trabalhadores)]
+
+    def iniciar(self):
+        self._rodando = True
+        for i in range(self.trabalhadores):
+            threading.Thread(target=self._trabalhar, args=(i,), daemon=True, name=f"no-recepcao-{i}").start()
+
+    def parar(self):
+        if not self._rodando:
+            return
+        self._rodando = False
+        with self._espaco:
+            self._espaco.notify_all()
+        for fila in self._filas:
+            fila.put(None)
+
+    def enfileirar(self, origem, funcao, *args):
+        # chamado pelo listener; devolve False quando a fila estava cheia e a
+        # mensagem foi descartada (o multicast confiável recupera por NACK)
+        if not self._filas:
+            # sem trabalhadores: processa no próprio listener, como antes
+            funcao(*args)
+            return True
+        fila = self._filas[hash(origem) % self.trabalhadores]
+        if self.profundidade() >= self.capacidade:
+            if self.politica == "descartar":
+                with self._lock:
+                    self.descartadas += 1
+                return False
+            # bloquear: o listener para de ler e o excesso espera na fila do socket no kernel
+            inicio = time.perf_counter()
+            with self._espaco:
+                self._esperando += 1
+                while self.profundidade() >= self.capacidade and self._rodando:
+                    self._espaco.wait()
+                self._esperando -= 1
+            with self._lock:
+                self.bloqueios += 1
+                self.tempo_bloqueado += time.perf_counter() - inicio
+        fila.put((time.perf_counter(), funcao, args))
+        return True
+
+    def _trabalhar(self, indice):
+        fila = self._filas[indice]
+        espera = self._esperas[indice]
+        while True:
+            tarefa = fila.get()
+            if self._esperando:
+                # abriu uma vaga: acorda o listener que esperava a fila esvaziar
+                with self._espaco:
+                    self._espaco.notify()
+            # parado, o que ainda estava na fila é descartado junto com o listener
+            if tarefa is None or not self._rodando:
+                return
+            enfileirada, funcao, args = tarefa
+            atraso = time.perf_counter() - enfileirada
+            espera[0] += 1
+            espera[1] += atraso
+            if atraso > espera[2]:
+                espera[2] = atraso
+            try:
+                funcao(*args)
+            except Exception as e:
+                if self._rodando:
+                    print(f"[ERROR] erro em {getattr(funcao, '__name__', funcao)}: {e}")
+
+    def profundidade(self):
+        return sum(fila.qsize() for fila in self._filas)
+
+    def estatisticas(self):
+        processadas = sum(e[0] for e in self._esperas)
+        espera_total = sum(e[1] for e in self._esperas)
+        with self._lock:
+            descartadas, bloqueios, tempo_bloqueado = self.descartadas, self.bloqueios, self.tempo_bloqueado
+        return {
+            "trabalhadores": self.trabalhadores,
+            "politica": self.politica,
+            "profundidade": self.profundidade(),
+            "processadas": processadas,
+            "espera_segundos": espera_total,
+            "espera_maxima": max((e[2] for e in self._esperas), default=0.0),
+            "descartadas": descartadas,
+            "bloqueios": bloqueios,
+            "tempo_bloqueado": tempo_bloqueado,
+        }
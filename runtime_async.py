@@ -0,0 +1,197 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+
+class _ProtocoloDatagrama(asyncio.DatagramProtocol):
+    def __init__(self, no, processar, nome):
+        self.no = no
+        self.processar = processar
+        self.nome = nome
+
+    def datagram_received(self, data, addr):
+        try:
+            self.processar(data, addr)
+        except Exception as e:
+            if self.no.rodando:
+                print(f"[ERROR] erro {self.nome}: {e}")
+
+    def error_received(self, exc):
+        if self.no.rodando:
+            self.no.transporte.erros_recepcao += 1
+            print(f"[ERROR] erro {self.nome}: {exc}")
+
+
+class RuntimeAsync:
+    # roda o nó num único loop asyncio: os dois sockets viram endpoints de datagrama,
+    # as tarefas periódicas e com timeout viram corrotinas e só o REPL (input
+    # bloqueante) fica num executor
+    def __init__(self, no, trabalhadores=TRABALHADORES_ASYNC):
+        self.no = no
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix="no-async")
+        self._tarefas = set()
+        # tarefas que No._disparar pede e a corrotina que as substitui aqui
+        self._corrotinas = {
+            "iniciar_eleicao": self.eleicao,
+            "iniciar_sincronizacao_berkeley": self.sincronizacao_berkeley,
+            "monitorar_votacao": self.monitorar_votacao,
+        }
+        # laços que rodam uma vez só por nó: a tarefa viva de cada um, pelo nome
+        self._lacos = {"iniciar_sincronizacao_berkeley": None, "monitorar_votacao": None}
+
+    def rodar(self, repl=True):
+        asyncio.run(self.executar(repl))
+
+    async def executar(self, repl=True):
+        self.loop = asyncio.get_running_loop()
+        no = self.no
+        no.runtime = self
+        transportes = []
+        # o loop escuta os sockets do TransporteUDP direto, sem os threads de recepção
+        for sock, processar, nome in ((no.transporte.msock, no.processar_multicast, "listener_multicast"),
+                                      (no.transporte.sock, no.processar_unicast, "listener_unicast")):
+            transporte, _ = await self.loop.create_datagram_endpoint(
+                lambda p=processar, n=nome: _ProtocoloDatagrama(no, p, n), sock=sock)
+            transportes.append(transporte)
+        no.servir_metricas()
+
+        self._iniciar(self.periodico(INTERVALO_HEARTBEAT / 2, no.enviar_heartbeat, imediato=True))
+        self._iniciar(self.periodico(INTERVALO_VERIFICACAO_FALHA, no.verificar_heartbeat))
+        self._iniciar(self.periodico(INTERVALO_NACK_FRAGMENTOS, no.pedir_fragmentos))
+        self._iniciar(self.periodico(INTERVALO_NACK_CONFIAVEL, no.reparar_multicast))
+        if no.swim is not None:
+            self._iniciar(self.periodico(INTERVALO_PASSO_SWIM, no.swim.passo))
+        if no.historico.armazenamento is not None:
+            self._iniciar(self.periodico(INTERVALO_DESCARGA_LOG, no.descarregar_historico))
+        try:
+            await self.entrar_na_rede()
+            if no.rodando:
+                await self.loop.run_in_executor(self.executor, no.repl if repl else no.aguardar_parada)
+        finally:
+            no.rodando = False
+            for tarefa in list(self._tarefas):
+                tarefa.cancel()
+            for transporte in transportes:
+                transporte.close()
+            no.metricas.parar()
+            self.executor.shutdown(wait=False)
+            no.runtime = None
+
+    def _no_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _iniciar(self, corrotina):
+        tarefa = self.loop.create_task(corrotina)
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._fim)
+        return tarefa
+
+    def _fim(self, tarefa):
+        self._tarefas.discard(tarefa)
+        if not tarefa.cancelled() and tarefa.exception() is not None and self.no.rodando:
+            print(f"[ERROR] tarefa falhou: {tarefa.exception()}")
+
+    def disparar(self, alvo, *args):
+        nome = alvo.__name__
+        corrotina = self._corrotinas.get(nome)
+
+        def agendar():
+            if corrotina is None:
+                self.loop.run_in_executor(self.executor, alvo, *args)
+                return
+            if nome not in self._lacos:
+                self._iniciar(corrotina(*args))
+                return
+            # o laço anterior ainda roda (ex.: reeleito coordenador): ele segue as rodadas
+            anterior = self._lacos[nome]
+            if anterior is None or anterior.done():
+                self._lacos[nome] = self._iniciar(corrotina(*args))
+
+        # handlers rodam no loop; o REPL chama a partir do executor
+        if self._no_loop():
+            agendar()
+        else:
+            self.loop.call_soon_threadsafe(agendar)
+
+    def agendar(self, atraso, funcao, *args):
+        if self._no_loop():
+            return self.loop.call_later(atraso, funcao, *args)
+        self.loop.call_soon_threadsafe(self.loop.call_later, atraso, funcao, *args)
+
+    async def aguardar(self, futuro, timeout, condicao=None):
+        # espera um correlacao.Futuro sem ocupar o executor: cada resposta que o
+        # handler resolve reavalia a condição e acorda a corrotina
+        pronto = asyncio.Event()
+
+        def verificar():
+            if not futuro.satisfeito(condicao):
+                return
+            if self._no_loop():
+                pronto.set()
+            else:
+                self.loop.call_soon_threadsafe(pronto.set)
+
+        futuro.ao_resolver(verificar)
+        verificar()
+        try:
+            await asyncio.wait_for(pronto.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return futuro.satisfeito(condicao)
+
+    async def periodico(self, intervalo, funcao, imediato=False):
+        if not imediato:
+            await asyncio.sleep(intervalo)
+        while self.no.rodando:
+            try:
+                funcao()
+            except Exception as e:
+                if self.no.rodando:
+                    print(f"[ERROR] erro em {funcao.__name__}: {e}")
+            await asyncio.sleep(intervalo)
+
+    async def entrar_na_rede(self):
+        no = self.no
+        futuro = no._enviar_join()
+        if not futuro:
+            return
+        await self.aguardar(futuro, TIMEOUT_SINCRONIZACAO_HISTORICO)
+        no._concluir_entrada()
+
+    async def eleicao(self):
+        no = self.no
+        if no.modo_eleicao == "rapida":
+            # as esperas da sondagem bloqueiam no futuro: vão para o executor
+            await self.loop.run_in_executor(self.executor, no.eleicao_rapida)
+            return
+        espera = no._preparar_eleicao()
+        if espera is None:
+            return
+        req, futuro = espera
+        no._concluir_eleicao(req, await self.aguardar(futuro, TIMEOUT_ELEICAO))
+
+    async def monitorar_votacao(self):
+        no = self.no
+        while no.rodando:
+            if no.verificar_votacao():
+                break
+            espera = no._aguardar_apuracao()
+            if espera is None:
+                break
+            await self.aguardar(*espera)
+
+    async def sincronizacao_berkeley(self):
+        no = self.no
+        if not no.eh_coordenador:
+            return
+        while no.rodando and no.eh_coordenador:
+            await asyncio.sleep(no.proxima_rodada_berkeley())
+            if not no.rodando or not no.eh_coordenador:
+                break
+            print("[TEMPO] Iniciando sincronização de tempo Berkeley...")
+            # a rodada bloqueia no futuro até as respostas chegarem: vai para o executor
+            await self.loop.run_in_executor(self.executor, no.sincronizar_berkeley)
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+import time
+from config import *
+from agendador import Agendador
+from no import No
+from recepcao import FilaRecepcao
+from transporte import RedeSimulada
+
+# roda n nós num único processo sobre a rede simulada em memória e mede a
+# entrada no grupo, o espalhamento de chat, a sincronização de histórico de um
+# nó que chega atrasado e a eleição depois da queda do coordenador
+
+PORTA_BASE = 20000
+INTERVALO_AMOSTRA = 0.01
+
+
+def esperar(condicao, timeout):
+    # devolve quanto tempo a condição levou para valer, ou None no timeout
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < timeout:
+        if condicao():
+            return round(time.perf_counter() - inicio, 3)
+        time.sleep(INTERVALO_AMOSTRA)
+    return None
+
+
+def criar_no(rede, agendador, recepcao, i, eleicao):
+    porta = PORTA_BASE + i
+    no = No(porta, nome=f"S{i}", eleicao=eleicao, transporte=rede.conectar(("127.0.0.1", porta)),
+            agendador=agendador, recepcao=recepcao)
+    no.iniciar_servicos()
+    return no
+
+
+def derrubar(no):
+    # queda sem GOODBYE: o nó some da rede e para os próprios timers
+    no.rodando = False
+    no.transporte.fechar()
+
+
+def simular(args):
+    rede = RedeSimulada(latencia=args.latencia, variacao=args.variacao, perda=args.perda,
+                        banda=args.banda, semente=args.semente)
+    agendador = Agendador(trabalhadores=args.trabalhadores)
+    agendador.iniciar()
+    # uma fila de recepção para todos: o thread da rede só entrega e enfileira. Ela
+    # tem a capacidade de um nó só, então bloqueia em vez de descartar, como a
+    # entrega direta fazia: a fila da própria rede simulada segura o excesso
+    recepcao = FilaRecepcao(trabalhadores=args.trabalhadores_recepcao, politica="bloquear")
+    recepcao.iniciar()
+    n = args.nos
+    resultado = {"nos": n, "latencia": args.latencia, "perda": args.perda, "banda": args.banda,
+                 "eleicao": args.eleicao}
+    nos = []
+    try:
+        coordenador = criar_no(rede, agendador, recepcao, 1, args.eleicao)
+        coordenador.tornar_coordenador_inicial()
+        nos.append(coordenador)
+        inicio = time.perf_counter()
+        # entra em ondas: centenas de JOINs de uma vez só medem a fila do coordenador
+        for primeiro in range(2, n + 1, args.onda):
+            onda = [criar_no(rede, agendador, recepcao, i, args.eleicao)
+                    for i in range(primeiro, min(primeiro + args.onda, n + 1))]
+            nos.extend(onda)
+            for no in onda:
+                no.entrar_na_rede(esperar=False)
+            esperar(lambda: all(no.id is not None for no in onda), args.timeout)
+        pronto = esperar(lambda: all(no.id is not None and len(no.peers) == n for no in nos), args.timeout)
+        resultado["entrada_s"] = round(time.perf_counter() - inicio, 3) if pronto is not None else None
+
+        # espalhamento: um nó manda uma rajada e todos precisam recebê-la
+        emissor = nos[-1]
+        base = len(emissor.historico)
+        for k in range(args.mensagens):
+            emissor.enviar_chat(f"mensagem {k}")
+        alvo = base + args.mensagens
+        t = esperar(lambda: all(len(no.historico) >= alvo for no in nos), args.timeout)
+        resultado["espalhamento_s"] = t
+        resultado["entregas_por_s"] = round(args.mensagens * (n - 1) / t) if t else None
+
+        # sincronização: um nó novo recebe o histórico inteiro na entrada
+        atrasado = criar_no(rede, agendador, recepcao, n + 1, args.eleicao)
+        nos.append(atrasado)
+        atrasado.entrar_na_rede(esperar=False)
+        total = len(coordenador.historico)
+        resultado["sincronizacao_s"] = esperar(lambda: len(atrasado.historico) >= total, args.timeout)
+
+        # eleição: o coordenador cai e os sobreviventes precisam concordar no maior id
+        derrubar(coordenador)
+        vivos = nos[1:]
+        maior = max(no.id for no in vivos if no.id is not None)
+        resultado["eleicao_s"] = esperar(lambda: all(no.coordenador_id == maior for no in vivos), args.timeout)
+    finally:
+        for no in nos:
+            derrubar(no)
+        agendador.parar()
+        recepcao.parar()
+        rede.parar()
+    resultado["rede"] = rede.estatisticas()
+    resultado["agendador"] = {k: round(v, 5) if isinstance(v, float) else v
+                              for k, v in agendador.estatisticas().items()}
+    resultado["recepcao"] = {k: round(v, 5) if isinstance(v, float) else v
+                             for k, v in recepcao.estatisticas().items()}
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="muitos nós num processo sobre a rede simulada")
+    parser.add_argument("--nos", type=int, default=100)
+    parser.add_argument("--latencia", type=float, default=LATENCIA_SIMULADA, help="segundos")
+    parser.add_argument("--variacao", type=float, default=VARIACAO_LATENCIA_SIMULADA, help="segundos")
+    parser.add_argument("--perda", type=float, default=PERDA_SIMULADA, help="fração dos datagramas perdidos")
+    parser.add_argument("--banda", type=float, default=BANDA_SIMULADA, help="bytes/s por nó (0 = sem limite)")
+    parser.add_argument("--onda", type=int, default=25, help="nós que pedem entrada ao mesmo tempo")
+    parser.add_argument("--mensagens", type=int, default=20, help="tamanho da rajada de chat")
+    parser.add_argument("--eleicao", choices=["bully", "rapida"], default=MODO_ELEICAO)
+    parser.add_argument("--trabalhadores", type=int, default=TRABALHADORES_AGENDADOR,
+                        help="pool do agendador compartilhado pelos nós")
+    parser.add_argument("--trabalhadores-recepcao", type=int, default=TRABALHADORES_RECEPCAO,
+                        help="pool da fila de recepção compartilhada pelos nós (0 = no thread da rede)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="limite de cada etapa, em segundos")
+    parser.add_argument("--semente", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="mostra os logs dos nós")
+    parser.add_argument("--json", type=str, default=None, help="arquivo para gravar o resultado")
+    args = parser.parse_args()
+
+    # os logs dos nós saem por print de vários threads: sem --verbose vão para o devnull
+    saida = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    resultado = simular(args)
+    for chave in ("entrada_s", "espalhamento_s", "entregas_por_s", "sincronizacao_s", "eleicao_s"):
+        valor = resultado.get(chave)
+        print(f"{chave:<16} {'não concluiu' if valor is None else valor}", file=saida)
+    print(f"{'rede':<16} {resultado['rede']}", file=saida)
+    print(f"{'agendador':<16} {resultado['agendador']}", file=saida)
+    print(f"{'recepcao':<16} {resultado['recepcao']}", file=saida)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
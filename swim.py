@@ -0,0 +1,254 @@
+import math
+import random
+import time
+from threading import Lock
+from config import *
+from mensagem import Mensagem
+from codec import CODEC_JSON, CODECS_SUPORTADOS
+
+VIVO = "vivo"
+SUSPEITO = "suspeito"
+MORTO = "morto"
+
+
+class _Membro:
+    def __init__(self, addr, nome, codecs, estado=VIVO, incarnacao=0):
+        self.addr = tuple(addr)
+        self.nome = nome
+        self.codecs = codecs
+        self.estado = estado
+        self.incarnacao = incarnacao
+        # início da suspeita ou da morte, para os prazos
+        self.desde = 0.0
+
+    def boato(self, pid):
+        return [pid, self.estado, self.incarnacao, list(self.addr), self.nome, self.codecs]
+
+
+class MembrosSwim:
+    # associação ao grupo no estilo SWIM: a cada período o nó sonda um membro
+    # (PING), pede sondagem indireta a k outros se não houver ACK (PING_REQ) e
+    # espalha as mudanças de estado pegando carona nessas mesmas mensagens; o
+    # custo por nó não depende do tamanho do grupo
+    def __init__(self, no):
+        self.no = no
+        self.lock = Lock()
+        self.membros = {}
+        self.incarnacao = 0
+        # id -> [boato, transmissões restantes]
+        self._boatos = {}
+        self._fila = []
+        self._seq = 0
+        self._sondagem = None
+        # seq do PING que eu mandei por outro nó -> (quem pediu, seq dele, quando)
+        self._repasses = {}
+        self._proximo_periodo = 0.0
+
+    def _vivos(self):
+        return [pid for pid, m in self.membros.items() if m.estado != MORTO]
+
+    def _espalhar(self, pid):
+        # cada mudança vai em ~LAMBDA * log(n) mensagens antes de sair da fila
+        if pid == self.no.id:
+            boato = [pid, VIVO, self.incarnacao, list(self.no.addr), self.no.nome, CODECS_SUPORTADOS]
+        else:
+            boato = self.membros[pid].boato(pid)
+        restantes = int(math.ceil(LAMBDA_BOATOS_SWIM * math.log2(len(self.membros) + 2)))
+        self._boatos[pid] = [boato, restantes]
+
+    def _pegar_boatos(self):
+        with self.lock:
+            escolhidos = sorted(self._boatos.items(), key=lambda item: -item[1][1])[:MAX_BOATOS_SWIM]
+            boatos = []
+            for pid, entrada in escolhidos:
+                boatos.append(entrada[0])
+                entrada[1] -= 1
+                if entrada[1] <= 0:
+                    del self._boatos[pid]
+            return boatos
+
+    def _enviar(self, addr, tipo, conteudo):
+        no = self.no
+        conteudo["boatos"] = self._pegar_boatos()
+        msg = Mensagem(tipo, origem_id=no.id, origem_addr=no.addr, origem_nome=no.nome,
+                       lamport=no.incrementa_lamport(), conteudo=conteudo)
+        no.unicast_enviar(addr, msg)
+
+    def _atualizar_peers(self, pid, membro):
+        no = self.no
+        with no.lock_peers:
+            if membro.estado == MORTO:
+                no.peers.pop(pid, None)
+            else:
+                no.peers[pid] = {"addr": membro.addr, "nome": membro.nome, "codecs": membro.codecs}
+
+    def conhecer(self, peers):
+        # chamado quando chega uma lista inteira do coordenador (ASSIGN_ID, COORDINATOR):
+        # quem ainda não é membro entra como vivo; o resto muda só por boato
+        with self.lock:
+            for pid, info in peers.items():
+                if pid != self.no.id and pid not in self.membros and info.get("addr"):
+                    self.membros[pid] = _Membro(info["addr"], info.get("nome"), info.get("codecs", [CODEC_JSON]))
+
+    def alterar(self, op, pid, info=None):
+        # entrada atribuída pelo coordenador, saída (GOODBYE) ou chute
+        agora = time.time()
+        with self.lock:
+            membro = self.membros.get(pid)
+            if op == "entrou":
+                # id reaproveitado: a incarnação nova vence a morte registrada
+                incarnacao = membro.incarnacao + 1 if membro is not None else 0
+                membro = _Membro(info["addr"], info.get("nome"), info.get("codecs", [CODEC_JSON]),
+                                 VIVO, incarnacao)
+                self.membros[pid] = membro
+            elif membro is None or membro.estado == MORTO:
+                return
+            else:
+                membro.estado = MORTO
+                membro.desde = agora
+            self._espalhar(pid)
+        self._atualizar_peers(pid, membro)
+
+    def _sobrepoe(self, estado, incarnacao, membro):
+        if membro.estado == MORTO:
+            return estado == VIVO and incarnacao > membro.incarnacao
+        if estado == MORTO:
+            return True
+        if estado == VIVO:
+            return incarnacao > membro.incarnacao
+        if membro.estado == VIVO:
+            return incarnacao >= membro.incarnacao
+        return incarnacao > membro.incarnacao
+
+    def _aplicar_boato(self, boato, agora):
+        pid, estado, incarnacao, addr, nome, codecs = boato
+        no = self.no
+        with self.lock:
+            if pid == no.id:
+                # alguém acha que estou suspeito ou morto: refuto com incarnação maior
+                if estado != VIVO and incarnacao >= self.incarnacao:
+                    self.incarnacao = incarnacao + 1
+                    self._espalhar(pid)
+                return
+            membro = self.membros.get(pid)
+            if membro is None:
+                membro = _Membro(addr, nome, codecs, estado, incarnacao)
+                membro.desde = agora
+                self.membros[pid] = membro
+            elif self._sobrepoe(estado, incarnacao, membro):
+                anterior = membro.estado
+                membro.estado = estado
+                membro.incarnacao = incarnacao
+                membro.addr, membro.nome, membro.codecs = tuple(addr), nome, codecs
+                if estado != anterior:
+                    membro.desde = agora
+            else:
+                return
+            self._espalhar(pid)
+        if estado == MORTO:
+            print(f"[SWIM] {nome} (id {pid}) saiu do grupo")
+        self._atualizar_peers(pid, membro)
+
+    def _proximo_alvo(self):
+        # round-robin sobre uma ordem embaralhada: todo membro é sondado a cada volta
+        while True:
+            if not self._fila:
+                self._fila = self._vivos()
+                random.shuffle(self._fila)
+                if not self._fila:
+                    return None
+            pid = self._fila.pop()
+            membro = self.membros.get(pid)
+            if membro is not None and membro.estado != MORTO:
+                return pid
+
+    def _suspeitar(self, pid, agora):
+        membro = self.membros.get(pid)
+        if membro is None or membro.estado != VIVO:
+            return
+        membro.estado = SUSPEITO
+        membro.desde = agora
+        self._espalhar(pid)
+        print(f"[SWIM] {membro.nome} (id {pid}) sem resposta, marcado como suspeito")
+
+    def _expirar(self, agora):
+        # suspeita não refutada a tempo vira morte; lápides velhas são esquecidas
+        prazo = SUSPEITA_SWIM * PERIODO_SWIM * max(1.0, math.log2(len(self.membros) + 1))
+        mortos = []
+        for pid, membro in list(self.membros.items()):
+            if membro.estado == SUSPEITO and agora - membro.desde >= prazo:
+                membro.estado = MORTO
+                membro.desde = agora
+                self._espalhar(pid)
+                mortos.append((pid, membro))
+            elif membro.estado == MORTO and agora - membro.desde >= 10 * prazo:
+                del self.membros[pid]
+        for seq, (_, _, inicio) in list(self._repasses.items()):
+            if agora - inicio >= PERIODO_SWIM:
+                del self._repasses[seq]
+        return mortos
+
+    def passo(self, agora=None):
+        no = self.no
+        if no.id is None:
+            return
+        if agora is None:
+            agora = time.time()
+        envios = []
+        with self.lock:
+            sondagem = self._sondagem
+            if sondagem is not None:
+                if agora - sondagem["inicio"] >= PERIODO_SWIM:
+                    self._suspeitar(sondagem["alvo"], agora)
+                    self._sondagem = None
+                elif not sondagem["indireta"] and agora - sondagem["inicio"] >= TIMEOUT_PING_SWIM:
+                    sondagem["indireta"] = True
+                    ajudantes = [pid for pid in self._vivos() if pid != sondagem["alvo"]]
+                    for pid in random.sample(ajudantes, min(K_INDIRETO_SWIM, len(ajudantes))):
+                        envios.append((self.membros[pid].addr, "PING_REQ",
+                                       {"alvo": sondagem["alvo"], "seq": sondagem["seq"]}))
+            mortos = self._expirar(agora)
+            if self._sondagem is None and agora >= self._proximo_periodo:
+                alvo = self._proximo_alvo()
+                if alvo is not None:
+                    self._seq += 1
+                    self._sondagem = {"alvo": alvo, "seq": self._seq, "inicio": agora, "indireta": False}
+                    envios.append((self.membros[alvo].addr, "PING", {"seq": self._seq}))
+                self._proximo_periodo = agora + PERIODO_SWIM
+        for pid, membro in mortos:
+            print(f"[SWIM] {membro.nome} (id {pid}) não refutou a suspeita, removido do grupo")
+            self._atualizar_peers(pid, membro)
+        for addr, tipo, conteudo in envios:
+            self._enviar(addr, tipo, conteudo)
+
+    def tratar(self, msg):
+        conteudo = msg.conteudo or {}
+        agora = time.time()
+        for boato in conteudo.get("boatos", []):
+            self._aplicar_boato(boato, agora)
+        if not msg.origem_addr:
+            return
+        origem = tuple(msg.origem_addr)
+        seq = conteudo.get("seq")
+        if msg.tipo == "PING":
+            self._enviar(origem, "ACK", {"seq": seq, "alvo": self.no.id})
+        elif msg.tipo == "PING_REQ":
+            alvo = conteudo.get("alvo")
+            with self.lock:
+                membro = self.membros.get(alvo)
+                if membro is None:
+                    return
+                self._seq += 1
+                meu_seq = self._seq
+                self._repasses[meu_seq] = (origem, seq, agora)
+            self._enviar(membro.addr, "PING", {"seq": meu_seq})
+        elif msg.tipo == "ACK":
+            with self.lock:
+                repasse = self._repasses.pop(seq, None)
+                sondagem = self._sondagem
+                if (repasse is None and sondagem is not None and seq == sondagem["seq"]
+                        and conteudo.get("alvo") == sondagem["alvo"]):
+                    self._sondagem = None
+            if repasse is not None:
+                # ACK de uma sondagem indireta: devolve a quem pediu
+                self._enviar(repasse[0], "ACK", {"seq": repasse[1], "alvo": conteudo.get("alvo")})
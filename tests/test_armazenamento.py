@@ -0,0 +1,72 @@
+import os
+from armazenamento import LogHistorico, ArquivoFrio
+from mensagem import HistoricoCompacto
+
+
+def itens(inicio, fim, origem_id=1):
+    return [{"lamport": i, "origem_id": origem_id, "origem_nome": f"No:{origem_id}", "texto": f"m{i}",
+             "ts_real": 1000.0 + i, "ts_berkeley": 1000.0 + i} for i in range(inicio, fim)]
+
+
+def test_replay_dos_segmentos_na_ordem_de_escrita(tmp_path):
+    log = LogHistorico(str(tmp_path), tamanho_lote=7, tamanho_segmento=500)
+    esperados = itens(0, 100)
+    for i in range(0, 100, 3):
+        log.anexar(esperados[i:i + 3])
+    log.fechar()
+    assert len([nome for nome in os.listdir(tmp_path) if nome.startswith("seg-")]) > 1
+    assert LogHistorico(str(tmp_path)).carregar() == esperados
+
+
+def test_registro_cortado_no_fim_do_log_e_ignorado(tmp_path):
+    log = LogHistorico(str(tmp_path), tamanho_lote=1)
+    log.anexar(itens(0, 10))
+    log.fechar()
+    segmento = max(nome for nome in os.listdir(tmp_path) if nome.startswith("seg-"))
+    with open(tmp_path / segmento, "ab") as f:
+        # queda no meio de um registro: o tamanho promete mais do que foi escrito
+        f.write(b"\x00\x00\x01\x00{\"lamport\":")
+    reaberto = LogHistorico(str(tmp_path))
+    assert reaberto.carregar() == itens(0, 10)
+    # o próximo registro vai para um segmento novo, não para o cortado
+    reaberto.anexar(itens(10, 12))
+    reaberto.fechar()
+    assert LogHistorico(str(tmp_path)).carregar() == itens(0, 12)
+
+
+def test_snapshot_mais_cauda(tmp_path):
+    log = LogHistorico(str(tmp_path), tamanho_lote=1)
+    log.anexar(itens(0, 50))
+    ate = log.rotacionar()
+    log.compactar(itens(0, 50), ate)
+    assert not [nome for nome in os.listdir(tmp_path) if nome.startswith("seg-") and int(nome[4:10]) <= ate]
+    log.anexar(itens(50, 60))
+    log.fechar()
+    assert LogHistorico(str(tmp_path)).carregar() == itens(0, 60)
+
+
+def test_historico_com_parte_fria_volta_igual_depois_de_reiniciar(tmp_path):
+    def abrir():
+        historico = HistoricoCompacto(armazenamento=LogHistorico(str(tmp_path / "log"), tamanho_lote=10),
+                                      frio=ArquivoFrio(str(tmp_path / "frio")), max_mensagens=100,
+                                      max_bytes=None, max_idade=None, tamanho_segmento=40)
+        return historico, historico.carregar()
+
+    historico, restaurados = abrir()
+    assert restaurados == 0
+    historico.estende(itens(0, 300, 1) + itens(0, 200, 2))
+    historico.compactar()
+    historico.estende(itens(300, 350, 1))
+    historico.armazenamento.fechar()
+    esperado = historico.to_list()
+    resumo = historico.resumo()
+    assert historico.retencao()["frios_mensagens"] > 0
+
+    reaberto, restaurados = abrir()
+    assert restaurados == len(esperado) == 550
+    assert len(reaberto) == 550
+    assert reaberto.to_list() == esperado
+    assert reaberto.resumo() == resumo
+    # duplicata de um item frio continua recusada
+    assert not reaberto.adiciona(5, 1, "No:1", "m5")
+    reaberto.frio.fechar()
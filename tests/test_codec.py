@@ -0,0 +1,56 @@
+from codec import (codificar, decodificar, ler_origem, eh_binario, CODEC_JSON, CODEC_BINARIO, CODEC_ZLIB,
+                   FLAG_ZLIB, LIMIAR_COMPRESSAO)
+from mensagem import Mensagem
+
+
+def mensagem(tipo="CHAT", conteudo=None, seq=None, origem_id=3, addr=("127.0.0.1", 10003)):
+    msg = Mensagem(tipo, origem_id=origem_id, origem_addr=addr, origem_nome="No:10003", lamport=42,
+                   conteudo=conteudo)
+    msg.seq = seq
+    return msg
+
+
+def campos(msg):
+    return (msg.tipo, msg.origem_id, tuple(msg.origem_addr) if msg.origem_addr else None, msg.origem_nome,
+            msg.lamport, msg.conteudo, msg.seq)
+
+
+def test_ida_e_volta_em_todos_os_codecs():
+    for codec in (CODEC_JSON, CODEC_BINARIO, CODEC_ZLIB):
+        for msg in (mensagem(conteudo={"texto": "olá"}),
+                    mensagem(conteudo={"texto": "x"}, seq=[7, 12]),
+                    mensagem("HEARTBEAT", origem_id=None, addr=None)):
+            assert campos(decodificar(codificar(msg, codec))) == campos(msg)
+
+
+def test_binario_usa_o_cabecalho_fixo():
+    data = codificar(mensagem(conteudo={"texto": "oi"}), CODEC_BINARIO)
+    assert eh_binario(data)
+    assert not eh_binario(codificar(mensagem(conteudo={"texto": "oi"}), CODEC_JSON))
+
+
+def test_zlib_so_comprime_conteudo_grande():
+    pequeno = codificar(mensagem(conteudo={"texto": "oi"}), CODEC_ZLIB)
+    assert not pequeno[2] & FLAG_ZLIB
+    historico = [{"lamport": i, "origem_id": 1, "origem_nome": "No:10001", "texto": f"mensagem {i}"}
+                 for i in range(200)]
+    msg = mensagem("HISTORY", conteudo={"itens": historico})
+    grande = codificar(msg, CODEC_ZLIB)
+    assert grande[2] & FLAG_ZLIB
+    binario = codificar(msg, CODEC_BINARIO)
+    assert len(binario) > LIMIAR_COMPRESSAO and len(grande) < len(binario)
+    assert decodificar(grande).conteudo == {"itens": historico}
+
+
+def test_tipo_ou_endereco_fora_do_binario_cai_para_json():
+    for msg in (mensagem("DESCONHECIDO", conteudo={}), mensagem(addr=("::1", 10003), conteudo={})):
+        data = codificar(msg, CODEC_BINARIO)
+        assert not eh_binario(data)
+        assert campos(decodificar(data)) == campos(msg)
+
+
+def test_ler_origem_sem_decodificar():
+    origem_id, ip, porta = ler_origem(codificar(mensagem(conteudo={"texto": "oi"}), CODEC_BINARIO))
+    assert (origem_id, ip, porta) == (3, b"\x7f\x00\x00\x01", 10003)
+    assert ler_origem(codificar(mensagem(origem_id=None), CODEC_BINARIO))[0] is None
+    assert ler_origem(codificar(mensagem(), CODEC_JSON)) is None
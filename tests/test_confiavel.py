@@ -0,0 +1,126 @@
+from confiavel import EmissorConfiavel, ReceptorConfiavel
+from config import (INTERVALO_NACK_CONFIAVEL, MAX_NACKS_CONFIAVEL, JANELA_REORDEM_CONFIAVEL, INTERVALO_ANUNCIO_SEQ,
+                    INTERVALO_MAX_ANUNCIO_SEQ)
+from mensagem import Mensagem
+
+ORIGEM = ("127.0.0.1", 10002)
+SESSAO = 99
+PASSO = INTERVALO_NACK_CONFIAVEL * 1.01
+
+
+def faltando(receptor, agora):
+    nacks, _ = receptor.pendencias(agora)
+    return sorted(seq for _, _, seqs, _ in nacks for seq in seqs)
+
+
+def test_lacuna_no_meio_vira_nack_e_reparo_fecha():
+    receptor = ReceptorConfiavel()
+    for seq in (1, 2, 5, 6):
+        assert receptor.aceitar(ORIGEM, SESSAO, seq, b"m%d" % seq)
+    assert faltando(receptor, 1000.0) == [3, 4]
+    assert receptor.aceitar(ORIGEM, SESSAO, 3, b"m3")
+    assert receptor.aceitar(ORIGEM, SESSAO, 4, b"m4")
+    assert faltando(receptor, 1000.0 + PASSO) == []
+    assert receptor.reparadas == 2
+
+
+def test_duplicata_e_descartada():
+    receptor = ReceptorConfiavel()
+    assert receptor.aceitar(ORIGEM, SESSAO, 1, b"m1")
+    assert not receptor.aceitar(ORIGEM, SESSAO, 1, b"m1")
+    receptor.aceitar(ORIGEM, SESSAO, 3, b"m3")
+    assert receptor.aceitar(ORIGEM, SESSAO, 2, b"m2")
+    assert not receptor.aceitar(ORIGEM, SESSAO, 2, b"m2")
+
+
+def test_inicio_da_sessao_perdido_e_pedido():
+    # a primeira mensagem que chega é a 4: as três anteriores são lacuna
+    receptor = ReceptorConfiavel()
+    receptor.aceitar(ORIGEM, SESSAO, 4, b"m4")
+    assert faltando(receptor, 1000.0) == [1, 2, 3]
+
+
+def test_entrada_no_meio_da_sessao_nao_pede_o_passado():
+    # longe do começo, o histórico anterior vem pela sincronização, não por NACK
+    receptor = ReceptorConfiavel()
+    primeiro = JANELA_REORDEM_CONFIAVEL + 50
+    receptor.aceitar(ORIGEM, SESSAO, primeiro, b"m")
+    assert faltando(receptor, 1000.0) == []
+    # mas quem passou à frente por reordenação ainda vale, uma vez
+    assert receptor.aceitar(ORIGEM, SESSAO, primeiro - 1, b"m")
+    assert not receptor.aceitar(ORIGEM, SESSAO, primeiro - 1, b"m")
+    assert not receptor.aceitar(ORIGEM, SESSAO, primeiro - JANELA_REORDEM_CONFIAVEL - 1, b"m")
+
+
+def test_anuncio_revela_perda_na_cauda():
+    receptor = ReceptorConfiavel()
+    receptor.aceitar(ORIGEM, SESSAO, 1, b"m1")
+    receptor.anuncio(ORIGEM, SESSAO, 3)
+    assert faltando(receptor, 1000.0) == [2, 3]
+
+
+def test_anuncio_de_origem_nova_pede_a_sessao_inteira():
+    # todas as mensagens da origem se perderam e só o SEQ_STATUS chegou
+    receptor = ReceptorConfiavel()
+    receptor.anuncio(ORIGEM, SESSAO, 2)
+    assert faltando(receptor, 1000.0) == [1, 2]
+
+
+def test_desiste_depois_de_max_nacks_e_avisa_a_origem():
+    receptor = ReceptorConfiavel()
+    receptor.aceitar(ORIGEM, SESSAO, 1, b"m1")
+    receptor.aceitar(ORIGEM, SESSAO, 3, b"m3")
+    agora = 1000.0
+    pedidos = 0
+    desistiu = set()
+    for _ in range(MAX_NACKS_CONFIAVEL + 1):
+        nacks, desistiu = receptor.pendencias(agora)
+        pedidos += len(nacks)
+        agora += PASSO
+    assert pedidos == MAX_NACKS_CONFIAVEL
+    assert desistiu == {ORIGEM}
+    assert receptor.perdidas == 1
+
+
+def test_nack_respeita_o_intervalo():
+    receptor = ReceptorConfiavel()
+    receptor.aceitar(ORIGEM, SESSAO, 2, b"m2")
+    assert faltando(receptor, 1000.0) == [1]
+    assert faltando(receptor, 1000.0 + INTERVALO_NACK_CONFIAVEL / 2) == []
+
+
+def test_qualquer_receptor_repara_pelo_cache():
+    receptor = ReceptorConfiavel()
+    for seq in (1, 2, 3):
+        receptor.aceitar(ORIGEM, SESSAO, seq, b"m%d" % seq)
+    assert receptor.buscar(ORIGEM, SESSAO, [1, 3, 7]) == [b"m1", b"m3"]
+
+
+def test_emissor_numera_guarda_e_busca():
+    emissor = EmissorConfiavel(retidos=2)
+    for texto in ("a", "b", "c"):
+        msg = Mensagem("CHAT", conteudo={"texto": texto})
+        seq = emissor.numerar(msg)
+        assert msg.seq == [emissor.sessao, seq]
+        emissor.guardar(seq, texto.encode())
+    assert emissor.buscar([1, 2, 3]) == [b"b", b"c"]
+
+
+def test_anuncio_se_repete_com_intervalo_dobrando():
+    emissor = EmissorConfiavel()
+    assert emissor.anuncio_pendente(0.0) is None
+    emissor.numerar(Mensagem("CHAT"))
+    inicio = emissor.ultimo_envio
+    assert emissor.anuncio_pendente(inicio) is None
+    agora = inicio + INTERVALO_ANUNCIO_SEQ
+    intervalos = []
+    for _ in range(12):
+        assert emissor.anuncio_pendente(agora) == 1
+        assert emissor.anuncio_pendente(agora) is None
+        intervalos.append(emissor.intervalo_anuncio)
+        agora = emissor.proximo_anuncio
+    assert intervalos[:2] == [INTERVALO_ANUNCIO_SEQ * 2, INTERVALO_ANUNCIO_SEQ * 4]
+    assert intervalos[-1] == INTERVALO_MAX_ANUNCIO_SEQ
+    # um envio novo volta ao intervalo curto
+    emissor.numerar(Mensagem("CHAT"))
+    assert emissor.intervalo_anuncio == INTERVALO_ANUNCIO_SEQ
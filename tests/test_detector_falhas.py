@@ -0,0 +1,71 @@
+from detector_falhas import DetectorPhiAccrual
+from config import LIMIAR_PHI, TIMEOUT_HEARTBEAT
+
+OCIOSO = 1.0
+
+
+def quando_suspeita(detector, desde, limite=30.0, passo=0.01):
+    # segundos depois da última mensagem até phi passar do limiar
+    t = 0.0
+    while t < limite:
+        if detector.suspeito(desde + t):
+            return t
+        t += passo
+    return None
+
+
+def test_sem_amostras_equivale_ao_timeout_fixo():
+    detector = DetectorPhiAccrual(intervalo_ocioso=OCIOSO)
+    assert detector.phi(0.0) == 0.0
+    detector.registrar(100.0)
+    assert detector.phi(100.0 + TIMEOUT_HEARTBEAT) == LIMIAR_PHI
+    assert not detector.suspeito(100.0 + TIMEOUT_HEARTBEAT * 0.9)
+
+
+def test_heartbeats_regulares_suspeitam_logo_apos_o_intervalo():
+    detector = DetectorPhiAccrual(intervalo_ocioso=OCIOSO)
+    agora = 100.0
+    for i in range(30):
+        agora += OCIOSO + (0.02 if i % 2 else -0.02)
+        detector.registrar(agora)
+    assert detector.phi(agora + 0.5) < 1.0
+    assert 1.0 < quando_suspeita(detector, agora) < 1.5
+
+
+def test_rajada_nao_torna_o_detector_nervoso():
+    # depois de muito tráfego o silêncio normal vai até o heartbeat ocioso
+    detector = DetectorPhiAccrual(intervalo_ocioso=OCIOSO)
+    agora = 100.0
+    for _ in range(50):
+        agora += 0.01
+        detector.registrar(agora)
+    assert not detector.suspeito(agora + OCIOSO)
+    assert quando_suspeita(detector, agora) < 1.5
+
+
+def test_trafego_misturado_usa_o_atraso_dos_silencios_ociosos():
+    # intervalos curtos e longos misturados não alargam a folga; heartbeats
+    # que chegam atrasados, sim
+    def treinar(atraso):
+        detector = DetectorPhiAccrual(intervalo_ocioso=OCIOSO)
+        agora = 100.0
+        for i in range(60):
+            agora += 0.05 if i % 3 else OCIOSO + (atraso if i % 2 else 0.0)
+            detector.registrar(agora)
+        return quando_suspeita(detector, agora)
+
+    pontual = treinar(0.0)
+    atrasado = treinar(0.4)
+    assert pontual < 1.5
+    assert atrasado > pontual + 0.5
+
+
+def test_reiniciar_esquece_o_coordenador_anterior():
+    detector = DetectorPhiAccrual(intervalo_ocioso=OCIOSO)
+    agora = 100.0
+    for _ in range(20):
+        agora += OCIOSO
+        detector.registrar(agora)
+    detector.reiniciar(agora)
+    assert not detector.intervalos and not detector.atrasos_ociosos
+    assert detector.phi(agora + TIMEOUT_HEARTBEAT) == LIMIAR_PHI
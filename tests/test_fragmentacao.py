@@ -0,0 +1,68 @@
+from fragmentacao import Fragmentador, Remontador, eh_fragmento, eh_nack, ler_nack
+from config import INTERVALO_NACK_FRAGMENTOS, MAX_NACKS_FRAGMENTOS
+
+ADDR = ("127.0.0.1", 10001)
+# um pouco além do intervalo, para a conta em ponto flutuante não ficar na borda
+PASSO = INTERVALO_NACK_FRAGMENTOS * 1.01
+
+
+def test_mensagem_pequena_nao_fragmenta():
+    assert Fragmentador(tamanho=100).fragmentar(b"x" * 100) == [b"x" * 100]
+
+
+def test_remonta_fora_de_ordem_uma_vez_so():
+    data = bytes(range(256)) * 10
+    partes = Fragmentador(tamanho=300).fragmentar(data)
+    assert len(partes) == 9 and all(eh_fragmento(p) for p in partes)
+    remontador = Remontador()
+    for parte in reversed(partes[1:]):
+        assert remontador.receber(parte, ADDR) is None
+    assert remontador.receber(partes[0], ADDR, grupo=True) == (data, True)
+    # fragmento atrasado da mensagem já entregue
+    assert remontador.receber(partes[3], ADDR) is None
+
+
+def test_nack_pede_so_o_que_falta_e_retransmissao_completa():
+    data = b"abcdefghij" * 100
+    fragmentador = Fragmentador(tamanho=100)
+    partes = fragmentador.fragmentar(data)
+    remontador = Remontador()
+    perdidos = {2, 5, 9}
+    for i, parte in enumerate(partes):
+        if i not in perdidos:
+            remontador.receber(parte, ADDR, grupo=True)
+    agora = remontador._pendentes[next(iter(remontador._pendentes))].ultimo
+    # ainda chegando: sem NACK
+    assert remontador.pendencias(agora) == []
+    nacks = remontador.pendencias(agora + PASSO)
+    assert len(nacks) == 1
+    addr, nack = nacks[0]
+    assert addr == ADDR and eh_nack(nack)
+    msg_id, indices = ler_nack(nack)
+    assert sorted(indices) == sorted(perdidos)
+    # o reenvio chega por unicast, mas a mensagem completa conta como do grupo
+    resultado = None
+    for parte in fragmentador.retransmitir(msg_id, indices):
+        resultado = remontador.receber(parte, ADDR) or resultado
+    assert resultado == (data, True)
+
+
+def test_nacks_param_depois_do_limite_e_remontagem_expira():
+    partes = Fragmentador(tamanho=10).fragmentar(b"x" * 50)
+    remontador = Remontador(timeout=5.0)
+    remontador.receber(partes[0], ADDR)
+    agora = remontador._pendentes[next(iter(remontador._pendentes))].ultimo
+    enviados = 0
+    for k in range(1, MAX_NACKS_FRAGMENTOS + 3):
+        enviados += len(remontador.pendencias(agora + k * PASSO))
+    assert enviados == MAX_NACKS_FRAGMENTOS
+    remontador.pendencias(agora + 6.0)
+    assert not remontador._pendentes and remontador.descartadas == 1
+
+
+def test_buffer_limitado_descarta_as_mais_antigas():
+    fragmentador = Fragmentador(tamanho=10)
+    remontador = Remontador(max_mensagens=2)
+    for _ in range(3):
+        remontador.receber(fragmentador.fragmentar(b"y" * 30)[0], ADDR)
+    assert len(remontador._pendentes) == 2 and remontador.descartadas == 1
@@ -0,0 +1,89 @@
+import random
+from armazenamento import ArquivoFrio
+from mensagem import HistoricoCompacto, chave_item
+
+
+def item(lamport, origem_id):
+    return {"lamport": lamport, "origem_id": origem_id, "origem_nome": f"No:{origem_id}",
+            "texto": f"{origem_id}/{lamport}", "ts_real": 1.0, "ts_berkeley": 1.0}
+
+
+def historico(max_mensagens=60, tamanho_segmento=16):
+    return HistoricoCompacto(frio=ArquivoFrio(None), max_mensagens=max_mensagens, max_bytes=None,
+                             max_idade=None, tamanho_segmento=tamanho_segmento)
+
+
+def test_retencao_confere_com_um_modelo_simples():
+    # inserções fora de ordem e repetidas, contra um dict ordenado pela chave
+    aleatorio = random.Random(7)
+    h = historico()
+    modelo = {}
+    for _ in range(40):
+        lote = [item(aleatorio.randrange(400), aleatorio.randrange(4)) for _ in range(aleatorio.randrange(1, 15))]
+        if aleatorio.random() < 0.5:
+            novos = sum(h.adiciona(i["lamport"], i["origem_id"], i["origem_nome"], i["texto"], 1.0) for i in lote)
+        else:
+            novos = h.estende(lote)
+        esperados = {chave_item(i) for i in lote} - set(modelo)
+        assert novos == len(esperados)
+        for i in lote:
+            modelo.setdefault(chave_item(i), i)
+        assert len(h) == len(modelo)
+        assert h.retencao()["quentes"] <= 60
+    lista = h.to_list()
+    assert [chave_item(i) for i in lista] == sorted(modelo)
+    assert [i["texto"] for i in lista] == [modelo[chave]["texto"] for chave in sorted(modelo)]
+    assert h.retencao()["frios_mensagens"] > 0
+    assert all(h.contem(i["lamport"], i["origem_id"]) for i in modelo.values())
+    h.frio.fechar()
+
+
+def test_faltantes_pelo_resumo_inclui_a_parte_fria():
+    completo = historico()
+    completo.estende([item(lamport, origem) for origem in (1, 2, 3) for lamport in range(1, 101)])
+    # o outro lado tem o começo de cada origem, parte dele já fria deste lado
+    parcial = historico(max_mensagens=None)
+    parcial.estende([item(lamport, origem) for origem, ate in ((1, 30), (2, 80)) for lamport in range(1, ate + 1)])
+    faltantes = completo.faltantes(parcial.resumo())
+    esperado = sorted(chave_item(item(lamport, origem)) for origem, ate in ((1, 30), (2, 80), (3, 0))
+                      for lamport in range(ate + 1, 101))
+    assert [chave_item(i) for i in faltantes] == esperado
+    # em lotes limitados, sem perder nem repetir nada
+    lotes = list(completo.lotes_faltantes(parcial.resumo(), tamanho=25))
+    assert all(len(lote) <= 25 for lote in lotes)
+    assert sorted(chave_item(i) for lote in lotes for i in lote) == esperado
+    parcial.estende(faltantes)
+    assert parcial.resumo() == completo.resumo()
+    assert completo.faltantes(parcial.resumo()) == []
+    completo.frio.fechar()
+    parcial.frio.fechar()
+
+
+def test_resumo_com_buracos_reenvia_a_origem():
+    completo = historico(max_mensagens=None)
+    completo.estende([item(lamport, 1) for lamport in range(1, 21)])
+    buracos = historico(max_mensagens=None)
+    buracos.estende([item(lamport, 1) for lamport in range(1, 21) if lamport != 5])
+    faltantes = completo.faltantes(buracos.resumo())
+    assert 5 in [i["lamport"] for i in faltantes]
+
+
+def test_falha_ao_gravar_segmento_mantem_as_mensagens_quentes():
+    h = historico(max_mensagens=20, tamanho_segmento=10)
+
+    def falhar(itens):
+        raise OSError("disco cheio")
+
+    gravar = h.frio.escrever
+    h.frio.escrever = falhar
+    h.estende([item(lamport, 1) for lamport in range(1, 41)])
+    assert len(h) == 40
+    assert h.retencao()["quentes"] == 40
+    assert [i["lamport"] for i in h.to_list()] == list(range(1, 41))
+    # passada a espera, o próximo despejo grava normalmente
+    h.frio.escrever = gravar
+    h._falha_frio = None
+    h.adiciona(41, 1, "No:1", "41", 1.0)
+    assert h.retencao()["quentes"] <= 20
+    assert [i["lamport"] for i in h.to_list()] == list(range(1, 42))
+    h.frio.fechar()
@@ -0,0 +1,70 @@
+import pytest
+import simulacao
+from agendador import Agendador
+from recepcao import FilaRecepcao
+from transporte import RedeSimulada
+
+TIMEOUT = 20.0
+
+
+@pytest.fixture
+def cluster():
+    rede = RedeSimulada(latencia=0.001, variacao=0.0005, perda=0.0, banda=0, semente=3)
+    agendador = Agendador(trabalhadores=4)
+    agendador.iniciar()
+    recepcao = FilaRecepcao(trabalhadores=4, politica="bloquear")
+    recepcao.iniciar()
+    nos = []
+
+    def criar(n):
+        novos = []
+        for _ in range(n):
+            no = simulacao.criar_no(rede, agendador, recepcao, len(nos) + 1, "bully")
+            if not nos:
+                no.tornar_coordenador_inicial()
+            else:
+                no.entrar_na_rede(esperar=False)
+            nos.append(no)
+            novos.append(no)
+        assert simulacao.esperar(lambda: all(no.id is not None for no in nos), TIMEOUT) is not None
+        return novos
+
+    yield rede, criar
+    for no in nos:
+        simulacao.derrubar(no)
+        no._parar_servicos()
+    agendador.parar()
+    recepcao.parar()
+    rede.parar()
+
+
+def textos(no):
+    return [(item["lamport"], item["origem_id"], item["texto"]) for item in no.historico.to_list()]
+
+
+def test_rajada_com_perda_chega_inteira_a_todos(cluster):
+    rede, criar = cluster
+    nos = criar(4)
+    # perda só depois da entrada: o que se mede é o reparo do multicast confiável
+    rede.perda = 0.1
+    for k in range(200):
+        nos[k % 4].enviar_chat(f"m{k}")
+    assert simulacao.esperar(lambda: all(len(no.historico) >= 200 for no in nos), TIMEOUT) is not None
+    rede.perda = 0.0
+    assert all(textos(no) == textos(nos[0]) for no in nos[1:])
+    assert sum(no.receptor.reparadas for no in nos) > 0
+
+
+def test_quem_chega_depois_recebe_o_historico_em_lotes(cluster):
+    rede, criar = cluster
+    nos = criar(3)
+    for no in nos:
+        no.historico.max_mensagens = 300
+        no.historico.tamanho_segmento = 100
+    for k in range(1500):
+        nos[k % 3].enviar_chat(f"m{k}")
+    assert simulacao.esperar(lambda: all(len(no.historico) >= 1500 for no in nos), TIMEOUT) is not None
+    assert nos[0].historico.retencao()["frios_mensagens"] > 0
+    atrasado, = criar(1)
+    assert simulacao.esperar(lambda: len(atrasado.historico) >= 1500, TIMEOUT) is not None
+    assert textos(atrasado) == textos(nos[0])
@@ -0,0 +1,101 @@
+import threading
+import time
+from swim import MembrosSwim, VIVO, SUSPEITO, MORTO
+from codec import codificar, decodificar, CODEC_JSON, CODECS_SUPORTADOS
+from mensagem import Mensagem
+from config import PERIODO_SWIM, INTERVALO_PASSO_SWIM
+
+
+class NoFalso:
+    # só o que o MembrosSwim usa do No; os envios vão para a fila do grupo
+    def __init__(self, grupo, pid):
+        self.grupo = grupo
+        self.id = pid
+        self.addr = ("127.0.0.1", 30000 + pid)
+        self.nome = f"F{pid}"
+        self.peers = {}
+        self.lock_peers = threading.Lock()
+        self.lamport = 0
+        self.swim = MembrosSwim(self)
+
+    def incrementa_lamport(self):
+        self.lamport += 1
+        return self.lamport
+
+    def unicast_enviar(self, addr, msg):
+        self.grupo.fila.append((tuple(addr), codificar(msg, CODEC_JSON)))
+
+
+class Grupo:
+    def __init__(self, n):
+        self.fila = []
+        self.nos = {pid: NoFalso(self, pid) for pid in range(1, n + 1)}
+        self.caidos = set()
+        tabela = {pid: {"addr": no.addr, "nome": no.nome, "codecs": CODECS_SUPORTADOS} for pid, no in self.nos.items()}
+        for no in self.nos.values():
+            no.peers = {pid: dict(info) for pid, info in tabela.items() if pid != no.id}
+            no.swim.conhecer(tabela)
+        self.agora = time.time()
+
+    def entregar(self):
+        por_addr = {no.addr: no for no in self.nos.values()}
+        while self.fila:
+            addr, data = self.fila.pop(0)
+            no = por_addr[addr]
+            if no.id not in self.caidos:
+                no.swim.tratar(decodificar(data))
+
+    def rodar(self, segundos):
+        fim = self.agora + segundos
+        while self.agora < fim:
+            self.agora += INTERVALO_PASSO_SWIM
+            for no in self.nos.values():
+                if no.id not in self.caidos:
+                    no.swim.passo(self.agora)
+            self.entregar()
+
+    def estado(self, de, pid):
+        return self.nos[de].swim.membros[pid].estado
+
+
+def test_membro_caido_vira_morto_em_todos():
+    grupo = Grupo(5)
+    grupo.rodar(5 * PERIODO_SWIM)
+    grupo.caidos.add(5)
+    grupo.rodar(40 * PERIODO_SWIM)
+    for pid in (1, 2, 3, 4):
+        assert grupo.estado(pid, 5) == MORTO
+        assert 5 not in grupo.nos[pid].peers
+        # ninguém vivo foi condenado junto
+        assert all(grupo.estado(pid, outro) == VIVO for outro in (1, 2, 3, 4) if outro != pid)
+
+
+def test_suspeita_falsa_e_refutada_com_incarnacao_maior():
+    grupo = Grupo(3)
+    boato = [2, SUSPEITO, 0, list(grupo.nos[2].addr), "F2", CODECS_SUPORTADOS]
+    ping = Mensagem("PING", origem_id=3, origem_addr=grupo.nos[3].addr, origem_nome="F3",
+                    conteudo={"seq": 1, "boatos": [boato]})
+    grupo.nos[1].swim.tratar(ping)
+    grupo.nos[2].swim.tratar(ping)
+    assert grupo.estado(1, 2) == SUSPEITO
+    assert grupo.nos[2].swim.incarnacao == 1
+    grupo.rodar(10 * PERIODO_SWIM)
+    assert grupo.estado(1, 2) == VIVO
+    assert grupo.nos[1].swim.membros[2].incarnacao == 1
+    assert 2 in grupo.nos[1].peers
+
+
+def test_sondagem_indireta_salva_membro_com_enlace_ruim():
+    # 1 não fala direto com 4, mas os outros falam: PING_REQ evita a suspeita
+    grupo = Grupo(4)
+    entregar = grupo.entregar
+    cortado = {grupo.nos[1].addr, grupo.nos[4].addr}
+
+    def sem_enlace():
+        grupo.fila = [(addr, data) for addr, data in grupo.fila
+                      if {addr, tuple(decodificar(data).origem_addr)} != cortado]
+        entregar()
+
+    grupo.entregar = sem_enlace
+    grupo.rodar(30 * PERIODO_SWIM)
+    assert grupo.estado(1, 4) == VIVO
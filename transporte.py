@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from config import *
+
+GRUPO = (GRUPO_MULTICAST, PORTA_MULTICAST)
+
+
+def estatisticas_socket_kernel(sock):
+    # fila e descartes do socket no kernel, do /proc/net/udp (só Linux; None nos outros)
+    try:
+        inode = os.fstat(sock.fileno()).st_ino
+        with open("/proc/net/udp") as f:
+            next(f)
+            for linha in f:
+                campos = linha.split()
+                if int(campos[9]) == inode:
+                    return {"fila_bytes": int(campos[4].split(":")[1], 16), "descartes": int(campos[12])}
+    except (OSError, ValueError, IndexError, StopIteration):
+        pass
+    return None
+
+
+class TransporteUDP:
+    # os sockets reais do nó: unicast (por onde tudo sai) e o do grupo multicast
+    def __init__(self, ip, porta, rcvbuf=TAMANHO_RCVBUF, sndbuf=TAMANHO_SNDBUF):
+        self.addr = (ip, porta)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        efetivo = ajustar_buffers_socket(self.sock, rcvbuf, sndbuf)
+        self.sock.bind(self.addr)
+        self.msock = criar_socket_multicast(endereco_bind=ip, porta=PORTA_MULTICAST, rcvbuf=rcvbuf, sndbuf=sndbuf)
+        # o Linux informa o dobro do que reserva: menos que o pedido indica o teto do rmem_max
+        if rcvbuf and sys.platform.startswith("linux") and efetivo < rcvbuf * 2:
+            print(f"[WARN] SO_RCVBUF limitado a {efetivo // 2} bytes (pedido {rcvbuf}); "
+                  f"aumente net.core.rmem_max para evitar descartes")
+        self.ativo = False
+        self.erros_envio = 0
+        self.erros_recepcao = 0
+
+    def enviar(self, data, destino):
+        try:
+            self.sock.sendto(data, destino)
+        except OSError:
+            self.erros_envio += 1
+            raise
+
+    def iniciar(self, ao_receber_unicast, ao_receber_grupo):
+        self.ativo = True
+        for sock, tratar, nome in ((self.msock, ao_receber_grupo, "listener_multicast"),
+                                   (self.sock, ao_receber_unicast, "listener_unicast")):
+            threading.Thread(target=self._escutar, args=(sock, tratar, nome), daemon=True, name=nome).start()
+
+    def _escutar(self, sock, tratar, nome):
+        # recvfrom simples: no CPython o bytes de TAMANHO_BUFFER é alocado e
+        # encolhido mais rápido do que recvfrom_into num buffer reaproveitado
+        # mais o memoryview; o que evita descartes é o SO_RCVBUF
+        while self.ativo:
+            try:
+                data, addr = sock.recvfrom(TAMANHO_BUFFER)
+            except OSError as e:
+                if self.ativo:
+                    self.erros_recepcao += 1
+                    print(f"[ERROR] erro {nome}: {e}")
+                continue
+            try:
+                tratar(data, addr)
+            except Exception as e:
+                if self.ativo:
+                    print(f"[ERROR] erro {nome}: {e}")
+
+    def estatisticas_kernel(self):
+        # socket -> fila no kernel, descartes por fila cheia e SO_RCVBUF efetivo
+        estatisticas = {}
+        for sock, nome in ((self.sock, "unicast"), (self.msock, "multicast")):
+            dados = estatisticas_socket_kernel(sock)
+            if dados is None:
+                continue
+            try:
+                dados["rcvbuf"] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            except OSError:
+                continue
+            estatisticas[nome] = dados
+        return estatisticas
+
+    def fechar(self):
+        self.ativo = False
+        for sock in (self.msock, self.sock):
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+
+class TransporteSimulado:
+    # ponta de um nó na RedeSimulada; mesma interface do TransporteUDP
+    def __init__(self, rede, addr):
+        self.rede = rede
+        self.addr = addr
+        self.ativo = False
+        self._ao_receber_unicast = None
+        self._ao_receber_grupo = None
+        self.erros_envio = 0
+        self.erros_recepcao = 0
+
+    def enviar(self, data, destino):
+        if not self.ativo:
+            self.erros_envio += 1
+            raise OSError("transporte fechado")
+        self.rede.transmitir(self.addr, data, tuple(destino))
+
+    def iniciar(self, ao_receber_unicast, ao_receber_grupo):
+        self._ao_receber_unicast = ao_receber_unicast
+        self._ao_receber_grupo = ao_receber_grupo
+        self.ativo = True
+
+    def entregar(self, data, origem, grupo):
+        if not self.ativo:
+            return
+        tratar = self._ao_receber_grupo if grupo else self._ao_receber_unicast
+        try:
+            tratar(data, origem)
+        except Exception as e:
+            if self.ativo:
+                print(f"[ERROR] erro {'listener_multicast' if grupo else 'listener_unicast'}: {e}")
+
+    def estatisticas_kernel(self):
+        return {}
+
+    def fechar(self):
+        self.ativo = False
+        self.rede.desconectar(self.addr)
+
+
+class RedeSimulada:
+    # rede em memória para rodar centenas de nós num processo: cada datagrama
+    # chega depois da latência (mais o tempo de transmissão pela banda do
+    # emissor), pode ser perdido, e o que vai ao grupo é copiado a todos os
+    # membros; um único thread entrega, chamando os handlers dos nós. Com
+    # variação na latência, datagramas do mesmo par podem chegar fora de ordem
+    def __init__(self, latencia=LATENCIA_SIMULADA, variacao=VARIACAO_LATENCIA_SIMULADA,
+                 perda=PERDA_SIMULADA, banda=BANDA_SIMULADA, semente=None):
+        self.latencia = latencia
+        self.variacao = variacao
+        self.perda = perda
+        # bytes por segundo no enlace de saída de cada nó; 0 = sem limite
+        self.banda = banda
+        self.aleatorio = random.Random(semente)
+        self._membros = {}
+        # addr -> instante em que o enlace de saída do nó fica livre
+        self._livre = {}
+        self._fila = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.enviados = 0
+        self.entregues = 0
+        self.perdidos = 0
+        self.bytes = 0
+        self._rodando = True
+        threading.Thread(target=self._entregar, daemon=True, name="rede-simulada").start()
+
+    def conectar(self, addr):
+        addr = tuple(addr)
+        with self._cond:
+            if addr in self._membros:
+                raise OSError(f"endereço {addr} já em uso")
+            transporte = TransporteSimulado(self, addr)
+            self._membros[addr] = transporte
+        return transporte
+
+    def desconectar(self, addr):
+        with self._cond:
+            self._membros.pop(tuple(addr), None)
+
+    def transmitir(self, origem, data, destino):
+        agora = time.monotonic()
+        with self._cond:
+            saida = agora
+            if self.banda:
+                # o datagrama só sai quando o anterior do mesmo nó terminou de sair
+                saida = max(agora, self._livre.get(origem, agora)) + len(data) / self.banda
+                self._livre[origem] = saida
+            grupo = destino == GRUPO
+            if grupo:
+                # como no IP_MULTICAST_LOOP, o próprio emissor também recebe
+                alvos = list(self._membros.values())
+            else:
+                alvo = self._membros.get(destino)
+                alvos = [alvo] if alvo is not None else []
+            self.bytes += len(data)
+            for alvo in alvos:
+                self.enviados += 1
+                if self.perda and self.aleatorio.random() < self.perda:
+                    self.perdidos += 1
+                    continue
+                prazo = saida + self.latencia + self.aleatorio.uniform(0, self.variacao)
+                heapq.heappush(self._fila, (prazo, next(self._seq), alvo, data, origem, grupo))
+            self._cond.notify()
+
+    def _entregar(self):
+        while True:
+            with self._cond:
+                while self._rodando:
+                    agora = time.monotonic()
+                    if self._fila and self._fila[0][0] <= agora:
+                        break
+                    self._cond.wait(self._fila[0][0] - agora if self._fila else None)
+                if not self._rodando:
+                    return
+                _, _, alvo, data, origem, grupo = heapq.heappop(self._fila)
+                self.entregues += 1
+            alvo.entregar(data, origem, grupo)
+
+    def pendentes(self):
+        with self._cond:
+            return len(self._fila)
+
+    def parar(self):
+        with self._cond:
+            self._rodando = False
+            self._cond.notify()
+
+    def estatisticas(self):
+        with self._cond:
+            return {"membros": len(self._membros), "enviados": self.enviados, "entregues": self.entregues,
+                    "perdidos": self.perdidos, "bytes": self.bytes, "na_fila": len(self._fila)}